@@ -11,7 +11,8 @@ class BiClassifier(binode.BiNode, mdp.ClassifierNode):
     """
 
     def _execute(self, x, return_labels=None, return_probs=None,
-                 return_ranks=None):
+                 return_ranks=None, return_label_codes=None,
+                 return_prob_matrix=None):
         """Return the unaltered x and classification results when requested.
 
         return_labels -- If True then the 'label' method is called on the x
@@ -20,23 +21,25 @@ def _execute(self, x, return_labels=None, return_probs=None,
             'labels' key of the result.
         return_probs, return_ranks -- Work like return_labels, but the results
             are stored under the key 'probs' and 'ranks'.
+        return_label_codes, return_prob_matrix -- Work like return_labels,
+            but the (array, labels) tuples returned by the 'label_codes' and
+            'prob_matrix' methods are stored under the keys 'label_codes' and
+            'prob_matrix'. These avoid building Python objects for each
+            data point.
         """
         msg = {}
-        if return_labels:
-            if not isinstance(return_labels, str):
-                msg["labels"] = self.label(x)
-            else:
-                msg[return_labels + "labels"] = self.label(x)
-        if return_probs:
-            if not isinstance(return_probs, str):
-                msg["probs"] = self.prob(x)
-            else:
-                msg[return_probs + "probs"] = self.prob(x)
-        if return_ranks:
-            if not isinstance(return_ranks, str):
-                msg["ranks"] = self.rank(x)
-            else:
-                msg[return_ranks + "ranks"] = self.rank(x)
+        for request, key, method in (
+                            (return_labels, "labels", self.label),
+                            (return_probs, "probs", self.prob),
+                            (return_ranks, "ranks", self.rank),
+                            (return_label_codes, "label_codes",
+                             self.label_codes),
+                            (return_prob_matrix, "prob_matrix",
+                             self.prob_matrix)):
+            if request:
+                if isinstance(request, str):
+                    key = request + key
+                msg[key] = method(x)
         if msg:
             return x, msg
         else:
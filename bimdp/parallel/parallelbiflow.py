@@ -530,7 +530,9 @@ def use_results(self, results):
         results -- Iterable containing the results, normally the return value
             of scheduler.ResultContainer.get_results().
             The individual results can be the return values of the tasks.
+            If a task failed then a ParallelFlowException is raised.
         """
+        parallel._check_results(results)
         if self.is_parallel_training:
             for result in results:
                 self._flownode.join(result)
@@ -277,6 +277,18 @@ def test_autogen_biclassifier(self):
         assert result[0] is x
         assert result[1]["labels"].tolist() == [-1, 1]
 
+    def test_biclassifier_arrays(self):
+        """Test that the label codes and probability arrays are returned."""
+        node = SignumBiClassifier()
+        msg = {"return_label_codes": True,
+               "return_prob_matrix": "test->"}
+        x = n.array([[1, 2, -3, -4], [1, 2, 3, 4]])
+        # SignumClassifier has no probabilities
+        py.test.raises(NotImplementedError, node.execute, x, msg)
+        del msg["return_prob_matrix"]
+        codes, labels = node.execute(x, msg)[1]["label_codes"]
+        assert [labels[code] for code in codes] == [-1, 1]
+
 
 class TestIdentityBiNode(object):
 
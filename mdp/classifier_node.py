@@ -1,6 +1,7 @@
+from __future__ import with_statement
+
 import mdp
 from mdp import PreserveDimNode, numx, VariadicCumulator
-import operator
 
 
 class ClassifierNode(PreserveDimNode):
@@ -28,11 +29,62 @@ def __init__(self, execute_method=None,
 
     ### Methods to be implemented by the subclasses
 
-    def _label(self, x, *args, **kargs):
-        raise NotImplementedError
-
-    def _prob(self, x, *args, **kargs):
-        raise NotImplementedError
+    # A subclass should overwrite at least one of _label and _label_codes,
+    # and optionally one of _prob and _prob_matrix. The array methods
+    # avoid building Python objects for each data point, so they are
+    # preferred; the missing methods are derived from the implemented ones.
+
+    def _label(self, x, *args, **kwargs):
+        if not self._is_overwritten('_label_codes', '_prob_matrix'):
+            raise NotImplementedError
+        codes, labels = self._label_codes(x, *args, **kwargs)
+        return [labels[code] for code in codes]
+
+    def _prob(self, x, *args, **kwargs):
+        if not self._is_overwritten('_prob_matrix'):
+            raise NotImplementedError
+        probs, labels = self._prob_matrix(x, *args, **kwargs)
+        # leave out the probabilities which are not defined (nan)
+        complete = ~numx.isnan(probs).any(axis=1)
+        return [dict(zip(labels, prob)) if is_complete else
+                dict((label, p) for label, p in zip(labels, prob) if p == p)
+                for prob, is_complete in zip(probs, complete)]
+
+    def _label_codes(self, x, *args, **kwargs):
+        if self._is_overwritten('_prob_matrix'):
+            probs, labels = self._prob_matrix(x, *args, **kwargs)
+            return probs.argmax(axis=1), labels
+        if not self._is_overwritten('_label'):
+            raise NotImplementedError
+        labels, codes = numx.unique(numx.asarray(self._label(x, *args,
+                                                             **kwargs)),
+                                    return_inverse=True)
+        return codes, list(labels)
+
+    def _prob_matrix(self, x, *args, **kwargs):
+        if not self._is_overwritten('_prob'):
+            raise NotImplementedError
+        probs = self._prob(x, *args, **kwargs)
+        labels = []
+        codes = {}
+        for prob in probs:
+            for label in prob:
+                if label not in codes:
+                    codes[label] = len(labels)
+                    labels.append(label)
+        # labels without a probability for a data point are set to nan
+        prob_matrix = numx.empty((len(probs), len(labels)))
+        prob_matrix.fill(numx.nan)
+        for i, prob in enumerate(probs):
+            for label, p in prob.iteritems():
+                prob_matrix[i, codes[label]] = p
+        return prob_matrix, labels
+
+    def _is_overwritten(self, *names):
+        """Return True if a subclass overwrites one of the given methods."""
+        cls = self.__class__
+        return any(getattr(cls, name) != getattr(ClassifierNode, name)
+                   for name in names)
 
     ### User interface to the overwritten methods
 
@@ -57,6 +109,27 @@ def prob(self, x, *args, **kwargs):
         self._pre_execution_checks(x)
         return self._prob(self._refcast(x), *args, **kwargs)
 
+    def label_codes(self, x, *args, **kwargs):
+        """Returns a tuple (codes, labels), where codes is an integer array
+        with the index in the list labels of the best class for each
+        datapoint (e.g., (array([2, 0, ...]), [1, 2, 3])).
+
+        This is the array version of 'label'.
+        """
+        self._pre_execution_checks(x)
+        return self._label_codes(self._refcast(x), *args, **kwargs)
+
+    def prob_matrix(self, x, *args, **kwargs):
+        """Returns a tuple (probs, labels), where probs is an array with
+        one row for each datapoint and one column for each class in the
+        list labels (e.g., (array([[0.1, 0.0, 0.9], ...]), [1, 2, 3])).
+
+        This is the array version of 'prob'. Probabilities which are not
+        defined by the classifier are set to nan.
+        """
+        self._pre_execution_checks(x)
+        return self._prob_matrix(self._refcast(x), *args, **kwargs)
+
     def rank(self, x, threshold=None):
         """Returns ordered list with all labels ordered according to prob(x)
         (e.g., [[3 1 2], [2 1 3], ...]).
@@ -65,17 +138,15 @@ def rank(self, x, threshold=None):
         or less probability. E.g. threshold=0 excludes all labels with zero
         probability.
         """
-        all_ranking = []
-        prob = self.prob(x)
-        for p in prob:
-            if threshold is None:
-                ranking = p.items()
-            else:
-                ranking = ((k, v) for k, v in p.items() if v > threshold)
-            result = [k for k, v in
-                      sorted(ranking, key=operator.itemgetter(1), reverse=True)]
-            all_ranking.append(result)
-        return all_ranking
+        probs, labels = self.prob_matrix(x)
+        labels = numx.asarray(labels, dtype=object)
+        order = (-probs).argsort(axis=1, kind='mergesort')
+        sorted_probs = probs[numx.arange(len(probs))[:, numx.newaxis], order]
+        valid = ~numx.isnan(sorted_probs)
+        if threshold is not None:
+            with numx.errstate(invalid='ignore'):
+                valid &= sorted_probs > threshold
+        return [list(labels[row[mask]]) for row, mask in zip(order, valid)]
     
     def _execute(self, x):
         if not self.execute_method:
@@ -28,7 +28,7 @@
 """
 
 from flownode import FlowNode
-from layer import Layer, SameInputLayer, CloneLayer
+from layer import Layer, SameInputLayer, CloneLayer, Rectangular2dCloneLayer
 from switchboard import (
     Switchboard, SwitchboardException, MeanInverseSwitchboard,
     ChannelSwitchboard,
@@ -46,6 +46,7 @@
 )
 
 __all__ = ['FlowNode', 'Layer', 'SameInputLayer', 'CloneLayer',
+           'Rectangular2dCloneLayer',
            'Switchboard', 'SwitchboardException', 'ChannelSwitchboard',
            'Rectangular2dSwitchboard', 'Rectangular2dSwitchboardException',
            'DoubleRect2dSwitchboard', 'DoubleRect2dSwitchboardException',
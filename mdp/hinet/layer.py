@@ -5,9 +5,29 @@
 supported.
 """
 
+import os
+from multiprocessing import cpu_count
+
 import mdp
 from mdp import numx
 
+# environment variables which set the number of threads used by BLAS
+_BLAS_THREADS_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                           'MKL_NUM_THREADS')
+
+# maximum number of entries in the blocks of fields which are processed
+# at once by Rectangular2dCloneLayer
+_FIELD_BLOCK_SIZE = 2**22
+
+def _blas_threads():
+    """Return the number of BLAS threads set in the environment, or None."""
+    for variable in _BLAS_THREADS_VARIABLES:
+        try:
+            return max(1, int(os.environ[variable]))
+        except (KeyError, ValueError):
+            pass
+    return None
+
 # TODO: maybe turn self.nodes into a read only property with self._nodes
 
 # TODO: Find a better way to deal with additional args for train/execute?
@@ -27,9 +47,13 @@ class Layer(mdp.Node):
     Since they are nodes themselves layers can be stacked in a flow (e.g. to
     build a layered network). If one would like to use flows instead of nodes
     inside of a layer one can use a FlowNode.
+
+    The internal nodes can be trained and executed by a pool of threads
+    (see the n_threads argument). This pays off when the nodes spend their
+    time in NumPy/BLAS routines, which release the GIL.
     """
 
-    def __init__(self, nodes, dtype=None):
+    def __init__(self, nodes, dtype=None, n_threads=1):
         """Setup the layer with the given list of nodes.
 
         The input and output dimensions for the nodes must be already set
@@ -38,8 +62,14 @@ def __init__(self, nodes, dtype=None):
 
         Keyword arguments:
         nodes -- List of the nodes to be used.
+        n_threads -- Number of threads used to train and execute the nodes
+            (the nodes must be distinct instances). If the number of BLAS
+            threads is set in the environment (e.g. with OMP_NUM_THREADS),
+            at most cpu_count // blas_threads threads are used so that the
+            cores are not oversubscribed.
         """
         self.nodes = nodes
+        self.n_threads = n_threads
         # check nodes properties and get the dtype
         dtype = self._check_props(dtype)
         # calculate the the dimensions
@@ -133,21 +163,47 @@ def _get_train_seq(self):
                 max_train_length = node_length
         return ([[self._train, self._stop_training]] * max_train_length)
 
+    def _n_workers(self, n_tasks):
+        """Return the number of threads to use for n_tasks tasks."""
+        n_workers = min(self.n_threads, n_tasks)
+        blas_threads = _blas_threads()
+        if blas_threads is not None:
+            n_workers = min(n_workers, max(1, cpu_count() // blas_threads))
+        return n_workers
+
+    def _map_nodes(self, func, tasks):
+        """Apply func to each task, in a thread pool if requested.
+
+        The results are returned in the order of the tasks.
+        """
+        tasks = list(tasks)
+        return mdp.utils.thread_map(func, tasks, self._n_workers(len(tasks)))
+
+    def _node_slices(self, dim_attr):
+        """Return a list with the (start, stop) indices of each node, for the
+        given dimension attribute ('input_dim' or 'output_dim')."""
+        slices = []
+        stop = 0
+        for node in self.nodes:
+            start = stop
+            stop += getattr(node, dim_attr)
+            slices.append((start, stop))
+        return slices
+
     def _train(self, x, *args, **kwargs):
         """Perform single training step by training the internal nodes."""
-        start_index = 0
-        stop_index = 0
-        for node in self.nodes:
-            start_index = stop_index
-            stop_index += node.input_dim
-            if node.is_training():
-                node.train(x[:, start_index : stop_index], *args, **kwargs)
+        def train_node(task):
+            node, (start_index, stop_index) = task
+            node.train(x[:, start_index : stop_index], *args, **kwargs)
+        self._map_nodes(train_node,
+                        [task for task in zip(self.nodes,
+                                              self._node_slices('input_dim'))
+                         if task[0].is_training()])
 
     def _stop_training(self, *args, **kwargs):
         """Stop training of the internal nodes."""
-        for node in self.nodes:
-            if node.is_training():
-                node.stop_training(*args, **kwargs)
+        self._map_nodes(lambda node: node.stop_training(*args, **kwargs),
+                        [node for node in self.nodes if node.is_training()])
         if self.output_dim is None:
             self.output_dim = self._get_output_dim_from_nodes()
 
@@ -167,50 +223,43 @@ def _pre_execution_checks(self, x):
                 raise mdp.NodeException(err)
         super(Layer, self)._pre_execution_checks(x)
 
+    def _combine(self, method, x, in_slices, out_slices, out_dim,
+                 *args, **kwargs):
+        """Call the given method of each node on its part of x and combine
+        the results.
+
+        method -- Name of the node method ('execute' or 'inverse').
+        in_slices, out_slices -- Lists with the (start, stop) indices of the
+            nodes in x and in the result.
+        """
+        # the first node determines the dtype of the result
+        in_start, in_stop = in_slices[0]
+        out_start, out_stop = out_slices[0]
+        node_y = getattr(self.nodes[0], method)(x[:, in_start:in_stop],
+                                                *args, **kwargs)
+        y = numx.zeros([node_y.shape[0], out_dim], dtype=node_y.dtype)
+        y[:, out_start:out_stop] = node_y
+        def process_node(task):
+            node, (in_start, in_stop), (out_start, out_stop) = task
+            # each node writes into its own columns of y
+            y[:, out_start:out_stop] = getattr(node, method)(
+                                x[:, in_start:in_stop], *args, **kwargs)
+        self._map_nodes(process_node, zip(self.nodes[1:], in_slices[1:],
+                                          out_slices[1:]))
+        return y
+
     def _execute(self, x, *args, **kwargs):
         """Process the data through the internal nodes."""
-        in_start = 0
-        in_stop = 0
-        out_start = 0
-        out_stop = 0
-        y = None
-        for node in self.nodes:
-            out_start = out_stop
-            out_stop += node.output_dim
-            in_start = in_stop
-            in_stop += node.input_dim
-            if y is None:
-                node_y = node.execute(x[:,in_start:in_stop], *args, **kwargs)
-                y = numx.zeros([node_y.shape[0], self.output_dim],
-                               dtype=node_y.dtype)
-                y[:,out_start:out_stop] = node_y
-            else:
-                y[:,out_start:out_stop] = node.execute(x[:,in_start:in_stop],
-                                                        *args, **kwargs)
-        return y
+        return self._combine('execute', x, self._node_slices('input_dim'),
+                             self._node_slices('output_dim'),
+                             self.output_dim, *args, **kwargs)
 
     def _inverse(self, x, *args, **kwargs):
         """Combine the inverse of all the internal nodes."""
-        in_start = 0
-        in_stop = 0
-        out_start = 0
-        out_stop = 0
-        y = None
-        for node in self.nodes:
-            # compared with execute, input and output are switched
-            out_start = out_stop
-            out_stop += node.input_dim
-            in_start = in_stop
-            in_stop += node.output_dim
-            if y is None:
-                node_y = node.inverse(x[:,in_start:in_stop], *args, **kwargs)
-                y = numx.zeros([node_y.shape[0], self.input_dim],
-                               dtype=node_y.dtype)
-                y[:,out_start:out_stop] = node_y
-            else:
-                y[:,out_start:out_stop] = node.inverse(x[:,in_start:in_stop],
-                                                        *args, **kwargs)
-        return y
+        # compared with execute, input and output are switched
+        return self._combine('inverse', x, self._node_slices('output_dim'),
+                             self._node_slices('input_dim'),
+                             self.input_dim, *args, **kwargs)
 
     ## container methods ##
 
@@ -238,17 +287,58 @@ class CloneLayer(Layer):
     A CloneLayer can be used for weight sharing in the training phase. It might
     be also useful for reducing the memory footprint use during the execution
     phase (since only a single node instance is needed).
+
+    In batched mode the node is called only once for all the clones. For
+    execution (and inversion) the input is reshaped into a matrix with
+    n_samples * n_nodes rows, so the node must process each row
+    independently. For training the data of the clones is stacked one clone
+    after the other, so a node that looks at consecutive rows (e.g. the
+    time derivative in SFANode) sees n_nodes-1 additional transitions
+    between the clones in each chunk.
     """
 
-    def __init__(self, node, n_nodes=1, dtype=None):
+    def __init__(self, node, n_nodes=1, dtype=None, batched=False):
         """Setup the layer with the given list of nodes.
 
         Keyword arguments:
         node -- Node to be cloned.
         n_nodes -- Number of repetitions/clones of the given node.
+        batched -- If True, call the node once for all the clones, which
+            turns many small operations into one large one (see the class
+            docstring for the requirements).
         """
         super(CloneLayer, self).__init__((node,) * n_nodes, dtype=dtype)
         self.node = node  # attribute for convenience
+        self.batched = batched
+
+    def _train(self, x, *args, **kwargs):
+        """Perform single training step by training the internal node."""
+        if not self.batched or args or kwargs:
+            super(CloneLayer, self)._train(x, *args, **kwargs)
+        elif self.node.is_training():
+            # stack the data of the clones one after the other
+            n_nodes = len(self.nodes)
+            x = x.reshape((x.shape[0], n_nodes, self.node.input_dim))
+            self.node.train(x.swapaxes(0, 1).reshape((-1,
+                                                      self.node.input_dim)))
+
+    def _execute(self, x, *args, **kwargs):
+        """Process the data through the internal node."""
+        if not self.batched:
+            return super(CloneLayer, self)._execute(x, *args, **kwargs)
+        # each row of x contains the inputs of all the clones, so a plain
+        # reshape gives one row for each clone and sample
+        y = self.node.execute(x.reshape((-1, self.node.input_dim)),
+                              *args, **kwargs)
+        return y.reshape((x.shape[0], -1))
+
+    def _inverse(self, x, *args, **kwargs):
+        """Combine the inverse of the internal node."""
+        if not self.batched:
+            return super(CloneLayer, self)._inverse(x, *args, **kwargs)
+        y = self.node.inverse(x.reshape((-1, self.node.output_dim)),
+                              *args, **kwargs)
+        return y.reshape((x.shape[0], -1))
 
     def _stop_training(self, *args, **kwargs):
         """Stop training of the internal node."""
@@ -257,6 +347,107 @@ def _stop_training(self, *args, **kwargs):
         if self.output_dim is None:
             self.output_dim = self._get_output_dim_from_nodes()
 
+class Rectangular2dCloneLayer(mdp.Node):
+    """Fused Rectangular2dSwitchboard and CloneLayer.
+
+    This node is equivalent to a flow of the switchboard followed by
+    CloneLayer(node, switchboard.output_channels, batched=True), but the
+    fields are read from the strided view of the input (see
+    Rectangular2dSwitchboard.get_field_view) in blocks of samples, im2col
+    style. So the routed data, which is larger than the input when the
+    fields overlap, is never materialized as a whole.
+    """
+
+    def __init__(self, switchboard, node, dtype=None):
+        """Setup the layer.
+
+        Keyword arguments:
+        switchboard -- Rectangular2dSwitchboard defining the fields.
+        node -- Node applied to every field, its input_dim must be equal to
+            the out_channel_dim of the switchboard.
+        """
+        if node.input_dim != switchboard.out_channel_dim:
+            err = ("The input_dim of the node (%s) must be equal to the "
+                   "out_channel_dim of the switchboard (%d)." %
+                   (str(node.input_dim), switchboard.out_channel_dim))
+            raise mdp.NodeException(err)
+        self.switchboard = switchboard
+        self.node = node
+        if dtype is None:
+            dtype = node.dtype
+        super(Rectangular2dCloneLayer, self).__init__(
+                                        input_dim=switchboard.input_dim,
+                                        output_dim=self._get_output_dim(),
+                                        dtype=dtype)
+
+    def _get_output_dim(self):
+        """Return the output_dim from the node (None if it is not set)."""
+        if self.node.output_dim is None:
+            return None
+        return self.node.output_dim * self.switchboard.output_channels
+
+    def _set_dtype(self, t):
+        self.node.dtype = t
+        self._dtype = t
+
+    def _get_supported_dtypes(self):
+        return self.node.get_supported_dtypes()
+
+    def is_trainable(self):
+        return self.node.is_trainable()
+
+    @staticmethod
+    def is_invertible():
+        return False
+
+    def _get_train_seq(self):
+        return ([[self._train, self._stop_training]] *
+                len(self.node._get_train_seq()))
+
+    def _train(self, x):
+        """Train the node with the fields, one clone after the other."""
+        if not self.node.is_training():
+            return
+        view = self.switchboard.get_field_view(x)
+        field_dim = self.node.input_dim
+        # number of output channel rows in each block
+        row_size = view.shape[0] * view.shape[2] * field_dim
+        n_rows = max(1, _FIELD_BLOCK_SIZE // row_size)
+        for start in range(0, view.shape[1], n_rows):
+            fields = view[:, start:start+n_rows].transpose(1, 2, 0, 3, 4, 5)
+            self.node.train(fields.reshape((-1, field_dim)))
+
+    def _stop_training(self):
+        if self.node.is_training():
+            self.node.stop_training()
+        if self.output_dim is None:
+            self.output_dim = self._get_output_dim()
+
+    def _pre_execution_checks(self, x):
+        """Make sure that output_dim is set and then perform normal checks."""
+        if self.output_dim is None:
+            fields = self.switchboard.get_field_view(x[:1])
+            self.node._pre_execution_checks(
+                            fields.reshape((-1, self.node.input_dim)))
+            self.output_dim = self._get_output_dim()
+        super(Rectangular2dCloneLayer, self)._pre_execution_checks(x)
+
+    def _execute(self, x):
+        """Process the fields of blocks of samples with the node."""
+        view = self.switchboard.get_field_view(x)
+        field_dim = self.node.input_dim
+        n_samples = max(1, _FIELD_BLOCK_SIZE // self.switchboard.output_dim)
+        y = None
+        for start in range(0, x.shape[0], n_samples):
+            fields = view[start:start+n_samples].reshape((-1, field_dim))
+            y_block = self.node.execute(fields)
+            if y is None:
+                y = numx.empty((x.shape[0], self.output_dim),
+                               dtype=y_block.dtype)
+            y[start:start+n_samples] = y_block.reshape((-1, self.output_dim))
+        return y
+
+
 class SameInputLayer(Layer):
     """SameInputLayer is a layer were all nodes receive the full input.
 
@@ -264,7 +455,7 @@ class SameInputLayer(Layer):
     receive the complete input data.
     """
 
-    def __init__(self, nodes, dtype=None):
+    def __init__(self, nodes, dtype=None, n_threads=1):
         """Setup the layer with the given list of nodes.
 
         The input dimensions for the nodes must all be equal, the output
@@ -272,8 +463,11 @@ def __init__(self, nodes, dtype=None):
 
         Keyword arguments:
         nodes -- List of the nodes to be used.
+        n_threads -- Number of threads used to train and execute the nodes,
+            see Layer.
         """
         self.nodes = nodes
+        self.n_threads = n_threads
         # check node properties and get the dtype
         dtype = self._check_props(dtype)
         # check that the input dimensions are all the same
@@ -294,9 +488,8 @@ def is_invertible():
 
     def _train(self, x, *args, **kwargs):
         """Perform single training step by training the internal nodes."""
-        for node in self.nodes:
-            if node.is_training():
-                node.train(x, *args, **kwargs)
+        self._map_nodes(lambda node: node.train(x, *args, **kwargs),
+                        [node for node in self.nodes if node.is_training()])
 
     def _pre_execution_checks(self, x):
         """Make sure that output_dim is set and then perform nromal checks."""
@@ -313,17 +506,8 @@ def _pre_execution_checks(self, x):
 
     def _execute(self, x, *args, **kwargs):
         """Process the data through the internal nodes."""
-        out_start = 0
-        out_stop = 0
-        y = None
-        for node in self.nodes:
-            out_start = out_stop
-            out_stop += node.output_dim
-            if y is None:
-                node_y = node.execute(x, *args, **kwargs)
-                y = numx.zeros([node_y.shape[0], self.output_dim],
-                               dtype=node_y.dtype)
-                y[:,out_start:out_stop] = node_y
-            else:
-                y[:,out_start:out_stop] = node.execute(x, *args, **kwargs)
-        return y
+        # all the nodes get the complete input
+        in_slices = [(0, self.input_dim)] * len(self.nodes)
+        return self._combine('execute', x, in_slices,
+                             self._node_slices('output_dim'),
+                             self.output_dim, *args, **kwargs)
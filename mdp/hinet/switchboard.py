@@ -15,6 +15,52 @@ class SwitchboardException(mdp.NodeException):
     pass
 
 
+# minimal mean length of the runs of consecutive connections for which the
+# routing is done with slice copies instead of an index array
+_MIN_RUN_LENGTH = 8
+
+def _connection_runs(connections):
+    """Return the runs of consecutive indices in a connection array.
+
+    The result is a list of (out_start, out_stop, in_start) tuples, so that
+    the output connections out_start:out_stop are connected to the input
+    connections starting at in_start. None is returned if the runs are too
+    short on average for slice copies to be worthwhile.
+    """
+    connections = numx.asarray(connections)
+    if connections.min() < 0:
+        return None
+    starts = numx.flatnonzero(numx.diff(connections) != 1) + 1
+    if len(connections) < (len(starts) + 1) * _MIN_RUN_LENGTH:
+        return None
+    starts = numx.concatenate(([0], starts))
+    stops = numx.concatenate((starts[1:], [len(connections)]))
+    return [(int(start), int(stop), int(connections[start]))
+            for start, stop in zip(starts, stops)]
+
+def _route(x, connections, runs):
+    """Return the columns of x given by connections.
+
+    runs -- Result of _connection_runs for the connections. A single run
+        returns a view of x.
+    """
+    if runs is None:
+        y = numx.empty((x.shape[0], len(connections)) + x.shape[2:],
+                       dtype=x.dtype)
+        # the connections have already been checked, 'wrap' avoids the
+        # buffering of the output that take does in the "raise" mode
+        return numx.take(x, connections, axis=1, out=y, mode="wrap")
+    if len(runs) == 1:
+        out_start, out_stop, in_start = runs[0]
+        return x[:, in_start:in_start + out_stop - out_start]
+    y = numx.empty((x.shape[0], len(connections)) + x.shape[2:],
+                   dtype=x.dtype)
+    for out_start, out_stop, in_start in runs:
+        y[:, out_start:out_stop] = x[:, in_start:
+                                        in_start + out_stop - out_start]
+    return y
+
+
 # TODO: deal with input_dim, output_dim and dtype correctly,
 #    like in IdentityNode
 
@@ -53,7 +99,12 @@ def __init__(self, input_dim, connections):
                    "indices exceed the input dimension.")
             raise SwitchboardException(err)
         # checks passed
-        self.connections = numx.array(connections)
+        if (isinstance(connections, numx.ndarray) and
+            not connections.flags.writeable):
+            # shared read-only table (e.g. from the 2d connection cache)
+            self.connections = connections
+        else:
+            self.connections = numx.array(connections)
         output_dim = len(connections)
         super(Switchboard, self).__init__(input_dim=input_dim,
                                           output_dim=output_dim)
@@ -61,11 +112,16 @@ def __init__(self, input_dim, connections):
         if (self.input_dim == self.output_dim and
             len(numx.unique(self.connections)) == self.input_dim):
             self.inverse_connections = numx.argsort(self.connections)
+            self._inverse_runs = _connection_runs(self.inverse_connections)
         else:
             self.inverse_connections = None
+        # the connections often consist of runs of consecutive indices
+        # (e.g. for the components of a channel), which can be routed
+        # with slice copies
+        self._runs = _connection_runs(self.connections)
 
     def _execute(self, x):
-        return x[:, self.connections]
+        return _route(x, self.connections, self._runs)
 
     @staticmethod
     def is_trainable():
@@ -81,7 +137,7 @@ def _inverse(self, x):
         if self.inverse_connections is None:
             raise SwitchboardException("Connections are not invertible.")
         else:
-            return x[:, self.inverse_connections]
+            return _route(x, self.inverse_connections, self._inverse_runs)
 
     def _get_supported_dtypes(self):
         """Return the list of dtypes supported by this node."""
@@ -101,21 +157,17 @@ class MeanInverseSwitchboard(Switchboard):
 
     def _inverse(self, x):
         """Take the mean of overlapping values."""
-        n_y_cons = numx.bincount(self.connections)  # n. connections to y_i
-        y_cons = numx.argsort(self.connections)  # x indices for y_i
+        # sort the x indices by the y index they are connected to, so that
+        # the values for each y_i can be summed with a single reduceat
+        y_cons = numx.argsort(self.connections, kind="mergesort")
+        sorted_cons = self.connections[y_cons]
+        starts = numx.flatnonzero(numx.concatenate(
+                                ([True], sorted_cons[1:] != sorted_cons[:-1])))
+        i_y = sorted_cons[starts]  # y indices with at least one connection
+        n_cons = numx.diff(numx.concatenate((starts, [len(y_cons)])))
         y = numx.zeros((len(x), self.input_dim))
-        i_x_counter = 0  # counter for processed x indices
-        i_y = 0  # current y index
-        while True:
-            n_cons = n_y_cons[i_y]
-            if n_cons > 0:
-                y[:,i_y] = numx.sum(x[:,y_cons[i_x_counter:
-                                               i_x_counter + n_cons]],
-                                    axis=1) / n_cons
-                i_x_counter += n_cons
-                if i_x_counter >= self.output_dim:
-                    break
-            i_y += 1
+        y[:, i_y] = (numx.add.reduceat(x[:, y_cons], starts, axis=1) /
+                     n_cons.astype(y.dtype))
         return y
 
     @staticmethod
@@ -209,6 +261,47 @@ def to_2tuple(value):
         return tuple(value)
     return (value, value)
 
+
+# connection tables of the 2d switchboards, shared by all the switchboards
+# with the same geometry (the arrays are read-only)
+_CONNECTIONS_CACHE = {}
+
+def _cached_connections(key, build_connections):
+    """Return the connection table for the given geometry key, calling
+    build_connections to create it the first time."""
+    connections = _CONNECTIONS_CACHE.get(key)
+    if connections is None:
+        connections = build_connections()
+        connections.flags.writeable = False
+        _CONNECTIONS_CACHE[key] = connections
+    return connections
+
+def _channel_connections(channels, in_channel_dim):
+    """Return the connections for an array of input channel indices.
+
+    The connections of each channel are appended along a new last axis and
+    the result is flattened.
+    """
+    connections = (channels[..., numx.newaxis] * in_channel_dim +
+                   numx.arange(in_channel_dim))
+    return connections.astype(numx.int32).ravel()
+
+def _rect_field_channels(x_in_channels, field_channels_xy,
+                         x_starts, y_starts):
+    """Return the input channel indices of rectangular fields.
+
+    x_starts, y_starts -- Arrays with the coordinates of the upper left
+        corners of the fields, all combinations are used (y in the outer
+        loop).
+
+    The result has the shape (y_out, x_out, y_field, x_field).
+    """
+    y_chans = (y_starts[:, numx.newaxis, numx.newaxis, numx.newaxis] +
+               numx.arange(field_channels_xy[1])[:, numx.newaxis])
+    x_chans = (x_starts[:, numx.newaxis, numx.newaxis] +
+               numx.arange(field_channels_xy[0]))
+    return y_chans * x_in_channels + x_chans
+
     
 class Rectangular2dSwitchboardException(SwitchboardException):
     """Exception for routing problems in the Rectangular2dSwitchboard class."""
@@ -230,6 +323,10 @@ class Rectangular2dSwitchboard(ChannelSwitchboard):
     The coordinates follow the standard image convention (see the above
     CoordinateTranslator class).
 
+    Since the fields form a regular grid, the routing can be expressed as a
+    strided view of the input (see get_field_view), which is used instead of
+    the generic gather in execute.
+
     public attributes (in addition to init arguments and inherited attributes):
         unused_channels_xy
         out_channels_xy
@@ -294,33 +391,20 @@ def __init__(self, in_channels_xy, field_channels_xy,
                 raise Rectangular2dSwitchboardException(err)
         self.out_channels_xy = (x_out_channels, y_out_channels)
         ## end of parameters checks
-        # TODO: rewrite all this leveraging numpy?
-        #    this might make the code much simpler
-        #    use 3rd shape entry for channel width
-        out_channels = x_out_channels * y_out_channels
-        in_trans = CoordinateTranslator(*in_channels_xy)
         # input-output mapping of connections
         # connections has an entry for each output connection,
         # containing the index of the input connection.
-        connections = numx.zeros([out_channels * out_channel_dim],
-                                 dtype=numx.int32)
-        first_out_con = 0
-        for y_out_chan in range(self.out_channels_xy[1]):
-            for x_out_chan in range(self.out_channels_xy[0]):
-                # inner loop over field
-                x_start_chan = x_out_chan * field_spacing_xy[0]
-                y_start_chan = y_out_chan * field_spacing_xy[1]
-                for y_in_chan in range(y_start_chan,
-                                       y_start_chan + field_channels_xy[1]):
-                    for x_in_chan in range(x_start_chan,
-                                        x_start_chan + field_channels_xy[0]):
-                        first_in_con = (in_trans.image_to_index(
-                                                    x_in_chan, y_in_chan) *
-                                        in_channel_dim)
-                        connections[first_out_con:
-                                    first_out_con + in_channel_dim] = \
-                            range(first_in_con, first_in_con + in_channel_dim)
-                        first_out_con += in_channel_dim
+        def build_connections():
+            channels = _rect_field_channels(
+                            in_channels_xy[0], field_channels_xy,
+                            numx.arange(x_out_channels) * field_spacing_xy[0],
+                            numx.arange(y_out_channels) * field_spacing_xy[1])
+            return _channel_connections(channels, in_channel_dim)
+        connections = _cached_connections(
+                            ("Rectangular2d", in_channels_xy,
+                             field_channels_xy, field_spacing_xy,
+                             in_channel_dim),
+                            build_connections)
         super(Rectangular2dSwitchboard, self).__init__(
                                 input_dim=(in_channel_dim *
                                     in_channels_xy[0] * in_channels_xy[1]),
@@ -328,6 +412,38 @@ def __init__(self, in_channels_xy, field_channels_xy,
                                 out_channel_dim=out_channel_dim,
                                 in_channel_dim=in_channel_dim)
 
+    def get_field_view(self, x):
+        """Return a read-only strided view of the fields in x.
+
+        The view has the shape (n, y_out, x_out, y_field, x_field,
+        in_channel_dim), where (y_out, x_out) is the output channel and
+        (y_field, x_field) the input channel inside the field. No data is
+        copied (unless x is not C-contiguous), so overlapping fields do not
+        increase the memory usage. Reshaping the view to (n, output_dim)
+        gives the output of execute.
+        """
+        x = numx.ascontiguousarray(x)
+        x_in, y_in = self.in_channels_xy
+        x_spacing, y_spacing = self.field_spacing_xy
+        item = x.itemsize
+        chan = self.in_channel_dim * item
+        shape = (x.shape[0], self.out_channels_xy[1], self.out_channels_xy[0],
+                 self.field_channels_xy[1], self.field_channels_xy[0],
+                 self.in_channel_dim)
+        strides = (x.strides[0], y_spacing * x_in * chan, x_spacing * chan,
+                   x_in * chan, chan, item)
+        view = mdp.utils.as_strided(x, shape=shape, strides=strides)
+        view.flags.writeable = False
+        return view
+
+    def _execute(self, x):
+        y = self.get_field_view(x).reshape((x.shape[0], self.output_dim))
+        if not y.flags.writeable:
+            # the reshape returned the read-only view itself (e.g. for
+            # non-overlapping fields), return a copy as usual
+            y = y.copy()
+        return y
+
 
 class DoubleRect2dSwitchboardException(SwitchboardException):
     """Exception for routing problems in the DoubleRect2dSwitchboard class."""
@@ -446,51 +562,29 @@ def __init__(self, in_channels_xy, field_channels_xy,
         ## end of parameters checks
         self.long_out_channels_xy = (xl, yl)
         self.unused_channels_xy = (x_unused_channels, y_unused_channels)
-        out_channels = xl * yl + (xl-1) * (yl-1)
-        in_trans = CoordinateTranslator(*in_channels_xy)
-        connections = numx.zeros([out_channels * out_channel_dim],
-                                 dtype=numx.int32)
-        first_out_con = 0
-        ## first create the even connections
-        even_x_out_channels = in_channels_xy[0] // (2 * field_spacing_xy[0])
-        even_y_out_channels = in_channels_xy[1] // (2 * field_spacing_xy[1])
-        for y_out_chan in range(even_y_out_channels):
-            for x_out_chan in range(even_x_out_channels):
-                # inner loop over field
-                x_start_chan = x_out_chan * (2 * field_spacing_xy[0])
-                y_start_chan = y_out_chan * (2 * field_spacing_xy[1])
-                for y_in_chan in range(y_start_chan,
-                                    y_start_chan + self.field_channels_xy[1]):
-                    for x_in_chan in range(x_start_chan,
-                                    x_start_chan + self.field_channels_xy[0]):
-                        first_in_con = (in_trans.image_to_index(
-                                            x_in_chan, y_in_chan) *
-                                        in_channel_dim)
-                        connections[first_out_con:
-                                    first_out_con + in_channel_dim] = \
-                            range(first_in_con,
-                                  first_in_con + in_channel_dim)
-                        first_out_con += in_channel_dim
-        ## create the uneven connections
-        for y_out_chan in range(even_y_out_channels - 1):
-            for x_out_chan in range(even_x_out_channels - 1):
-                # inner loop over field
-                x_start_chan = (x_out_chan * (2 * field_spacing_xy[0]) +
-                                field_spacing_xy[0])
-                y_start_chan = (y_out_chan * (2 * field_spacing_xy[1]) +
-                                field_spacing_xy[1])
-                for y_in_chan in range(y_start_chan,
-                                       y_start_chan + self.field_channels_xy[1]):
-                    for x_in_chan in range(x_start_chan,
-                                       x_start_chan + self.field_channels_xy[0]):
-                        first_in_con = (in_trans.image_to_index(
-                                                    x_in_chan, y_in_chan) *
-                                        in_channel_dim)
-                        connections[first_out_con:
-                                    first_out_con + in_channel_dim] = \
-                            range(first_in_con,
-                                  first_in_con + in_channel_dim)
-                        first_out_con += in_channel_dim
+        def build_connections():
+            ## first create the even connections
+            x_spacing, y_spacing = field_spacing_xy
+            even_x_out_channels = in_channels_xy[0] // (2 * x_spacing)
+            even_y_out_channels = in_channels_xy[1] // (2 * y_spacing)
+            x_starts = numx.arange(even_x_out_channels) * 2 * x_spacing
+            y_starts = numx.arange(even_y_out_channels) * 2 * y_spacing
+            even_channels = _rect_field_channels(in_channels_xy[0],
+                                                 field_channels_xy,
+                                                 x_starts, y_starts)
+            ## create the uneven connections
+            uneven_channels = _rect_field_channels(
+                                    in_channels_xy[0], field_channels_xy,
+                                    x_starts[:-1] + x_spacing,
+                                    y_starts[:-1] + y_spacing)
+            return numx.concatenate(
+                        (_channel_connections(even_channels, in_channel_dim),
+                         _channel_connections(uneven_channels,
+                                              in_channel_dim)))
+        connections = _cached_connections(
+                            ("DoubleRect2d", in_channels_xy,
+                             field_channels_xy, in_channel_dim),
+                            build_connections)
         super(DoubleRect2dSwitchboard, self).__init__(
                                 input_dim=in_channel_dim *
                                     in_channels_xy[0] * in_channels_xy[1],
@@ -575,53 +669,49 @@ def __init__(self, long_in_channels_xy,
         x_out_channels = (2 * _x_chan_field_range // diag_field_channels + 1)
         y_out_channels = (2 * _y_chan_field_range // diag_field_channels + 1)
         self.out_channels_xy = (x_out_channels, y_out_channels)
-        ## prepare iteration over fields
-        long_in_trans = CoordinateTranslator(*long_in_channels_xy)
-        short_in_trans = CoordinateTranslator(long_in_channels_xy[0] - 1,
-                                              long_in_channels_xy[1] - 1)
         short_in_offset = long_in_channels_xy[0] * long_in_channels_xy[1]
-        connections = numx.zeros([x_out_channels * y_out_channels *
-                                  out_channel_dim], dtype=numx.int32)
-        first_out_con = 0
-        for y_out_chan in range(y_out_channels):
-            for x_out_chan in range(x_out_channels):
-                # inner loop over perceptive field
-                x_start_chan = (1 + x_out_chan) * diag_field_channels // 2
-                y_start_chan = y_out_chan * diag_field_channels
-                # set the initial field offset to minimize edge loss
-                x_start_chan -= started_in_short
-                y_start_chan += started_in_short
-                # iterate over both long and short rows
-                for iy, y_in_chan in enumerate(range(y_start_chan,
-                                y_start_chan + (2 * diag_field_channels - 1))):
-                    # half width of the field in the given row
-                    if iy <= (diag_field_channels - 1):
-                        field_width = iy + 1
-                    else:
-                        field_width = (diag_field_channels - 1 -
-                                       (iy % diag_field_channels))
-                    for x_in_chan in range(x_start_chan - field_width // 2,
-                                           x_start_chan + field_width // 2
-                                                        + field_width % 2):
-                        # array index of the first input connection
-                        # for this input channel
-                        if not y_in_chan % 2:
-                            if started_in_short:
-                                x_in_chan += 1
-                            first_in_con = (
-                                long_in_trans.image_to_index(
-                                                x_in_chan, y_in_chan // 2) *
-                                                        self.in_channel_dim)
-                        else:
-                            first_in_con = (
-                                (short_in_trans.image_to_index(
-                                                x_in_chan, y_in_chan // 2)
-                                 + short_in_offset) * self.in_channel_dim)
-                        connections[first_out_con:
-                                    first_out_con + self.in_channel_dim] = \
-                            range(first_in_con,
-                                  first_in_con + self.in_channel_dim)
-                        first_out_con += self.in_channel_dim
+        def build_connections():
+            # offsets (row, column) of the input channels in a field,
+            # relative to the field start, for both long and short rows
+            field_rows = []
+            field_cols = []
+            for iy in range(2 * diag_field_channels - 1):
+                # half width of the field in the given row
+                if iy <= (diag_field_channels - 1):
+                    field_width = iy + 1
+                else:
+                    field_width = (diag_field_channels - 1 -
+                                   (iy % diag_field_channels))
+                cols = range(-(field_width // 2),
+                             field_width // 2 + field_width % 2)
+                field_rows += [iy] * len(cols)
+                field_cols += cols
+            # start of the fields, set the initial field offset to minimize
+            # edge loss
+            x_starts = ((1 + numx.arange(x_out_channels)) *
+                        diag_field_channels // 2 - started_in_short)
+            y_starts = (numx.arange(y_out_channels) * diag_field_channels +
+                        started_in_short)
+            # shape (y_out, x_out, field channels)
+            y_in_chans = (y_starts[:, numx.newaxis, numx.newaxis] +
+                          numx.array(field_rows))
+            x_in_chans = (x_starts[:, numx.newaxis] +
+                          numx.array(field_cols))
+            y_in_chans, x_in_chans = numx.broadcast_arrays(y_in_chans,
+                                                           x_in_chans)
+            # even rows are long rows, odd rows are short rows
+            long_rows = (y_in_chans % 2) == 0
+            channels = numx.where(
+                long_rows,
+                (y_in_chans // 2) * long_in_channels_xy[0] +
+                    x_in_chans + started_in_short,
+                (y_in_chans // 2) * (long_in_channels_xy[0] - 1) +
+                    x_in_chans + short_in_offset)
+            return _channel_connections(channels, in_channel_dim)
+        connections = _cached_connections(
+                            ("DoubleRhomb2d", long_in_channels_xy,
+                             diag_field_channels, in_channel_dim),
+                            build_connections)
         super(DoubleRhomb2dSwitchboard, self).__init__(
                                         input_dim=input_dim,
                                         connections=connections,
@@ -5,6 +5,20 @@
 
 # TODO: The GaussianClassifier and NearestMeanClassifier could be parallelized.
 
+# maximum number of distances computed at once by NearestMeanClassifier
+_DISTANCE_BLOCK_SIZE = 2**22
+# maximum number of whitened differences computed at once by
+# GaussianClassifier
+_LOG_PROB_BLOCK_SIZE = 2**22
+# number of k-means iterations used to build the approximate index
+_INDEX_ITERATIONS = 10
+
+# scipy returns the upper Cholesky factor by default, numpy the lower one
+if mdp.numx_description == 'scipy':
+    _CHOLESKY_ARGS = {'lower': True}
+else:
+    _CHOLESKY_ARGS = {}
+
 
 class SignumClassifier(ClassifierNode):
     """This classifier node classifies as ``1`` if the sum of the data points
@@ -90,19 +104,45 @@ class SimpleMarkovClassifier(ClassifierNode):
     """A simple version of a Markov classifier.
     It can be trained on a vector of tuples the label being the next element
     in the testing data.
+
+    Features (the rows of the input) and labels are mapped to integer codes,
+    and the number of times each label follows each feature is accumulated
+    in a count matrix, so that training and classification work on whole
+    batches of data. The count matrix is dense by default; with
+    'sparse=True' a scipy.sparse matrix is used instead, which saves memory
+    when there are many features and labels.
+
+    The number of occurrences of each feature, label and (feature, label)
+    pair are also kept in the dictionaries 'features', 'labels' and
+    'connections', and their total in 'ntotal_connections'.
     """
     def __init__(self, execute_method=None,
-                 input_dim=None, output_dim=None, dtype=None):
+                 input_dim=None, output_dim=None, dtype=None, sparse=False):
         super(SimpleMarkovClassifier, self).__init__(
                                                 execute_method=execute_method,
                                                 input_dim=input_dim,
                                                 output_dim=output_dim,
                                                 dtype=dtype)
+        if sparse and mdp.numx_description != 'scipy':
+            err = "The sparse count matrix requires scipy."
+            raise mdp.NodeException(err)
+        self.sparse = sparse
         self.ntotal_connections = 0
-
         self.features = {}
         self.labels = {}
         self.connections = {}
+        # features and labels in the order of their codes
+        self._feature_list = []
+        self._label_list = []
+        # dictionaries mapping features and labels to their codes
+        self._feature_codes = {}
+        self._label_codes_dict = {}
+        # number of times each label (column) follows each feature (row);
+        # the dense matrix has spare rows and columns to grow into, the
+        # sparse one is only updated with the pending counts when needed
+        self._counts = None
+        self._pending_counts = []
+        self._n_pending_counts = 0
         
     def _get_supported_dtypes(self):
         """Return the list of dtypes supported by this node."""
@@ -117,8 +157,122 @@ def _check_train_args(self, x, labels):
                    "datapoints (%d != %d)" % (len(labels), x.shape[0]))
             raise mdp.TrainingException(msg)
 
-        if (not isinstance(labels, (list, tuple, numx.ndarray))):
-            labels = [labels]
+    @staticmethod
+    def _encode(keys, items, codes, item_list, add):
+        """Return the codes of the unique items, -1 for unknown items
+        unless 'add' is true."""
+        result = numx.empty(len(keys), dtype='l')
+        for i, key in enumerate(keys):
+            item = items(key)
+            code = codes.get(item)
+            if code is None:
+                if add:
+                    code = len(item_list)
+                    codes[item] = code
+                    item_list.append(item)
+                else:
+                    code = -1
+            result[i] = code
+        return result
+
+    def _encode_features(self, x, add=True):
+        """Return an array with the code of each row of x."""
+        x = numx.ascontiguousarray(x)
+        # view each row as a single item, so that unique finds the
+        # distinct features
+        rows = x.view(numx.dtype((numx.void,
+                                  x.dtype.itemsize * x.shape[1]))).ravel()
+        _, index, inverse = numx.unique(rows, return_index=True,
+                                        return_inverse=True)
+        codes = self._encode(index, lambda row: tuple(x[row]),
+                             self._feature_codes, self._feature_list, add)
+        return codes[inverse]
+
+    def _encode_labels(self, labels, add=True):
+        """Return an array with the code of each label."""
+        uniq, inverse = numx.unique(numx.asarray(labels),
+                                    return_inverse=True)
+        codes = self._encode(uniq, lambda label: label,
+                             self._label_codes_dict, self._label_list, add)
+        return codes[inverse]
+
+    def _add_counts(self, feature_codes, label_codes):
+        """Add the feature-label pairs to the counts."""
+        n_labels = len(self._label_list)
+        pairs, pair_counts = numx.unique(feature_codes * n_labels +
+                                         label_codes, return_counts=True)
+        rows, cols = pairs // n_labels, pairs % n_labels
+        self._add_occurrences(rows, cols, pair_counts)
+        if self.sparse:
+            self._pending_counts.append((rows, cols, pair_counts))
+            self._n_pending_counts += len(pairs)
+            # merge only once the pending counts are as large as the
+            # matrix, so that the matrix is rebuilt a logarithmic number
+            # of times
+            if (self._counts is None or
+                self._n_pending_counts > self._counts.nnz):
+                self._merge_pending_counts()
+        else:
+            self._grow_counts()
+            self._counts[rows, cols] += pair_counts
+
+    def _add_occurrences(self, rows, cols, pair_counts):
+        """Update the occurrence dictionaries with the counts of the
+        distinct feature-label pairs of a chunk."""
+        self.ntotal_connections += int(pair_counts.sum())
+        features, labels = self.features, self.labels
+        connections = self.connections
+        for row, col, count in zip(rows.tolist(), cols.tolist(),
+                                   pair_counts.tolist()):
+            feature = self._feature_list[row]
+            label = self._label_list[col]
+            features[feature] = features.get(feature, 0) + count
+            labels[label] = labels.get(label, 0) + count
+            connection = (feature, label)
+            connections[connection] = connections.get(connection, 0) + count
+
+    def _grow_counts(self):
+        """Make room for the new features and labels in the dense count
+        matrix, doubling its size when it is too small."""
+        shape = (len(self._feature_list), len(self._label_list))
+        if self._counts is None:
+            self._counts = numx.zeros(shape, dtype='l')
+        elif (shape[0] > self._counts.shape[0] or
+              shape[1] > self._counts.shape[1]):
+            old = self._counts
+            self._counts = numx.zeros((max(shape[0], 2*old.shape[0]),
+                                       max(shape[1], 2*old.shape[1])),
+                                      dtype='l')
+            self._counts[:old.shape[0], :old.shape[1]] = old
+
+    def _merge_pending_counts(self):
+        """Add the pending counts to the sparse count matrix."""
+        import scipy.sparse
+        shape = (len(self._feature_list), len(self._label_list))
+        rows, cols, pair_counts = [numx.concatenate(arrays) for arrays in
+                                   zip(*self._pending_counts)]
+        counts = scipy.sparse.csr_matrix((pair_counts, (rows, cols)),
+                                         shape=shape)
+        if self._counts is not None:
+            old = self._counts
+            # the new rows are empty, so only the row pointers are extended
+            indptr = numx.concatenate(
+                        (old.indptr, numx.repeat(old.indptr[-1:],
+                                                 shape[0] - old.shape[0])))
+            counts = counts + scipy.sparse.csr_matrix(
+                                (old.data, old.indices, indptr), shape=shape)
+        self._counts = counts
+        self._pending_counts = []
+        self._n_pending_counts = 0
+
+    def _count_matrix(self):
+        """Return the matrix with the number of times each label follows
+        each feature."""
+        if self.sparse:
+            if self._pending_counts:
+                self._merge_pending_counts()
+            return self._counts
+        return self._counts[:len(self._feature_list), :len(self._label_list)]
 
     def _train(self, x, labels):
         """Update the internal structures according to the input data 'x'.
@@ -129,64 +283,47 @@ def _train(self, x, labels):
               or a single label, in which case all input data is assigned to
               the same class.
         """
-        # if labels is a number, all x's belong to the same class
-        for xi, labeli in mdp.utils.izip_stretched(x, labels):
-            self._learn(xi, labeli)
-
-    def _learn(self, feature, label):
-        feature = tuple(feature)
-        self.ntotal_connections += 1
-
-        if label in self.labels:
-            self.labels[label] += 1
-        else:
-            self.labels[label] = 1
-
-        if feature in self.features:
-            self.features[feature] += 1
-        else:
-            self.features[feature] = 1
-
-        connection = (feature, label)
-        if connection in self.connections:
-            self.connections[connection] += 1
+        feature_codes = self._encode_features(x)
+        if isinstance(labels, (list, tuple, numx.ndarray)):
+            label_codes = self._encode_labels(labels)
         else:
-            self.connections[connection] = 1
-
-    def _prob(self, features):
-        return [self._prob_one(feature) for feature in features]
-
-    def _prob_one(self, feature):
-        feature = tuple(feature)
-        probabilities = {}
-
-        try:
-            n_feature_connections = self.features[feature]
-        except KeyError:
-            n_feature_connections = 0
-            # if n_feature_connections == 0, we get a division by zero
-            # we could throw here, but maybe it's best to simply return
-            # an empty dict object
-            return {}
-
-        for label in self.labels:
-            conn = (feature, label)
-            try:
-                n_conn = self.connections[conn]
-            except KeyError:
-                n_conn = 0
+            # if labels is a number, all x's belong to the same class
+            label_codes = self._encode_labels([labels]).repeat(len(x))
+        self._add_counts(feature_codes, label_codes)
+
+    def _feature_counts(self, x):
+        """Return the counts of the labels for each row of x and a boolean
+        array which is false for the features never seen in training."""
+        codes = self._encode_features(x, add=False)
+        known = codes >= 0
+        counts = numx.zeros((len(x), len(self._label_list)))
+        if known.any():
+            known_counts = self._count_matrix()[codes[known]]
+            if self.sparse:
+                known_counts = known_counts.toarray()
+            counts[known] = known_counts
+        return counts, known
+
+    def _prob_matrix(self, x):
+        """Return the probability of each label following each row of x.
+
+        The probabilities are nan for the features never seen in training.
+        """
+        counts, known = self._feature_counts(x)
+        counts[~known] = numx.nan
+        return (counts / counts.sum(axis=1)[:, numx.newaxis],
+                self._label_list)
 
-            try:
-                n_label_connections = self.labels[label]
-            except KeyError:
-                n_label_connections = 0
+    def _label_codes(self, x):
+        """Return the most probable label following each row of x.
 
-            p_feature_given_label = 1.0 * n_conn / n_label_connections
-            p_label = 1.0 * n_label_connections / self.ntotal_connections
-            p_feature = 1.0 * n_feature_connections / self.ntotal_connections
-            prob = 1.0 * p_feature_given_label * p_label / p_feature
-            probabilities[label] = prob
-        return probabilities
+        For the features never seen in training this is the most frequent
+        label.
+        """
+        counts, known = self._feature_counts(x)
+        counts[~known] = numx.asarray(
+                            self._count_matrix().sum(axis=0)).ravel()
+        return counts.argmax(axis=1), self._label_list
 
 
 class DiscreteHopfieldClassifier(ClassifierNode):
@@ -194,13 +331,38 @@ class DiscreteHopfieldClassifier(ClassifierNode):
     # TODO: It is unclear if this belongs to classifiers or is a general node
     # because label space is a subset of feature space
     def __init__(self, execute_method=None,
-                 input_dim=None, output_dim=None, dtype='b'):
+                 input_dim=None, output_dim=None, dtype='b',
+                 update_mode='async', block_size=1, max_iter=None):
+        """
+        update_mode -- Either 'async' or 'sync'. In asynchronous mode the
+            units are updated in a random order, 'block_size' units at a
+            time (with block_size=1 these are the classic Hopfield
+            dynamics). In synchronous mode all the units are updated at
+            once; recall stops when a pattern reaches a fixpoint or a
+            cycle of length two.
+        block_size -- Number of units updated together in asynchronous
+            mode. With block_size > 1 the recall is not guaranteed to
+            converge, so 'max_iter' should be set.
+        max_iter -- Maximum number of updates of all the units during recall
+            (None means until convergence).
+
+        In both modes all the patterns passed to 'label' are recalled at
+        the same time, with one matrix product per update step.
+        """
         super(DiscreteHopfieldClassifier, self).__init__(
                                             execute_method=execute_method,
                                             input_dim=input_dim,
                                             output_dim=output_dim,
                                             dtype=dtype)
-        self._weight_matrix = 0 # assigning zero to ease addition
+        if update_mode not in ('async', 'sync'):
+            err = "Unknown update mode '%s'." % str(update_mode)
+            raise mdp.NodeException(err)
+        self.update_mode = update_mode
+        self.block_size = block_size
+        self.max_iter = max_iter
+        # sum of the outer products of the patterns (in sign
+        # representation), stored as float32 since the values are integers
+        self._weight_matrix = None
         self._num_patterns = 0
         self._shuffled_update = True
 
@@ -213,14 +375,13 @@ def _train(self, x):
         x -- a matrix having different variables on different columns
             and observations on rows.
         """
-        for pattern in x:
-            self._train_one(pattern)
-
-    def _train_one(self, pattern):
-        pattern = mdp.utils.bool_to_sign(pattern)
-        weights = numx.outer(pattern, pattern)
-        self._weight_matrix += weights / float(self.input_dim)
-        self._num_patterns += 1
+        patterns = mdp.utils.bool_to_sign(x).astype('f')
+        weights = mdp.utils.mult(patterns.T, patterns)
+        if self._weight_matrix is None:
+            self._weight_matrix = weights
+        else:
+            self._weight_matrix += weights
+        self._num_patterns += x.shape[0]
 
     @property
     def memory_size(self):
@@ -235,40 +396,77 @@ def load_parameter(self):
         return self._num_patterns / float(self.input_dim)
 
     def _stop_training(self):
+        # the local fields are integers up to num_patterns * input_dim,
+        # which are only exact in single precision below 2**24
+        if self._num_patterns * self.input_dim >= 2**24:
+            self._weight_matrix = self._weight_matrix.astype('d')
         # remove self-feedback
-        # we could use numx.fill_diagonal, but thats numpy 1.4 only
-        for i in range(self.input_dim):
-            self._weight_matrix[i][i] = 0
+        self._weight_matrix.flat[::self.input_dim+1] = 0
 
     def _label(self, x, threshold = 0):
         """Retrieves patterns from the associative memory.
         """
-        threshold = numx.zeros(self.input_dim) + threshold
-        return numx.array([self._label_one(pattern, threshold) for pattern in x])
-
-    def _label_one(self, pattern, threshold):
-        pattern = mdp.utils.bool_to_sign(pattern)
-
-        has_converged = False
-        while not has_converged:
-            has_converged = True
-            iter_order = range(len(self._weight_matrix))
+        weights = self._weight_matrix
+        patterns = mdp.utils.bool_to_sign(x).astype(weights.dtype)
+        # the weights are not divided by input_dim, scale the threshold
+        threshold = (numx.zeros(self.input_dim) + threshold) * self.input_dim
+        threshold = threshold.astype(weights.dtype)
+        if self.update_mode == 'sync':
+            self._recall_sync(patterns, threshold)
+        else:
+            self._recall_async(patterns, threshold)
+        return mdp.utils.sign_to_bool(patterns)
+
+    def _recall_async(self, patterns, threshold):
+        """Update the patterns in place until all of them have converged."""
+        weights = self._weight_matrix
+        n_units = self.input_dim
+        # indices of the patterns which have not converged yet
+        active = numx.arange(len(patterns))
+        n_iter = 0
+        while len(active) and n_iter != self.max_iter:
+            n_iter += 1
             if self._shuffled_update:
-                numx_rand.shuffle(iter_order)
-            for row in iter_order:
-                w_row = self._weight_matrix[row]
-
-                thresh_row = threshold[row]
-                new_pattern_row = numx.sign(numx.dot(w_row, pattern) - thresh_row)
-
-                if new_pattern_row == 0:
-                    # Following McKay, Neural Networks, we do nothing
-                    # when the new pattern is zero
-                    pass
-                elif pattern[row] != new_pattern_row:
-                    has_converged = False
-                    pattern[row] = new_pattern_row
-        return mdp.utils.sign_to_bool(pattern)
+                order = numx_rand.permutation(n_units)
+            else:
+                order = numx.arange(n_units)
+            current = patterns[active]
+            changed = numx.zeros(len(active), dtype=bool)
+            for start in range(0, n_units, self.block_size):
+                units = order[start:start+self.block_size]
+                new = numx.sign(utils.mult(current, weights[:, units]) -
+                                threshold[units])
+                # Following McKay, Neural Networks, we do nothing
+                # when the new pattern is zero
+                update = (new != 0) & (new != current[:, units])
+                if update.any():
+                    current[:, units] = numx.where(update, new,
+                                                   current[:, units])
+                    changed |= update.any(axis=1)
+            patterns[active] = current
+            active = active[changed]
+
+    def _recall_sync(self, patterns, threshold):
+        """Update the patterns in place until all of them have reached a
+        fixpoint or a cycle of length two."""
+        weights = self._weight_matrix
+        active = numx.arange(len(patterns))
+        previous = None
+        n_iter = 0
+        while len(active) and n_iter != self.max_iter:
+            n_iter += 1
+            current = patterns[active]
+            new = numx.sign(utils.mult(current, weights) - threshold)
+            # Following McKay, Neural Networks, we do nothing
+            # when the new pattern is zero
+            zeros = new == 0
+            new[zeros] = current[zeros]
+            patterns[active] = new
+            running = (new != current).any(axis=1)
+            if previous is not None:
+                running &= (new != previous).any(axis=1)
+            active = active[running]
+            previous = current[running]
 
 # TODO: Make it more efficient
 
@@ -337,11 +535,15 @@ def _nearest_centroid_idx(self, data, centroids):
         dists = numx.array([numx.linalg.norm(data - c) for c in centroids])
         return dists.argmin()
 
-    def _label(self, x):
+    def _label_codes(self, x):
         """For a set of feature vectors x, this classifier returns
-        a list of centroids.
+        the indices of the nearest centroids.
         """
-        return [self._nearest_centroid_idx(xi, self._centroids) for xi in x]
+        centroids = numx.asarray(self._centroids)
+        square_distances = ((x*x).sum(axis=1)[:, numx.newaxis] +
+                            (centroids*centroids).sum(axis=1) -
+                            2 * utils.mult(x, centroids.T))
+        return square_distances.argmin(axis=1), range(len(centroids))
 
 
 class GaussianClassifier(ClassifierNode):
@@ -357,10 +559,16 @@ def __init__(self, execute_method=False,
                                                  input_dim=input_dim,
                                                  output_dim=output_dim,
                                                  dtype=dtype)
-        self._cov_objs = {}  # only stored during training
-        # this list contains the square root of the determinant of the
-        # corresponding covariance matrix
-        self._sqrt_def_covs = []
+        # number of points, sums and second moments of each class,
+        # only stored during training
+        self._class_stats = None
+        # the inverse transposed Cholesky factors of the covariance matrices
+        # side by side, the means multiplied by them and the logarithm of
+        # the normalization constants times the class probabilities, so that
+        # the log-probabilities of all classes are computed with one product
+        self._chol_factors = None
+        self._chol_means = None
+        self._log_consts = None
         # we are going to store the inverse of the covariance matrices
         # since only those are useful to compute the probabilities
         self.inv_covs = []
@@ -379,11 +587,6 @@ def _check_train_args(self, x, labels):
                    "datapoints (%d != %d)" % (len(labels), x.shape[0]))
             raise mdp.TrainingException(msg)
 
-    def _update_covs(self, x, lbl):
-        if lbl not in self._cov_objs:
-            self._cov_objs[lbl] = utils.CovarianceMatrix(dtype=self.dtype)
-        self._cov_objs[lbl].update(x)
-
     def _train(self, x, labels):
         """
         :Arguments:
@@ -394,89 +597,99 @@ def _train(self, x, labels):
               or a single label, in which case all input data is assigned to
               the same class.
         """
-        # if labels is a number, all x's belong to the same class
-        if isinstance(labels, (list, tuple, numx.ndarray)):
-            labels_ = numx.asarray(labels)
-            # get all classes from cl
-            for lbl in set(labels_):
-                x_lbl = numx.compress(labels_==lbl, x, axis=0)
-                self._update_covs(x_lbl, lbl)
-        else:
-            self._update_covs(x, labels)
+        if self._class_stats is None:
+            self._class_stats = utils.ClassStatistics(dtype=self.dtype,
+                                                      second_moments=True)
+        self._class_stats.update(x, labels)
 
     def _stop_training(self):
-        self.labels = self._cov_objs.keys()
-        self.labels.sort()
+        stats = self._class_stats
+        covs = stats.get_covariances()
+        means = stats.get_means()
+        tlens = stats.get_counts()
+        codes = sorted(range(len(stats.labels)),
+                       key=lambda code: stats.labels[code])
+        self.labels = [stats.labels[code] for code in codes]
         nitems = 0
-        for lbl in self.labels:
-            cov, mean, p = self._cov_objs[lbl].fix()
+        chol_factors = []
+        log_dets = []
+        for code in codes:
+            cov, p = covs[code], int(tlens[code])
             nitems += p
-            self._sqrt_def_covs.append(numx.sqrt(numx_linalg.det(cov)))
-            if self._sqrt_def_covs[-1] == 0.0:
+            try:
+                chol = numx_linalg.cholesky(cov, **_CHOLESKY_ARGS)
+            except numx_linalg.LinAlgError:
                 err = ("The covariance matrix is singular for at least "
                        "one class.")
                 raise mdp.NodeException(err)
-            self.means.append(mean)
+            # (x-mean) inv(chol).T has the Mahalanobis distance as norm
+            chol_inv = utils.inv(chol).T
+            chol_factors.append(chol_inv)
+            # log of the square root of the determinant of cov
+            log_dets.append(numx.log(chol.diagonal()).sum())
+            self.means.append(means[code])
             self.p.append(p)
-            self.inv_covs.append(utils.inv(cov))
+            self.inv_covs.append(utils.mult(chol_inv, chol_inv.T))
 
         for i in range(len(self.p)):
             self.p[i] /= float(nitems)
 
-        del self._cov_objs
+        self._chol_factors = numx.concatenate(chol_factors, axis=1)
+        self._chol_means = numx.concatenate(
+                            [utils.mult(mean, chol_inv) for mean, chol_inv
+                             in zip(self.means, chol_factors)])
+        self._log_consts = (numx.log(self.p) - numx.array(log_dets) -
+                            0.5 * self.input_dim * numx.log(2.*numx.pi))
+        del self._class_stats
 
-    def _gaussian_prob(self, x, lbl_idx):
-        """Return the probability of the data points x with respect to a
-        gaussian.
+    def log_prob(self, x):
+        """Return the logarithm of the joint probability density of the
+        input and each class, i.e. log(p(x|class)*p(class)), as an array
+        with one column per class (in the order of self.labels).
 
-        Input arguments:
-        x -- Input data
-        S -- Covariance matrix
-        mn -- Mean
+        The densities are computed in log space and never underflow.
         """
+        self._pre_execution_checks(x)
         x = self._refcast(x)
-
-        dim = self.input_dim
-        sqrt_detS = self._sqrt_def_covs[lbl_idx]
-        invS = self.inv_covs[lbl_idx]
-        # subtract the mean
-        x_mn = x - self.means[lbl_idx][numx.newaxis, :]
-        # exponent
-        exponent = -0.5 * (utils.mult(x_mn, invS)*x_mn).sum(axis=1)
-        # constant
-        constant = (2.*numx.pi)**(-dim/2.) / sqrt_detS
-        # probability
-        return constant * numx.exp(exponent)
+        n_labels, dim = len(self.labels), self.input_dim
+        log_prob = numx.empty((x.shape[0], n_labels), dtype=self.dtype)
+        # whitened differences to the means of as many classes at once as
+        # fit in the block size
+        row_step = max(1, _LOG_PROB_BLOCK_SIZE // dim)
+        for row in range(0, x.shape[0], row_step):
+            x_block = x[row:row+row_step]
+            n_rows = x_block.shape[0]
+            step = max(1, _LOG_PROB_BLOCK_SIZE // (n_rows * dim))
+            for start in range(0, n_labels, step):
+                stop = min(start + step, n_labels)
+                cols = slice(start * dim, stop * dim)
+                z = (utils.mult(x_block, self._chol_factors[:, cols]) -
+                     self._chol_means[cols])
+                z = z.reshape((n_rows, stop - start, dim))
+                log_prob[row:row+n_rows, start:stop] = (
+                    self._log_consts[start:stop] - 0.5 * (z*z).sum(axis=2))
+        return log_prob
+
+    def class_log_probabilities(self, x):
+        """Return the logarithm of the posterior probability of each class
+        given the input."""
+        log_prob = self.log_prob(x)
+        # normalize with the log-sum-exp trick
+        log_max = log_prob.max(axis=1)[:, numx.newaxis]
+        log_tot = numx.log(numx.exp(log_prob - log_max).sum(axis=1))
+        return log_prob - log_max - log_tot[:, numx.newaxis]
 
     def class_probabilities(self, x):
         """Return the posterior probability of each class given the input."""
-        self._pre_execution_checks(x)
-
-        # compute the probability for each class
-        tmp_prob = numx.zeros((x.shape[0], len(self.labels)),
-                              dtype=self.dtype)
-        for i in range(len(self.labels)):
-            tmp_prob[:, i] = self._gaussian_prob(x, i)
-            tmp_prob[:, i] *= self.p[i]
-
-        # normalize to probability 1
-        # (not necessary, but sometimes useful)
-        tmp_tot = tmp_prob.sum(axis=1)
-        tmp_tot = tmp_tot[:, numx.newaxis]
-        return tmp_prob / tmp_tot
-
-    def _prob(self, x):
-        """Return the posterior probability of each class given the input in a dict."""
+        return numx.exp(self.class_log_probabilities(x))
 
-        class_prob = self.class_probabilities(x)
-        return [dict(zip(self.labels, prob)) for prob in class_prob]
+    def _prob_matrix(self, x):
+        """Return the posterior probability of each class given the input."""
+        return self.class_probabilities(x), self.labels
 
-    def _label(self, x):
+    def _label_codes(self, x):
         """Classify the input data using Maximum A-Posteriori."""
-
-        class_prob = self.class_probabilities(x)
-        winner = class_prob.argmax(axis=-1)
-        return [self.labels[winner[i]] for i in range(len(winner))]
+        return self.log_prob(x).argmax(axis=-1), self.labels
     
 # TODO: Maybe extract some common elements form this class and
 #    GaussianClassifier, like in _train.
@@ -485,17 +698,36 @@ class NearestMeanClassifier(ClassifierNode):
     """Nearest-Mean classifier."""
     
     def __init__(self, execute_method=None,
-                 input_dim=None, output_dim=None, dtype=None):
+                 input_dim=None, output_dim=None, dtype=None,
+                 approx_cells=None, approx_probes=3):
+        """Initialize classifier.
+
+        approx_cells -- If given, the class means are grouped in this many
+            cells after training (with a few k-means iterations) and a data
+            point is only compared with the means in the 'approx_probes'
+            cells with the nearest centers. This is approximate, but much
+            faster for very large numbers of classes. A good choice for
+            approx_cells is about the square root of the number of classes.
+        approx_probes -- Number of cells searched in approximate mode.
+        """
         super(NearestMeanClassifier, self).__init__(
                                             execute_method=execute_method,
                                             input_dim=input_dim,
                                             output_dim=output_dim,
                                             dtype=dtype)
-        self.label_means = {}  # not normalized during training
+        self.approx_cells = approx_cells
+        self.approx_probes = approx_probes
+        self.label_means = {}  # initialized after training
         self.n_label_samples = {}
+        # number of points and sums of each class, only stored during training
+        self._class_stats = None
         # initialized after training, used for vectorized execution:
         self.ordered_labels = []
         self.ordered_means = None  # will be array
+        self._mean_sq_norms = None
+        # approximate index, cell centers and mean indices in each cell
+        self._cell_centers = None
+        self._cell_members = None
         
     def _train(self, x, labels):
         """Update the mean information for the different classes.
@@ -504,22 +736,9 @@ def _train(self, x, labels):
             point) or a single label, in which case all input data is assigned
             to the same class (computationally this is more efficient).
         """
-        if isinstance(labels, (list, tuple, numx.ndarray)):
-            labels = numx.asarray(labels)
-            for label in set(labels):
-                x_label = numx.compress(labels==label, x, axis=0)
-                self._update_mean(x_label, label)
-        else:
-            self._update_mean(x, labels)
-            
-    def _update_mean(self, x, label):
-        """Update the mean with data for a single label."""
-        if label not in self.label_means:
-            self.label_means[label] = numx.zeros(self.input_dim)
-            self.n_label_samples[label] = 0
-        # TODO: use smarter summing to avoid rounding errors
-        self.label_means[label] += numx.sum(x, axis=0)
-        self.n_label_samples[label] += len(x)
+        if self._class_stats is None:
+            self._class_stats = utils.ClassStatistics(dtype=self.dtype)
+        self._class_stats.update(x, labels)
         
     def _check_train_args(self, x, labels):
         if isinstance(labels, (list, tuple, numx.ndarray)) and (
@@ -530,22 +749,94 @@ def _check_train_args(self, x, labels):
         
     def _stop_training(self):
         """Calculate the class means."""
-        ordered_means = [] 
-        for label in self.label_means:
-            self.label_means[label] /= self.n_label_samples[label]
+        stats = self._class_stats
+        means = stats.get_means()
+        tlens = stats.get_counts()
+        codes = sorted(range(len(stats.labels)),
+                       key=lambda code: stats.labels[code])
+        for code in codes:
+            label = stats.labels[code]
+            self.label_means[label] = means[code]
+            self.n_label_samples[label] = int(tlens[code])
             self.ordered_labels.append(label)
-            ordered_means.append(self.label_means[label])
-        self.ordered_means = numx.vstack(ordered_means)
+        self.ordered_means = means[codes]
+        self._mean_sq_norms = (self.ordered_means**2).sum(axis=1)
+        del self._class_stats
+        if self.approx_cells:
+            self._build_index()
+
+    def _build_index(self):
+        """Group the class means in cells with a few k-means iterations."""
+        means = self.ordered_means
+        n_cells = min(self.approx_cells, len(means))
+        centers = means[numx_rand.permutation(len(means))[:n_cells]]
+        for _ in range(_INDEX_ITERATIONS):
+            cells = self._nearest(means, centers, (centers**2).sum(axis=1))
+            counts = numx.bincount(cells, minlength=n_cells)
+            sums = numx.array([numx.bincount(cells, weights=column,
+                                             minlength=n_cells)
+                               for column in means.T]).T
+            # empty cells keep their old center
+            filled = counts > 0
+            centers[filled] = sums[filled] / counts[filled, numx.newaxis]
+        cells = self._nearest(means, centers, (centers**2).sum(axis=1))
+        self._cell_centers = centers
+        self._cell_members = [numx.flatnonzero(cells == cell)
+                              for cell in range(n_cells)]
+
+    @staticmethod
+    def _nearest(x, points, sq_norms):
+        """Return the index of the nearest point for each row of x.
+
+        The distances are computed as ||x||^2 + ||p||^2 - 2 x p^T with one
+        matrix product per block of rows. ||x||^2 is the same for all the
+        points, so it is left out.
+        """
+        block = max(1, _DISTANCE_BLOCK_SIZE // len(points))
+        nearest = numx.empty(len(x), dtype='l')
+        for start in range(0, len(x), block):
+            distances = sq_norms - 2 * utils.mult(x[start:start+block],
+                                                  points.T)
+            nearest[start:start+block] = distances.argmin(axis=1)
+        return nearest
             
-    def _label(self, x):
+    def _label_codes(self, x):
         """Classify the data based on minimal distance to mean."""
-        n_labels = len(self.ordered_labels)
-        differences = x[:,:,numx.newaxis].repeat(n_labels, 2). \
-                        swapaxes(1,2) - self.ordered_means
-        square_distances = (differences**2).sum(2)
-        label_indices = square_distances.argmin(1)
-        labels = [self.ordered_labels[i] for i in label_indices]
-        return labels
+        if self._cell_centers is None:
+            codes = self._nearest(x, self.ordered_means, self._mean_sq_norms)
+        else:
+            codes = self._approx_nearest(x)
+        return codes, self.ordered_labels
+
+    def _approx_nearest(self, x):
+        """Return the index of the nearest mean for each row of x, only
+        searching the means in the cells with the nearest centers."""
+        centers = self._cell_centers
+        n_cells = len(centers)
+        probes = min(self.approx_probes, n_cells)
+        cell_distances = ((centers**2).sum(axis=1) -
+                          2 * utils.mult(x, centers.T))
+        if probes < n_cells:
+            probed = cell_distances.argpartition(probes-1, axis=1)
+            probed = probed[:, :probes]
+        else:
+            probed = numx.tile(numx.arange(n_cells), (len(x), 1))
+        nearest = numx.zeros(len(x), dtype='l')
+        best = numx.empty(len(x))
+        best.fill(numx.inf)
+        for cell, members in enumerate(self._cell_members):
+            rows = numx.flatnonzero((probed == cell).any(axis=1))
+            if not len(rows) or not len(members):
+                continue
+            means = self.ordered_means[members]
+            distances = (self._mean_sq_norms[members] -
+                         2 * utils.mult(x[rows], means.T))
+            indices = distances.argmin(axis=1)
+            distances = distances[numx.arange(len(rows)), indices]
+            better = distances < best[rows]
+            best[rows[better]] = distances[better]
+            nearest[rows[better]] = members[indices[better]]
+        return nearest
     
     
 class KNNClassifier(ClassifierNode):
@@ -612,13 +903,21 @@ def _stop_training(self):
                                            dtype="int32") * i
                                  for i in range(len(self.ordered_labels))])
 
-    def _label(self, x):
+    def _label_codes(self, x):
         """Label the data by comparison with the reference points."""
         square_distances = (x*x).sum(1)[:, numx.newaxis] \
                       + (self.samples*self.samples).sum(1)
         square_distances -= 2 * numx.dot(x, self.samples.T)
-        min_inds = square_distances.argsort()
-        win_inds = [numx.bincount(self.sample_label_indices[indices[0:self.k]]).
-                    argmax(0) for indices in min_inds]
-        labels = [self.ordered_labels[i] for i in win_inds]
-        return labels
+        k = min(self.k, self.n_samples)
+        n_labels = len(self.ordered_labels)
+        if k < self.n_samples:
+            min_inds = square_distances.argpartition(k-1, axis=1)[:, :k]
+        else:
+            min_inds = square_distances.argsort(axis=1)
+        # count the votes for each label with a single bincount
+        votes = self.sample_label_indices[min_inds]
+        offsets = n_labels * numx.arange(len(x))[:, numx.newaxis]
+        counts = numx.bincount((votes + offsets).ravel(),
+                               minlength=n_labels*len(x))
+        counts = counts.reshape((len(x), n_labels))
+        return counts.argmax(axis=1), self.ordered_labels
@@ -1,9 +1,39 @@
 __docformat__ = "restructuredtext en"
 
-from mdp import numx, numx_linalg, utils, NodeException
+from mdp import numx, numx_linalg, numx_fft, utils, NodeException
 import mdp
 import scipy.signal as signal
 
+# numx_fft is scipy.fftpack when scipy is used, which has no transforms for
+# real input, so the full complex transforms are used there instead
+_REAL_FFT = hasattr(numx_fft, 'rfft2')
+
+def _fft2(x, shape):
+    """Return the 2D spectrum of x over the last two axes."""
+    if _REAL_FFT:
+        return numx_fft.rfft2(x, s=shape)
+    return numx_fft.fft2(x, shape=shape)
+
+def _ifft2(spectrum, shape):
+    """Return the real 2D inverse transform over the last two axes."""
+    if _REAL_FFT:
+        return numx_fft.irfft2(spectrum, s=shape)
+    return numx_fft.ifft2(spectrum, shape=shape).real
+
+# maximum number of elements of the filter spectra times the number of
+# images that are transformed at once in the 'fft' approach
+_FFT_BLOCK_SIZE = 2**22
+
+# maximum number of elements of the filters for which the 'linear' approach
+# uses im2col and a matrix product instead of scipy.signal.convolve2d
+_IM2COL_MAX_FILTER_SIZE = 64
+
+# maximum number of elements of the im2col matrix built at once
+_IM2COL_BLOCK_SIZE = 2**22
+
+# numpy.pad modes corresponding to the boundary conditions of convolve2d
+_PAD_MODES = {'wrap': 'wrap', 'symm': 'symmetric'}
+
 # TODO automatic selection of convolution
 
 # TODO provide generators for standard filters
@@ -22,6 +52,13 @@ class Convolution2DNode(mdp.Node):
     to be convolved with the filters, or as 2D data, in which case
     the ``input_shape`` argument must be specified.
 
+    All the images of a batch are convolved at once. In the 'fft' approach
+    the spectra of the filters are computed only once for each input shape,
+    the images are transformed together and multiplied with all the filter
+    spectra at the same time. In the 'linear' approach small filters are
+    applied with a single matrix product on the image patches (im2col).
+    The images can be processed in blocks by a pool of threads.
+
     This node depends on ``scipy``.
     """
 
@@ -29,7 +66,7 @@ def __init__(self, filters, input_shape = None,
                  approach = 'fft',
                  mode = 'full', boundary = 'fill', fillvalue = 0,
                  output_2d = True,
-                 input_dim = None, dtype = None):
+                 input_dim = None, dtype = None, n_threads = 1):
         """
         Input arguments:
 
@@ -66,6 +103,10 @@ def __init__(self, filters, input_shape = None,
                      filter_nr: index of convolution filter
                      idx: data point index
                      x, y: 2D coordinates
+
+        n_threads -- Number of threads used to process blocks of images
+                     in parallel
+                     (*Default* = 1)
         """
         super(Convolution2DNode, self).__init__(input_dim=input_dim,
                                               dtype=dtype)
@@ -85,6 +126,7 @@ def __init__(self, filters, input_shape = None,
         self.boundary = boundary
         self.fillvalue = fillvalue
         self.output_2d = output_2d
+        self.n_threads = n_threads
         self._output_shape = None
 
     # ------- class properties
@@ -98,6 +140,8 @@ def set_filters(self, filters):
             raise NodeException('Filters must be specified in a 3-dim array, with each '+
                                 'filter on a different row')
         self._filters = filters
+        # filter spectra for the 'fft' approach, for each input shape
+        self._spectra = {}
 
     filters = property(get_filters, set_filters)
 
@@ -199,26 +243,110 @@ def _pre_execution_checks(self, x):
             error_str = "x must have at least one observation (zero given)"
             raise NodeException(error_str)
 
+    def _get_spectra(self, input_shape):
+        """Return the spectra of the filters for the given input shape."""
+        if input_shape not in self._spectra:
+            fft_shape = self._full_shape(input_shape)
+            self._spectra[input_shape] = _fft2(self.filters, fft_shape)
+        return self._spectra[input_shape]
+
+    def _full_shape(self, input_shape):
+        """Return the shape of the output in 'full' mode."""
+        return (input_shape[0]+self.filters.shape[1]-1,
+                input_shape[1]+self.filters.shape[2]-1)
+
+    def _output_offset(self):
+        """Return the position of the output in the 'full' output."""
+        if self.mode == 'full':
+            return (0, 0)
+        elif self.mode == 'same':
+            return ((self.filters.shape[1]-1)//2,
+                    (self.filters.shape[2]-1)//2)
+        else: # mode == 'valid'
+            return (self.filters.shape[1]-1, self.filters.shape[2]-1)
+
+    def _fft_convolve(self, x, y):
+        """Convolve the images x with all the filters, store the result in y.
+        """
+        input_shape = x.shape[1:]
+        fft_shape = self._full_shape(input_shape)
+        spectra = self._get_spectra(input_shape)
+        r0, c0 = self._output_offset()
+        r1, c1 = r0 + y.shape[2], c0 + y.shape[3]
+        # all the images times all the filters, with one inverse transform
+        spectrum = _fft2(x, fft_shape)[:, numx.newaxis]
+        y[...] = _ifft2(spectrum * spectra, fft_shape)[:, :, r0:r1, c0:c1]
+
+    def _im2col_convolve(self, x, y):
+        """Convolve the images x with all the filters, store the result in y.
+        """
+        filters = self.filters
+        nfilters, fh, fw = filters.shape
+        if self.mode == 'valid':
+            padded = x
+        else:
+            pad = ((0, 0), (fh-1, fh-1), (fw-1, fw-1))
+            if self.boundary == 'fill':
+                padded = numx.pad(x, pad, mode='constant',
+                                  constant_values=self.fillvalue)
+            else:
+                padded = numx.pad(x, pad, mode=_PAD_MODES[self.boundary])
+            r0, c0 = self._output_offset()
+            padded = padded[:, r0:r0+y.shape[2]+fh-1, c0:c0+y.shape[3]+fw-1]
+        padded = numx.ascontiguousarray(padded)
+        # view on all the image patches
+        n, h, w = y.shape[0], y.shape[2], y.shape[3]
+        strides = padded.strides
+        patches = utils.as_strided(padded, shape=(n, h, w, fh, fw),
+                                   strides=strides[:3]+strides[1:])
+        # the convolution is a correlation with the flipped filters
+        flipped = filters[:, ::-1, ::-1].reshape(nfilters, fh*fw)
+        cols = patches.reshape(n*h*w, fh*fw)
+        result = utils.mult(cols, flipped.T).reshape(n, h, w, nfilters)
+        y[...] = result.transpose(0, 3, 1, 2)
+
+    def _convolve(self, x, y):
+        """Convolve the images x with all the filters, store the result in y.
+        """
+        if self.approach == 'fft':
+            self._fft_convolve(x, y)
+        elif (self.filters.shape[1]*self.filters.shape[2] <=
+              _IM2COL_MAX_FILTER_SIZE):
+            self._im2col_convolve(x, y)
+        else:
+            for n_im, im in enumerate(x):
+                for n_flt, flt in enumerate(self.filters):
+                    y[n_im,n_flt,:,:] = signal.convolve2d(
+                                                im, flt, mode=self.mode,
+                                                boundary=self.boundary,
+                                                fillvalue=self.fillvalue)
+
+    def _block_length(self, input_shape):
+        """Return the number of images that are convolved at once."""
+        filters = self.filters
+        if self.approach == 'fft':
+            fft_shape = self._full_shape(input_shape)
+            n_freqs = fft_shape[1]//2+1 if _REAL_FFT else fft_shape[1]
+            size = filters.shape[0] * fft_shape[0] * n_freqs
+            return max(1, _FFT_BLOCK_SIZE // size)
+        else:
+            size = (numx.prod(self._output_shape) *
+                    filters.shape[1] * filters.shape[2])
+            return max(1, _IM2COL_BLOCK_SIZE // size)
+
     def _execute(self, x):
-        is_2d = x.ndim==2
         output_shape, input_shape = self._output_shape, self._input_shape
-        filters = self.filters
-        nfilters = filters.shape[0]
+        input_shape = tuple(input_shape)
+        x = x.reshape((x.shape[0],) + input_shape)
+        nfilters = self.filters.shape[0]
 
-        # XXX depends on convolution
         y = numx.empty((x.shape[0], nfilters,
                         output_shape[0], output_shape[1]), dtype=self.dtype)
-        for n_im, im in enumerate(x):
-            if is_2d:
-                im = im.reshape(input_shape)
-            for n_flt, flt in enumerate(filters):
-                if self.approach == 'fft':
-                    y[n_im,n_flt,:,:] = signal.fftconvolve(im, flt, mode=self.mode)
-                elif self.approach == 'linear':
-                    y[n_im,n_flt,:,:] = signal.convolve2d(im, flt,
-                                                          mode=self.mode,
-                                                          boundary=self.boundary,
-                                                          fillvalue=self.fillvalue)
+        block = self._block_length(input_shape)
+        blocks = [slice(start, start+block)
+                  for start in range(0, x.shape[0], block)]
+        utils.thread_map(lambda b: self._convolve(x[b], y[b]), blocks,
+                         self.n_threads)
 
         # reshape if necessary
         if self.output_2d:
@@ -49,6 +49,10 @@ def __init__(self, input_dim=None, output_dim=None, dtype=None):
         self._S_W = None
         # covariance matrix of the full data distribution
         self._allcov = mdp.utils.CovarianceMatrix(dtype=self.dtype)
+        # number of points and sums of each class, maps the labels to
+        # integer codes
+        self._class_stats = None
+        self._class_means = None
         self.means = {}  # maps class labels to the class means
         self.tlens = {}  # maps class labels to number of training points
         self.v = None  # transposed of the projection matrix
@@ -65,31 +69,19 @@ def _check_train_args(self, x, labels):
 
     def _train_means(self, x, labels):
         """Gather data to compute the means and number of elements."""
-        if isinstance(labels, (list, tuple, numx.ndarray)):
-            labels_ = numx.asarray(labels)
-            for label in set(labels_):
-                # group for class
-                x_label = numx.compress(labels_==label, x, axis=0)
-                self._update_means(x_label, label)
-        else:
-            self._update_means(x, labels)
+        if self._class_stats is None:
+            self._class_stats = mdp.utils.ClassStatistics(dtype=self.dtype)
+        self._class_stats.update(x, labels)
 
     def _stop_means(self):
         """Calculate the class means."""
-        for label in self.means:
-            self.means[label] /= self.tlens[label]
-
-    def _update_means(self, x, label):
-        """Update the internal variables that store the data for the means.
-
-        x -- Data points from a single class.
-        label -- The label for that class.
-        """
-        if label not in self.means:
-            self.means[label] = numx.zeros((1, self.input_dim), dtype=self.dtype)
-            self.tlens[label] = 0
-        self.means[label] += x.sum(axis=0)
-        self.tlens[label] += x.shape[0]
+        stats = self._class_stats
+        # class means as a 2D array, indexed by the label codes
+        self._class_means = stats.get_means()
+        tlens = stats.get_counts()
+        for code, label in enumerate(stats.labels):
+            self.means[label] = self._class_means[code:code+1]
+            self.tlens[label] = int(tlens[code])
 
     # Training step 2: compute the overall and within-class covariance
     # matrices and solve the FDA problem
@@ -101,16 +93,15 @@ def _train_fda(self, x, labels):
                                    dtype=self.dtype)
         # update the covariance matrix of all classes
         self._allcov.update(x)
-        # if labels is a number, all x's belong to the same class
+        # center each point on its class mean and update the within-class
+        # covariance with a single matrix product
         if isinstance(labels, (list, tuple, numx.ndarray)):
-            labels_ = numx.asarray(labels)
-            # get all classes from labels
-            for label in set(labels_):
-                # group for class
-                x_label = numx.compress(labels_==label, x, axis=0)
-                self._update_SW(x_label, label)
+            codes = self._class_stats.encode(labels, add=False)
+            x = x - self._class_means[codes]
         else:
-            self._update_SW(x, labels)
+            # if labels is a number, all x's belong to the same class
+            x = x - self.means[labels]
+        self._S_W += mdp.utils.mult(x.T, x)
 
     def _stop_fda(self):
         """Solve the eigenvalue problem for the total covariance."""
@@ -118,6 +109,8 @@ def _stop_fda(self):
         del self._allcov
         S_W = self._S_W
         del self._S_W
+        del self._class_stats
+        del self._class_means
         # solve the generalized eigenvalue problem
         # the eigenvalues are already ordered in ascending order
         if self.output_dim is None:
@@ -127,15 +120,6 @@ def _stop_fda(self):
             rng = (1, self.output_dim)
         self.v = mdp.utils.symeig(S_W, S_T, range=rng, overwrite = 1)[1]
 
-    def _update_SW(self, x, label):
-        """Update the covariance matrix of the class means.
-
-        x -- Data points from a single class.
-        label -- The label for that class.
-        """
-        x = x - self.means[label]
-        self._S_W += mdp.utils.mult(x.T, x)
-    
     # Overwrite the standard methods
     
     # dummy method used to overwrite the train docstring
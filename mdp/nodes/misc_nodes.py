@@ -4,7 +4,9 @@
 
 import mdp
 from mdp import numx, utils, Node, NodeException, PreserveDimNode
+from numpy.lib import format as npy_format
 
+import struct
 import cPickle as pickle
 import pickle as real_pickle
 
@@ -25,17 +27,28 @@ def _get_supported_dtypes(self):
     def is_trainable():
         return False
 
-class OneDimensionalHitParade(object):
+class HitParade(object):
     """
     Class to produce hit-parades (i.e., a list of the largest
-    and smallest values) out of a one-dimensional time-series.
+    and smallest values) out of a multi-dimensional time-series.
+
+    Each column of the time-series is analyzed independently, but all
+    the columns are processed at once with array operations.
+    Hits are selected greedily: the largest (smallest) value is taken
+    first, then all the values closer than the minimum gap to it are
+    discarded, and so on. Since every hit discards at most 2d
+    neighbours, the n hits are always among the n*(2d+1) most extreme
+    values. These candidates are kept over all the chunks (for every
+    chunk they are found with ``argpartition``), so the result is the
+    same as for the whole time-series at once.
     """
-    
-    def __init__(self, n, d, real_dtype="d", integer_dtype="l"):
+
+    def __init__(self, n, d, cols=1, real_dtype="d", integer_dtype="l"):
         """
         Input arguments:
         n -- Number of maxima and minima to remember
         d -- Minimum gap between two hits
+        cols -- Number of columns of the time-series
 
         real_dtype -- dtype of sequence items
         integer_dtype -- dtype of sequence indices
@@ -43,21 +56,149 @@ def __init__(self, n, d, real_dtype="d", integer_dtype="l"):
         """
         self.n = int(n)
         self.d = int(d)
-        self.iM = numx.zeros((n, ), dtype=integer_dtype)
-        self.im = numx.zeros((n, ), dtype=integer_dtype)
-        
+        self.cols = int(cols)
+        self.iM = numx.zeros((n, cols), dtype=integer_dtype)
+        self.im = numx.zeros((n, cols), dtype=integer_dtype)
+
         real_dtype = numx.dtype(real_dtype)
         if real_dtype in mdp.utils.get_dtypes('AllInteger'):
-            max_num = numx.iinfo(real_dtype).max
-            min_num = numx.iinfo(real_dtype).min
+            self._max_num = numx.iinfo(real_dtype).max
+            self._min_num = numx.iinfo(real_dtype).min
+        else:
+            self._max_num = numx.finfo(real_dtype).max
+            self._min_num = numx.finfo(real_dtype).min
+        self.M = numx.zeros((n, cols), dtype=real_dtype) + self._min_num
+        self.m = numx.zeros((n, cols), dtype=real_dtype) + self._max_num
+        # flags marking which entries of the hit-parades are actual hits
+        self.vM = numx.zeros((n, cols), dtype=bool)
+        self.vm = numx.zeros((n, cols), dtype=bool)
+        # the most extreme values seen so far and their indices, sorted
+        # like the hits
+        self._n_cand = self.n*(2*self.d+1)
+        self._cM = self._icM = None
+        self._cm = self._icm = None
+
+    def update(self, inp):
+        """
+        Input arguments:
+        inp -- tuple (time-series, time-indices)
+        """
+        (x, ix) = inp
+        if x.shape[0] == 0:
+            return
+        ix = numx.asarray(ix).astype(self.iM.dtype)
+        self._cM, self._icM = self._candidates(self._cM, self._icM,
+                                               x, ix, True)
+        self._cm, self._icm = self._candidates(self._cm, self._icm,
+                                               x, ix, False)
+        self.M, self.iM, self.vM = self._select(self._cM, self._icM,
+                                                self._min_num)
+        self.m, self.im, self.vm = self._select(self._cm, self._icm,
+                                                self._max_num)
+
+    def _sort_order(self, values, indices, largest):
+        """Return the order of the values along the first axis.
+
+        Ties are resolved in favour of the earliest index.
+        """
+        if largest:
+            return numx.lexsort((-indices, values), axis=0)[::-1]
+        return numx.lexsort((indices, values), axis=0)
+
+    def _chunk_candidates(self, x, ix, k, largest):
+        """Return the rows of the k most extreme values in each column."""
+        rows = x.shape[0]
+        cols_idx = numx.arange(self.cols)
+        if k == rows:
+            return (numx.arange(rows)[:, numx.newaxis] +
+                    numx.zeros((1, self.cols), dtype='l'))
+        if largest:
+            part = numx.argpartition(x, rows-k, axis=0)
+            n_extreme = (x >= x[part[rows-k], cols_idx]).sum(axis=0)
+            part = part[rows-k:]
         else:
-            max_num = numx.finfo(real_dtype).max
-            min_num = numx.finfo(real_dtype).min
-        self.M = numx.array([min_num]*n, dtype=real_dtype)
-        self.m = numx.array([max_num]*n, dtype=real_dtype)
-        
-        self.lM = 0
-        self.lm = 0
+            part = numx.argpartition(x, k-1, axis=0)
+            n_extreme = (x <= x[part[k-1], cols_idx]).sum(axis=0)
+            part = part[:k]
+        if (n_extreme == k).all():
+            return part
+        # ties at the border of the partition, the earliest of the tied
+        # values must be taken
+        indices = numx.zeros(x.shape, dtype=ix.dtype) + ix[:, numx.newaxis]
+        return self._sort_order(x, indices, largest)[:k]
+
+    def _candidates(self, cand, icand, x, ix, largest):
+        """Merge the candidates with the most extreme values of a chunk.
+
+        Return the new (candidates, indices) tuple.
+        """
+        cols_idx = numx.arange(self.cols)
+        rows = self._chunk_candidates(x, ix,
+                                      min(x.shape[0], self._n_cand), largest)
+        values = x[rows, cols_idx]
+        indices = ix[rows]
+        if cand is not None:
+            values = numx.concatenate((cand, values))
+            indices = numx.concatenate((icand, indices))
+        order = self._sort_order(values, indices, largest)[:self._n_cand]
+        return values[order, cols_idx], indices[order, cols_idx]
+
+    def _select(self, values, indices, fill):
+        """Select the hits greedily from the sorted candidates.
+
+        Return the (hits, indices, valid) tuple.
+        """
+        n, d = self.n, self.d
+        cols_idx = numx.arange(self.cols)
+        hits = numx.zeros((n, self.cols), dtype=values.dtype) + fill
+        ihits = numx.zeros((n, self.cols), dtype=indices.dtype)
+        valid_hits = numx.zeros((n, self.cols), dtype=bool)
+        valid = numx.ones(values.shape, dtype=bool)
+        for j in xrange(n):
+            first = valid.argmax(axis=0)
+            ok = valid[first, cols_idx]
+            if not ok.any():
+                break
+            hits[j, ok] = values[first, cols_idx][ok]
+            ihits[j, ok] = indices[first, cols_idx][ok]
+            valid_hits[j] = ok
+            # discard the candidates within the gap of the new hits
+            valid &= (abs(indices - ihits[j]) > d) | ~ok
+        return hits, ihits, valid_hits
+
+    def get_maxima(self):
+        """
+        Return the tuple (maxima, time-indices).
+        Maxima are sorted in descending order.
+        """
+        return self.M.copy(), self.iM.copy()
+
+    def get_minima(self):
+        """
+        Return the tuple (minima, time-indices).
+        Minima are sorted in ascending order.
+        """
+        return self.m.copy(), self.im.copy()
+
+
+class OneDimensionalHitParade(HitParade):
+    """
+    Class to produce hit-parades (i.e., a list of the largest
+    and smallest values) out of a one-dimensional time-series.
+    """
+
+    def __init__(self, n, d, real_dtype="d", integer_dtype="l"):
+        """
+        Input arguments:
+        n -- Number of maxima and minima to remember
+        d -- Minimum gap between two hits
+
+        real_dtype -- dtype of sequence items
+        integer_dtype -- dtype of sequence indices
+        Note: be careful with dtypes!
+        """
+        super(OneDimensionalHitParade, self).__init__(n, d, 1, real_dtype,
+                                                      integer_dtype)
 
     def update(self, inp):
         """
@@ -65,59 +206,22 @@ def update(self, inp):
         inp -- tuple (time-series, time-indices)
         """
         (x, ix) = inp
-        rows = len(x)
-        d = self.d
-        M = self.M
-        m = self.m
-        iM = self.iM
-        im = self.im
-        lM = self.lM
-        lm = self.lm
-        for i in xrange(rows):
-            k1 = M.argmin()
-            k2 = m.argmax()
-            if x[i] > M[k1]:
-                if ix[i]-iM[lM] <= d and x[i] > M[lM]:
-                    M[lM] = x[i]
-                    iM[lM] = ix[i]
-                elif ix[i]-iM[lM] > d:
-                    M[k1] = x[i]
-                    iM[k1] = ix[i]
-                    lM = k1
-            if x[i] < m[k2]:
-                if ix[i]-im[lm] <= d and x[i] < m[lm]:
-                    m[lm] = x[i]
-                    im[lm] = ix[i]
-                elif ix[i]-im[lm] > d:
-                    m[k2] = x[i]
-                    im[k2] = ix[i]
-                    lm = k2
-        self.M = M
-        self.m = m
-        self.iM = iM
-        self.im = im
-        self.lM = lM
-        self.lm = lm
+        super(OneDimensionalHitParade, self).update((x[:, numx.newaxis],
+                                                     ix))
 
     def get_maxima(self):
         """
         Return the tuple (maxima, time-indices).
         Maxima are sorted in descending order.
         """
-        iM = self.iM
-        M = self.M
-        sort = M.argsort()
-        return M[sort[::-1]], iM[sort[::-1]]
+        return self.M[:, 0].copy(), self.iM[:, 0].copy()
 
     def get_minima(self):
         """
         Return the tuple (minima, time-indices).
         Minima are sorted in ascending order.
         """
-        im = self.im
-        m = self.m
-        sort = m.argsort()
-        return m[sort], im[sort]
+        return self.m[:, 0].copy(), self.im[:, 0].copy()
 
 
 class HitParadeNode(PreserveDimNode):
@@ -154,17 +258,11 @@ def _get_supported_dtypes(self):
                 mdp.utils.get_dtypes('AllInteger'))
 
     def _train(self, x):
-        hit = self.hit
-        old_tlen = self.tlen
-        if hit is None:
-            hit = [OneDimensionalHitParade(self.n, self.d, self.dtype,
-                                           self.itype)
-                   for c in range(self.input_dim)]
-        tlen = old_tlen + x.shape[0]
-        indices = numx.arange(old_tlen, tlen)
-        for c in range(self.input_dim):
-            hit[c].update((x[:, c], indices))
-        self.hit = hit
+        if self.hit is None:
+            self.hit = HitParade(self.n, self.d, self.input_dim, self.dtype,
+                                 self.itype)
+        tlen = self.tlen + x.shape[0]
+        self.hit.update((x, numx.arange(self.tlen, tlen)))
         self.tlen = tlen
 
     def get_maxima(self):
@@ -176,14 +274,7 @@ def get_maxima(self):
         stop_training.
         """
         self._if_training_stop_training()
-        cols = self.input_dim
-        n = self.n
-        hit = self.hit
-        iM = numx.zeros((n, cols), dtype=self.itype)
-        M = numx.ones((n, cols), dtype=self.dtype)
-        for c in range(cols):
-            M[:, c], iM[:, c] = hit[c].get_maxima()
-        return M, iM
+        return self.hit.get_maxima()
 
     def get_minima(self):
         """
@@ -194,14 +285,7 @@ def get_minima(self):
         stop_training.
         """
         self._if_training_stop_training()
-        cols = self.input_dim
-        n = self.n
-        hit = self.hit
-        im = numx.zeros((n, cols), dtype=self.itype)
-        m = numx.ones((n, cols), dtype=self.dtype)
-        for c in range(cols):
-            m[:, c], im[:, c] = hit[c].get_minima()
-        return m, im
+        return self.hit.get_minima()
 
 class TimeFramesNode(Node):
     """Copy delayed version of the input signal on the space dimensions.
@@ -221,20 +305,32 @@ class TimeFramesNode(Node):
     It is not always possible to invert this transformation (the
     transformation is not surjective. However, the ``pseudo_inverse``
     method does the correct thing when it is indeed possible.
+
+    The delayed copies can be expensive for a large number of time
+    frames. If ``view`` is True, ``execute`` returns a read-only view
+    on the input data whenever its memory layout allows it (e.g. for
+    C-contiguous data and ``gap=1``). Note that such a view shares its
+    memory with the input array. The methods ``execute_mult`` and
+    ``execute_moments`` compute projections and covariance statistics of
+    the output directly from the input data, without ever building the
+    delayed copies.
     """
 
     def __init__(self, time_frames, gap=1,
-                 input_dim=None, dtype=None):
+                 input_dim=None, dtype=None, view=False):
         """
         Input arguments:
         time_frames -- Number of delayed copies
         gap -- Time delay between the copies
+        view -- If True, return a read-only strided view on the input
+                data instead of a copy whenever possible
         """
         self.time_frames = time_frames
         super(TimeFramesNode, self).__init__(input_dim=input_dim,
                                              output_dim=None,
                                              dtype=dtype)
         self.gap = gap
+        self.view = view
 
     def _get_supported_dtypes(self):
         """Return the list of dtypes supported by this node."""
@@ -258,16 +354,94 @@ def _set_output_dim(self, n):
         msg = 'Output dim can not be explicitly set!'
         raise NodeException(msg)
 
+    def _frame_layout(self, rows):
+        """Return the layout of the output for an input with ``rows`` rows.
+
+        The layout is a tuple ``(out_rows, frames)``, where ``frames``
+        contains a tuple ``(start, stop, shift)`` for every time frame:
+        the output rows ``start:stop`` of the frame are a copy of the
+        input rows ``start+shift:stop+shift``, the other rows are zero.
+        """
+        tf = rows - (self.time_frames-1)*self.gap
+        return tf, [(0, tf, self.gap*frame)
+                    for frame in range(self.time_frames)]
+
+    def _strided_view(self, x):
+        """Return the output as a read-only view on x, or None if the
+        memory layout of x does not allow it."""
+        out_rows, frames = self._frame_layout(x.shape[0])
+        n = self.input_dim
+        row_stride, col_stride = x.strides
+        for frame, (start, stop, shift) in enumerate(frames):
+            if (start != 0 or stop != out_rows or
+                shift*row_stride != frame*n*col_stride):
+                return None
+        y = utils.as_strided(x, shape=(out_rows, self.output_dim),
+                             strides=x.strides)
+        y.flags.writeable = False
+        return y
+
     def _execute(self, x):
-        gap = self.gap
-        tf = x.shape[0] - (self.time_frames-1)*gap
-        rows = self.input_dim
-        cols = self.output_dim
-        y = numx.zeros((tf, cols), dtype=self.dtype)
-        for frame in range(self.time_frames):
-            y[:, frame*rows:(frame+1)*rows] = x[gap*frame:gap*frame+tf, :]
+        if self.view:
+            y = self._strided_view(x)
+            if y is not None:
+                return y
+        n = self.input_dim
+        out_rows, frames = self._frame_layout(x.shape[0])
+        y = numx.zeros((out_rows, self.output_dim), dtype=self.dtype)
+        for frame, (start, stop, shift) in enumerate(frames):
+            y[start:stop, frame*n:(frame+1)*n] = x[start+shift:stop+shift, :]
         return y
 
+    def execute_mult(self, x, matrix):
+        """Return ``mult(self.execute(x), matrix)``.
+
+        The product is computed frame by frame from the input data,
+        without creating the delayed copies of the signal.
+        """
+        self._pre_execution_checks(x)
+        x = self._refcast(x)
+        n = self.input_dim
+        out_rows, frames = self._frame_layout(x.shape[0])
+        y = numx.zeros((out_rows, matrix.shape[1]),
+                       dtype=numx.promote_types(self.dtype, matrix.dtype))
+        for frame, (start, stop, shift) in enumerate(frames):
+            if start < stop:
+                y[start:stop, :] += utils.mult(x[start+shift:stop+shift],
+                                               matrix[frame*n:(frame+1)*n])
+        return y
+
+    def execute_moments(self, x):
+        """Return the first and second moments of ``self.execute(x)``.
+
+        The return value is the tuple ``(mtx, avg, tlen)``, where ``mtx``
+        is the sum of the outer products of the output rows, ``avg`` is
+        the sum of the output rows and ``tlen`` the number of output rows.
+        They can be accumulated over several chunks to compute the
+        covariance matrix of the output. The statistics are computed block
+        by block from the input data, without creating the delayed copies
+        of the signal.
+        """
+        self._pre_execution_checks(x)
+        x = self._refcast(x)
+        n = self.input_dim
+        out_rows, frames = self._frame_layout(x.shape[0])
+        dim = self.output_dim
+        mtx = numx.zeros((dim, dim), dtype=self.dtype)
+        avg = numx.zeros((dim,), dtype=self.dtype)
+        for i, (start_i, stop_i, shift_i) in enumerate(frames):
+            avg[i*n:(i+1)*n] = x[start_i+shift_i:stop_i+shift_i].sum(axis=0)
+            for j in range(i, len(frames)):
+                start_j, stop_j, shift_j = frames[j]
+                start, stop = max(start_i, start_j), min(stop_i, stop_j)
+                if start >= stop:
+                    continue
+                block = utils.mult(x[start+shift_i:stop+shift_i, :].T,
+                                   x[start+shift_j:stop+shift_j, :])
+                mtx[i*n:(i+1)*n, j*n:(j+1)*n] = block
+                mtx[j*n:(j+1)*n, i*n:(i+1)*n] = block.T
+        return mtx, avg, out_rows
+
     def pseudo_inverse(self, y):
         """This function returns a pseudo-inverse of the execute frame.
         y == execute(x) only if y belongs to the domain of execute and
@@ -325,6 +499,10 @@ class TimeDelayNode(TimeFramesNode):
     This node provides similar functionality as the ``TimeFramesNode``, only
     that it performs a time embedding into the past rather than into the future.
 
+    Because of the zero padding the output can only be a view on the input
+    for ``time_frames=1``, but the methods ``execute_mult`` and
+    ``execute_moments`` are available to avoid the delayed copies.
+
     See ``TimeDelaySlidingWindowNode`` for a sliding window delay node for
     application in a non-batch manner.
 
@@ -332,27 +510,21 @@ class TimeDelayNode(TimeFramesNode):
     Dec 31, 2010
     """
 
-    def __init__(self, time_frames, gap=1, input_dim=None, dtype=None):
+    def __init__(self, time_frames, gap=1, input_dim=None, dtype=None,
+                 view=False):
         """
         Input arguments:
         time_frames -- Number of delayed copies
         gap -- Time delay between the copies
+        view -- If True, return a read-only strided view on the input
+                data instead of a copy whenever possible
         """
         super(TimeDelayNode, self).__init__(time_frames, gap,
-                                            input_dim, dtype)
+                                            input_dim, dtype, view)
 
-    def _execute(self, x):
-        gap = self.gap
-        rows = x.shape[0]
-        cols = self.output_dim
-        n = self.input_dim
-
-        y = numx.zeros((rows, cols), dtype=self.dtype)
-
-        for frame in range(self.time_frames):
-            y[gap*frame:, frame*n:(frame+1)*n] = x[:rows-gap*frame, :]
-
-        return y
+    def _frame_layout(self, rows):
+        return rows, [(min(self.gap*frame, rows), rows, -self.gap*frame)
+                      for frame in range(self.time_frames)]
 
     def pseudo_inverse(self, y):
         raise NotImplementedError
@@ -362,11 +534,15 @@ class TimeDelaySlidingWindowNode(TimeDelayNode):
     ``TimeDelaySlidingWindowNode`` is an alternative to ``TimeDelayNode``
     which should be used for online learning/execution. Whereas the
     ``TimeDelayNode`` works in a batch manner, for online application
-    a sliding window is necessary which yields only one row per call.
+    a sliding window is necessary which remembers the last samples
+    across calls.
 
     Applied to the same data the collection of all returned rows of the
     ``TimeDelaySlidingWindowNode`` is equivalent to the result of the
-    ``TimeDelayNode``.
+    ``TimeDelayNode``, no matter how the data is split in chunks.
+    The sliding window is a circular buffer holding the last
+    ``(time_frames-1)*gap`` samples. Use ``reset`` to start with a new
+    signal.
 
     Original code contributed by Sebastian Hoefer.
     Dec 31, 2010
@@ -383,45 +559,71 @@ def __init__(self, time_frames, gap=1, input_dim=None, dtype=None):
         super(TimeDelaySlidingWindowNode, self).__init__(time_frames, gap,
                                                          input_dim, dtype)
         self.sliding_wnd = None
+        # number of samples seen so far, the head of the circular
+        # buffer is at position cur_idx % len(sliding_wnd)
         self.cur_idx = 0
-        self.slide = False
 
     def _init_sliding_window(self):
-        rows = self.gap+1
-        cols = self.input_dim*self.time_frames
-        self.sliding_wnd = numx.zeros((rows, cols), dtype=self.dtype)
+        rows = (self.time_frames-1)*self.gap
+        self.sliding_wnd = numx.zeros((rows, self.input_dim),
+                                      dtype=self.dtype)
 
-    def _execute(self, x):
-        assert x.shape[0] == 1
+    def reset(self):
+        """Clear the sliding window, i.e. start with a new signal."""
+        self.sliding_wnd = None
+        self.cur_idx = 0
 
-        if self.sliding_wnd == None:
+    def _execute(self, x):
+        if self.sliding_wnd is None:
             self._init_sliding_window()
 
         gap = self.gap
-        rows = self.sliding_wnd.shape[0]
-        cols = self.output_dim
+        rows = x.shape[0]
         n = self.input_dim
+        wnd = self.sliding_wnd
+        wnd_len = wnd.shape[0]
 
-        new_row = numx.zeros(cols, dtype=self.dtype)
-        new_row[:n] = x
+        y = numx.zeros((rows, self.output_dim), dtype=self.dtype)
+        for frame in range(self.time_frames):
+            delay = gap*frame
+            cols = slice(frame*n, (frame+1)*n)
+            # Delay within the current chunk
+            if delay < rows:
+                y[delay:, cols] = x[:rows-delay, :]
+            # Delay from the samples of the previous calls. Samples before
+            # the first call are zero, as the buffer is initialized so.
+            past = min(delay, rows)
+            if past:
+                idx = (self.cur_idx + numx.arange(past) - delay) % wnd_len
+                y[:past, cols] = wnd[idx, :]
+
+        # Add the newest samples to the circular buffer
+        if wnd_len:
+            new = min(rows, wnd_len)
+            idx = (self.cur_idx + numx.arange(rows-new, rows)) % wnd_len
+            wnd[idx, :] = x[rows-new:, :]
+        self.cur_idx += rows
 
-        # Slide
-        if self.slide:
-            self.sliding_wnd[:-1, :] = self.sliding_wnd[1:, :]
+        return y
 
-        # Delay
-        if self.cur_idx-gap >= 0:
-            new_row[n:] = self.sliding_wnd[self.cur_idx-gap, :-n]
+    def execute_mult(self, x, matrix):
+        """Return ``mult(self.execute(x), matrix)``.
 
-        # Add new row to matrix
-        self.sliding_wnd[self.cur_idx, :] = new_row
+        The delayed samples come from the sliding window, so unlike in
+        ``TimeDelayNode`` the output is built by ``execute`` (which also
+        updates the sliding window).
+        """
+        return utils.mult(self.execute(x), matrix)
 
-        if self.cur_idx < rows-1:
-            self.cur_idx = self.cur_idx+1 
-        else:
-            self.slide = True
+    def execute_moments(self, x):
+        """Return the first and second moments of ``self.execute(x)``.
 
-        return new_row[numx.newaxis,:]
+        See ``TimeFramesNode.execute_moments``, the statistics are
+        computed from the output of ``execute`` (which also updates the
+        sliding window).
+        """
+        y = self.execute(x)
+        return utils.mult(y.T, y), y.sum(axis=0), y.shape[0]
 
 class EtaComputerNode(Node):
     """Compute the eta values of the normalized training data.
@@ -684,17 +886,39 @@ def _execute(self, x):
         return x
 
 
+# total length in bytes of the header of the .npy files written by
+# HistogramNode, large enough for any shape and dtype description
+_NPY_HEADER_LEN = 128
+
+def _npy_header(dtype, shape):
+    """Return a fixed-length .npy header for an array of the given shape."""
+    header = ("{'descr': %r, 'fortran_order': False, 'shape': %r, }" %
+              (npy_format.dtype_to_descr(dtype), tuple(map(int, shape))))
+    magic = npy_format.magic(1, 0)
+    header = header.ljust(_NPY_HEADER_LEN - len(magic) - 3) + '\n'
+    return magic + struct.pack('<H', len(header)) + header
+
+
 class HistogramNode(PreserveDimNode):
     """Node which stores a history of the data during its training phase.
 
     The data history is stored in ``self.data_hist`` and can also be deleted to
     free memory. Alternatively it can be automatically pickled to disk.
 
+    Instead of the whole history, a fixed number of randomly chosen samples
+    can be stored (reservoir sampling, see ``reservoir_size``). Every
+    training sample then has the same probability of being part of the
+    history, independently from the length of the training data. The data
+    history can also be appended chunk by chunk to a ``.npy`` file on
+    disk (see ``hist_memmap_filename``), in which case ``self.data_hist``
+    is a read-only memory map of that file.
+
     Note that data is only stored during training.
     """
 
     def __init__(self, hist_fraction=1.0, hist_filename=None,
-                 input_dim=None, output_dim=None, dtype=None):
+                 input_dim=None, output_dim=None, dtype=None,
+                 reservoir_size=None, hist_memmap_filename=None):
         """Initialize the node.
 
         hist_fraction -- Defines the fraction of the data that is stored
@@ -704,12 +928,25 @@ def __init__(self, hist_fraction=1.0, hist_filename=None,
             is called and data_hist is then cleared (to free memory).
             If filename is None (default value) then data_hist is not cleared
             and can be directly used after training.
+        reservoir_size -- If not None, the maximum number of samples that
+            are stored. The samples are a uniform random sample of all the
+            training data (reservoir sampling).
+        hist_memmap_filename -- Filename of a .npy file to which the data
+            history is appended during training. The data history is then
+            a read-only memory map of this file. Can not be combined with
+            reservoir_size.
         """
         super(HistogramNode, self).__init__(input_dim=input_dim,
                                             output_dim=output_dim,
                                             dtype=dtype)
+        if reservoir_size is not None and hist_memmap_filename is not None:
+            err = ("reservoir_size and hist_memmap_filename can not be "
+                   "used together.")
+            raise NodeException(err)
         self._hist_filename = hist_filename
         self.hist_fraction = hist_fraction
+        self.reservoir_size = reservoir_size
+        self._hist_memmap_filename = hist_memmap_filename
         self.data_hist = None  # stores the data history
 
     def _get_supported_dtypes(self):
@@ -717,14 +954,87 @@ def _get_supported_dtypes(self):
                 mdp.utils.get_dtypes('AllInteger') +
                 mdp.utils.get_dtypes('Character'))
 
+    def _get_data_hist(self):
+        if self._hist_memmap_filename is not None:
+            if not self._hist_len:
+                return None
+            return numx.load(self._hist_memmap_filename, mmap_mode='r')
+        if self.reservoir_size is not None:
+            if self._reservoir is None:
+                return None
+            return self._reservoir[:min(self._hist_len, self.reservoir_size)]
+        if not self._hist_chunks:
+            return None
+        if len(self._hist_chunks) > 1:
+            # concatenate only once, when the history is accessed
+            self._hist_chunks = [numx.concatenate(self._hist_chunks)]
+        return self._hist_chunks[0]
+
+    def _set_data_hist(self, data_hist):
+        self._hist_chunks = []
+        self._reservoir = None
+        self._hist_len = 0
+        if data_hist is None:
+            return
+        if self._hist_memmap_filename is not None:
+            self._append_to_file(data_hist)
+        elif self.reservoir_size is not None:
+            self._update_reservoir(data_hist)
+        else:
+            self._hist_chunks = [data_hist]
+            self._hist_len = len(data_hist)
+
+    data_hist = property(_get_data_hist, _set_data_hist,
+                         doc="Array with the stored data history.")
+
+    def _append_to_file(self, x):
+        """Append the data to the .npy file and update its header."""
+        mode = "r+b" if self._hist_len else "wb"
+        npy_file = open(self._hist_memmap_filename, mode)
+        try:
+            npy_file.seek(0, 2)
+            if not self._hist_len:
+                npy_file.write(_npy_header(x.dtype, (0, x.shape[1])))
+            x.tofile(npy_file)
+            self._hist_len += len(x)
+            npy_file.seek(0)
+            npy_file.write(_npy_header(x.dtype, (self._hist_len, x.shape[1])))
+        finally:
+            npy_file.close()
+
+    def _update_reservoir(self, x):
+        """Update the reservoir with the samples in x."""
+        size = self.reservoir_size
+        if self._reservoir is None:
+            self._reservoir = numx.zeros((size, x.shape[1]), dtype=x.dtype)
+        # fill the empty slots
+        n_fill = max(0, min(size - self._hist_len, len(x)))
+        self._reservoir[self._hist_len:self._hist_len+n_fill] = x[:n_fill]
+        self._hist_len += n_fill
+        x = x[n_fill:]
+        if not len(x):
+            return
+        # the t-th sample replaces a random slot with probability size/t
+        seen = self._hist_len + numx.arange(1, len(x)+1)
+        slots = (mdp.numx_rand.random(len(x)) * seen).astype('l')
+        accepted = slots < size
+        slots, x = slots[accepted][::-1], x[accepted][::-1]
+        # later samples take precedence when they replace the same slot
+        slots, first = numx.unique(slots, return_index=True)
+        self._reservoir[slots] = x[first]
+        self._hist_len = int(seen[-1])
+
     def _train(self, x):
         """Store the history data."""
         if self.hist_fraction < 1.0:
-            x = x[numx.random.random(len(x)) < self.hist_fraction]
-        if self.data_hist is not None:
-            self.data_hist = numx.concatenate([self.data_hist, x])
+            x = x[mdp.numx_rand.random(len(x)) < self.hist_fraction]
+        if self._hist_memmap_filename is not None:
+            self._append_to_file(x)
+        elif self.reservoir_size is not None:
+            self._update_reservoir(x)
         else:
-            self.data_hist = x
+            self._hist_chunks.append(x)
+            self._hist_len += len(x)
 
     def _stop_training(self):
         """Pickle the histogram data to file and clear it if required."""
@@ -749,11 +1059,18 @@ class AdaptiveCutoffNode(HistogramNode):
 
     When ``stop_training`` is called the cutoff values for each coordinate are
     calculated based on the collected histogram data.
+
+    If ``quantile_eps`` is specified, no histogram data is stored. The
+    cutoff values are instead computed from a quantile sketch
+    (``mdp.utils.QuantileSketch``), which needs an amount of memory that is
+    independent of the number of training samples.
     """
 
     def __init__(self, lower_cutoff_fraction=None, upper_cutoff_fraction=None,
                  hist_fraction=1.0, hist_filename=None,
-                 input_dim=None, output_dim=None, dtype=None):
+                 input_dim=None, output_dim=None, dtype=None,
+                 reservoir_size=None, hist_memmap_filename=None,
+                 quantile_eps=None):
         """Initialize the node.
 
         :Parameters:
@@ -773,32 +1090,64 @@ def __init__(self, lower_cutoff_fraction=None, upper_cutoff_fraction=None,
             cleared (to free memory).  If filename is ``None``
             (default value) then ``data_hist`` is not cleared and can
             be directly used after training.
+          reservoir_size
+            If not ``None``, only a uniform random sample of this size is
+            stored for the histogram (see ``HistogramNode``).
+          hist_memmap_filename
+            Filename of a ``.npy`` file to which the histogram data is
+            appended during training (see ``HistogramNode``).
+          quantile_eps
+            If not ``None``, the cutoff values are computed with a quantile
+            sketch instead of the histogram data. The value is the
+            approximate error of the cutoff fractions.
         """
-        super(AdaptiveCutoffNode, self).__init__(hist_fraction=hist_fraction,
-                                                 hist_filename=hist_filename,
-                                                 input_dim=input_dim,
-                                                 output_dim=output_dim,
-                                                 dtype=dtype)
+        super(AdaptiveCutoffNode, self).__init__(
+                                    hist_fraction=hist_fraction,
+                                    hist_filename=hist_filename,
+                                    input_dim=input_dim,
+                                    output_dim=output_dim,
+                                    dtype=dtype,
+                                    reservoir_size=reservoir_size,
+                                    hist_memmap_filename=hist_memmap_filename)
         self.lower_cutoff_fraction = lower_cutoff_fraction
         self.upper_cutoff_fraction = upper_cutoff_fraction
         self.lower_bounds = None
         self.upper_bounds = None
-        
+        self.quantile_eps = quantile_eps
+        if quantile_eps is None:
+            self._sketch = None
+        else:
+            self._sketch = mdp.utils.QuantileSketch(eps=quantile_eps)
+
     def _get_supported_dtypes(self):
         return (mdp.utils.get_dtypes('Float') +
                 mdp.utils.get_dtypes('AllInteger'))
 
+    def _train(self, x):
+        """Update the quantile sketch or store the history data."""
+        if self._sketch is not None:
+            self._sketch.update(x)
+        else:
+            super(AdaptiveCutoffNode, self)._train(x)
+
     def _stop_training(self):
         """Calculate the cutoff bounds based on collected histogram data."""
-        if self.lower_cutoff_fraction or self.upper_cutoff_fraction:
+        if self._sketch is not None:
+            if self.lower_cutoff_fraction:
+                self.lower_bounds = self._sketch.quantile(
+                                                self.lower_cutoff_fraction)
+            if self.upper_cutoff_fraction:
+                self.upper_bounds = self._sketch.quantile(
+                                                1 - self.upper_cutoff_fraction)
+        elif self.lower_cutoff_fraction or self.upper_cutoff_fraction:
             sorted_data = self.data_hist.copy()
             sorted_data.sort(axis=0)
             if self.lower_cutoff_fraction:
-                index = self.lower_cutoff_fraction * len(sorted_data)
+                index = int(self.lower_cutoff_fraction * len(sorted_data))
                 self.lower_bounds = sorted_data[index]
             if self.upper_cutoff_fraction:
-                index = (len(sorted_data) -
-                         self.upper_cutoff_fraction * len(sorted_data))
+                index = int(len(sorted_data) -
+                            self.upper_cutoff_fraction * len(sorted_data))
                 self.upper_bounds = sorted_data[index]
         super(AdaptiveCutoffNode, self)._stop_training()
 
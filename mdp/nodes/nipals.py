@@ -1,10 +1,20 @@
 __docformat__ = "restructuredtext en"
 
-from mdp import numx, NodeException, Cumulator
-from mdp.utils import mult
+import os
+import tempfile
+
+import mdp
+from mdp import numx, numx_linalg, NodeException, Cumulator
+from mdp.utils import mult, symeig
 from mdp.nodes import PCANode
 sqrt = numx.sqrt
 
+# numpy and scipy use different names for the reduced QR decomposition
+if mdp.numx_description == 'scipy':
+    _QR_MODE = 'economic'
+else:
+    _QR_MODE = 'reduced'
+
 class NIPALSNode(Cumulator, PCANode):
     """Perform Principal Component Analysis using the NIPALS algorithm.
     This algorithm is particularyl useful if you have more variable than
@@ -40,11 +50,20 @@ class NIPALSNode(Cumulator, PCANode):
     Karhunen-Loeve transform can be found among others in
     I.T. Jolliffe, Principal Component Analysis, Springer-Verlag (1986).
 
+    If ``block_size`` is specified, ``block_size`` components are
+    extracted at the same time by a block power iteration, which only
+    needs matrix-matrix products. The previously found components are
+    projected out of the iterated block instead of being subtracted from
+    the data, so the training data is never modified and is read chunk by
+    chunk. With ``chunk_dir`` the training chunks are stored to disk
+    instead of being kept in memory.
+
     Original code contributed by:
     Michael Schmuker, Susanne Lezius, and Farzad Farkhooi (2008).
     """
     def __init__(self, input_dim=None, output_dim=None, dtype=None,
-                 conv = 1e-8, max_it = 100000):
+                 conv = 1e-8, max_it = 100000, block_size = None,
+                 chunk_dir = None):
         """
         The number of principal components to be kept can be specified as
         'output_dim' directly (e.g. 'output_dim=10' means 10 components
@@ -54,18 +73,44 @@ def __init__(self, input_dim=None, output_dim=None, dtype=None,
 
         Other Arguments:
            conv   - convergence threshold for the residual error.
+                    With 'block_size' it is the threshold for the sum of
+                    the squared sines of the angles between the subspaces
+                    of two successive iterations.
            max_it - maximum number of iterations
-
+           block_size - number of components which are extracted together
+                        by a block power iteration. If None (default),
+                        the components are extracted one at a time.
+           chunk_dir - only used with 'block_size'. If not None, the
+                       training chunks are saved as .npy files in a
+                       temporary directory inside 'chunk_dir' and read
+                       back from disk during stop_training.
         """
         super(NIPALSNode, self).__init__(input_dim, output_dim, dtype)
         self.conv = conv
         self.max_it = max_it
+        self.block_size = block_size
+        self.chunk_dir = chunk_dir
+        self._chunk_path = None
 
     def _train(self, x):
-        super(NIPALSNode, self)._train(x)
+        if self.block_size is not None and self.chunk_dir is not None:
+            if self._chunk_path is None:
+                self._chunk_path = tempfile.mkdtemp(prefix='MDPNIPALS_',
+                                                    dir=self.chunk_dir)
+            filename = os.path.join(self._chunk_path,
+                                    'chunk%d.npy' % len(self.data))
+            numx.save(filename, x)
+            self.data.append(filename)
+            self.tlen += x.shape[0]
+        else:
+            super(NIPALSNode, self)._train(x)
 
     def _stop_training(self, debug=False):
         # debug argument is ignored but needed by the base class
+        if self.block_size is not None:
+            self._adjust_output_dim()
+            self._stop_training_block()
+            return
         super(NIPALSNode, self)._stop_training()
         self._adjust_output_dim()
         if self.desired_variance is not None:
@@ -129,3 +174,106 @@ def _stop_training(self, debug=False):
         self.d = d[:self.output_dim]
         self.v = eigenv[:self.output_dim, :].T
         self.explained_variance = exp_var
+
+    def _chunks(self):
+        """Iterate over the training chunks, loading them from disk if
+        necessary."""
+        for chunk in self.data:
+            if isinstance(chunk, basestring):
+                chunk = numx.load(chunk, mmap_mode='r')
+            yield chunk
+
+    def _cov_mult(self, Q):
+        """Return mult(C, Q)*(tlen-1), C being the covariance matrix of the
+        training data. The data is read chunk by chunk and is not modified.
+        """
+        avg = self.avg
+        avg_Q = mult(avg, Q)
+        Z = numx.zeros(Q.shape, dtype=self.dtype)
+        for chunk in self._chunks():
+            Y = mult(chunk, Q) - avg_Q
+            Z += mult(chunk.T, Y)
+            Z -= numx.outer(avg, Y.sum(axis=0))
+        return Z
+
+    def _block_components(self, V, k):
+        """Return the next k eigenvalues and eigenvectors, orthogonal to
+        the eigenvectors in the columns of V.
+
+        The eigenvalues are scaled by (tlen-1).
+        """
+        def deflate(Z):
+            return Z - mult(V, mult(V.T, Z))
+        Q = deflate(mdp.numx_rand.normal(size=(self.input_dim, k)))
+        Q = numx_linalg.qr(Q.astype(self.dtype), mode=_QR_MODE)[0]
+        for it in range(self.max_it):
+            Q_new = numx_linalg.qr(deflate(self._cov_mult(Q)),
+                                   mode=_QR_MODE)[0]
+            # sum of the squared sines of the angles between the subspaces
+            overlap = mult(Q.T, Q_new)
+            diff = k - (overlap*overlap).sum()
+            Q = Q_new
+            if diff < self.conv:
+                break
+        else:
+            msg = ('PC#%d-%d: no convergence after %d iterations.' %
+                   (V.shape[1], V.shape[1]+k-1, self.max_it))
+            raise NodeException(msg)
+        # Rayleigh-Ritz step to get the single components
+        Z = deflate(self._cov_mult(Q))
+        S = mult(Q.T, Z)
+        d, U = symeig(0.5*(S+S.T))
+        # sort in descending order
+        d, U = d[::-1], U[:, ::-1]
+        return d, mult(Q, U)
+
+    def _stop_training_block(self):
+        """Extract the components in blocks of block_size components."""
+        dtype = self.dtype
+        tlen = self.tlen
+        dim = self.input_dim
+        avg = numx.zeros((dim,), dtype=dtype)
+        sqsum = 0.
+        for chunk in self._chunks():
+            avg += chunk.sum(axis=0)
+            sqsum += (chunk*chunk).sum()
+        avg /= tlen
+        self.avg = avg
+        var = sqsum/tlen - (avg*avg).sum()
+        self.total_variance = var
+
+        if self.desired_variance is not None:
+            n_comp = dim
+        else:
+            n_comp = self.output_dim
+        V = numx.zeros((dim, 0), dtype=dtype)
+        d = numx.zeros((0,), dtype=dtype)
+        exp_var = 0
+        while V.shape[1] < n_comp:
+            k = min(self.block_size, n_comp - V.shape[1])
+            d_block, V_block = self._block_components(V, k)
+            d_block /= (tlen-1)
+            if self.desired_variance is not None:
+                cum_var = exp_var + (d_block/var).cumsum()
+                reached = numx.flatnonzero(cum_var >= self.desired_variance)
+                if len(reached):
+                    k = reached[0] + 1
+                    n_comp = V.shape[1] + k
+                    self.output_dim = n_comp
+                d_block, V_block = d_block[:k], V_block[:, :k]
+            exp_var += (d_block/var).sum()
+            d = numx.concatenate((d, d_block))
+            V = numx.concatenate((V, V_block), axis=1)
+        if self.output_dim is None:
+            self.output_dim = V.shape[1]
+
+        self.d = d.astype(dtype)
+        self.v = V.astype(dtype)
+        self.explained_variance = exp_var
+        # free the memory and remove the chunks from the disk
+        if self._chunk_path is not None:
+            for filename in self.data:
+                os.remove(filename)
+            os.rmdir(self._chunk_path)
+            self._chunk_path = None
+        self.data = None
@@ -23,21 +23,26 @@
 from scheduling import (
     ResultContainer, ListResultContainer, OrderedResultContainer, TaskCallable,
     SqrTestCallable, SleepSqrTestCallable, TaskCallableWrapper, Scheduler,
-    cpu_count, MDPVersionCallable
+    cpu_count, MDPVersionCallable, TaskFailure
 )
 from process_schedule import ProcessScheduler
+from fork_schedule import ForkScheduler
 from thread_schedule import ThreadScheduler
+from cluster_schedule import ClusterScheduler, LocalClusterScheduler
 from parallelnodes import (
     ParallelExtensionNode, NotForkableParallelException, JoinParallelException,
-    ParallelPCANode, ParallelSFANode, ParallelFDANode, ParallelHistogramNode
+    ParallelPCANode, ParallelSFANode, ParallelFDANode, ParallelHistogramNode,
+    ParallelAdaptiveCutoffNode
 )
 from parallelclassifiers import (
     ParallelGaussianClassifier, ParallelNearestMeanClassifier,
     ParallelKNNClassifier
 )
 from parallelflows import (
-    _purge_flownode, FlowTaskCallable, FlowTrainCallable, FlowExecuteCallable,
-    TrainResultContainer, ExecuteResultContainer,
+    _purge_flownode, _check_results,
+    FlowTaskCallable, FlowTrainCallable, FlowExecuteCallable,
+    FlowJoinCallable, FlowStickyTrainCallable, TrainResultContainer,
+    ExecuteResultContainer,
     ParallelFlowException, NoTaskException,
     ParallelFlow, ParallelCheckpointFlow
 )
@@ -56,13 +61,15 @@
 __all__ = [
     "ResultContainer", "ListResultContainer",
     "OrderedResultContainer", "TaskCallable", "SqrTestCallable",
-    "SleepSqrTestCallable", "TaskCallableWrapper", "Scheduler",
-    "ProcessScheduler", "ThreadScheduler",
+    "SleepSqrTestCallable", "TaskCallableWrapper", "Scheduler", "TaskFailure",
+    "ProcessScheduler", "ForkScheduler", "ThreadScheduler",
+    "ClusterScheduler", "LocalClusterScheduler",
     "ParallelExtensionNode", "JoinParallelException",
     "NotForkableParallelException",
     "ParallelSFANode", "ParallelSFANode", "ParallelFDANode",
-    "ParallelHistogramNode",
+    "ParallelHistogramNode", "ParallelAdaptiveCutoffNode",
     "FlowTaskCallable", "FlowTrainCallable", "FlowExecuteCallable",
+    "FlowJoinCallable", "FlowStickyTrainCallable",
     "ExecuteResultContainer", "TrainResultContainer", "ParallelFlowException",
     "NoTaskException",
     "ParallelFlow", "ParallelCheckpointFlow",
@@ -72,7 +79,9 @@
 fixup_namespace(__name__, __all__,
                 ('scheduling',
                  'process_schedule',
+                 'fork_schedule',
                  'thread_schedule',
+                 'cluster_schedule',
                  'parallelnodes',
                  'parallelflows',
                  'parallelhinet',
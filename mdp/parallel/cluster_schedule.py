@@ -0,0 +1,674 @@
+"""
+Socket based scheduler for distribution across multiple machines.
+
+The tasks are processed by worker daemons, which are started on the
+machines of the cluster by running this module as a script, e.g.
+
+    MDP_CLUSTER_SECRET=xyz python cluster_schedule.py --host 0.0.0.0
+
+The ClusterScheduler then connects to the workers via TCP. The
+LocalClusterScheduler starts the workers on the local machine.
+
+Warning: The tasks and the results are pickled, so a worker runs any code
+that an authenticated scheduler sends to it, and the scheduler unpickles
+the results of an authenticated worker. The workers refuse to start
+without a secret (set via the MDP_CLUSTER_SECRET environment variable).
+Only run the workers in trusted networks.
+"""
+
+# Protocol: After the connection is established the worker sends a random
+#    challenge, which the scheduler must answer with the HMAC of the secret,
+#    followed by its own random challenge. The worker answers that with the
+#    HMAC of the secret (prefixed with _WORKER_DIGEST_PREFIX, so that
+#    answers cannot be reflected). All of these are raw bytes. Then the
+#    worker sends ("HELLO", n_credits).
+#    All further messages are sent with _send_message, the scheduler
+#    sends ("TASK", data, task_callable, task_index) or ("EXIT",), the
+#    worker answers each task with ("RESULT", result) or ("ERROR", text).
+
+import sys
+import os
+import socket
+import struct
+import hmac
+import hashlib
+import cPickle as pickle
+import cStringIO as StringIO
+import collections
+import threading
+import Queue
+import subprocess
+import traceback
+import optparse
+import warnings
+
+if __name__ == "__main__":
+    # try to make sure that mdp can be imported by adding it to sys.path
+    mdp_path = os.path.realpath(__file__)
+    mdp_index = mdp_path.rfind("mdp")
+    if mdp_index:
+        mdp_path = mdp_path[:mdp_index-1]
+        # mdp path goes after sys.path
+        sys.path.append(mdp_path)
+    # shut off warnings of any kinds
+    warnings.filterwarnings("ignore", ".*")
+
+import mdp
+from mdp import numx
+from mdp.parallel import Scheduler, TaskFailure, cpu_count
+
+# arrays with at least this many bytes are sent as raw buffers
+RAW_BUFFER_MIN_BYTES = 2**12
+# default port of the worker daemons
+DEFAULT_PORT = 50018
+# default number of tasks a worker can hold at the same time (the task
+# it is running and the tasks that are already received in the meantime)
+DEFAULT_CREDITS = 2
+# environment variable with the secret of a worker daemon, unlike command
+# line arguments it is not visible to other users
+SECRET_ENVIRON = "MDP_CLUSTER_SECRET"
+
+# lengths of the pickled part and number of raw buffers of a message
+_HEADER = struct.Struct("!QI")
+_CHALLENGE_BYTES = 32
+_WORKER_DIGEST_PREFIX = "worker"
+
+
+def _recv_into(sock, view):
+    """Fill the writable buffer view with bytes from the socket."""
+    size = len(view)
+    received = 0
+    while received < size:
+        n_bytes = sock.recv_into(view[received:], size - received)
+        if not n_bytes:
+            raise EOFError("The connection was closed.")
+        received += n_bytes
+
+
+def _recv_bytes(sock, size):
+    """Receive exactly size bytes from the socket and return them."""
+    data = bytearray(size)
+    _recv_into(sock, memoryview(data))
+    return str(data)
+
+
+def _send_message(sock, obj):
+    """Send obj as a single message.
+
+    The message consists of a header with the lengths of the parts, the
+    pickled object and the raw buffers. Arrays with at least
+    RAW_BUFFER_MIN_BYTES bytes are not pickled, instead their memory is sent
+    without any copies as a raw buffer (unless the array is not contiguous).
+    """
+    arrays = []
+    handles = {}
+    def persistent_id(obj):
+        if (type(obj) is not numx.ndarray or obj.dtype.hasobject or
+            obj.nbytes < RAW_BUFFER_MIN_BYTES):
+            return None
+        handle = handles.get(id(obj))
+        if handle is None:
+            if obj.flags.c_contiguous:
+                order, raw = "C", obj
+            elif obj.flags.f_contiguous:
+                order, raw = "F", obj.T
+            else:
+                order, raw = "C", numx.ascontiguousarray(obj)
+            handle = (len(arrays), obj.dtype, obj.shape, order)
+            handles[id(obj)] = handle
+            arrays.append(raw)
+        return handle
+    # pickle everything first, so a pickling error leaves the connection in
+    # a consistent state
+    pickled = StringIO.StringIO()
+    pickler = pickle.Pickler(pickled, -1)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    pickled = pickled.getvalue()
+    sizes = [raw.nbytes for raw in arrays]
+    sock.sendall(_HEADER.pack(len(pickled), len(arrays)) +
+                 struct.pack("!%dQ" % len(arrays), *sizes) + pickled)
+    for raw in arrays:
+        sock.sendall(memoryview(raw.reshape(-1).view(numx.uint8)))
+
+
+def _recv_message(sock):
+    """Receive a message that was sent with _send_message and return it.
+
+    The raw buffers are received directly into the memory of new arrays.
+    """
+    pickled_size, n_arrays = _HEADER.unpack(_recv_bytes(sock, _HEADER.size))
+    sizes = struct.unpack("!%dQ" % n_arrays, _recv_bytes(sock, 8 * n_arrays))
+    pickled = _recv_bytes(sock, pickled_size)
+    raws = []
+    for size in sizes:
+        raw = numx.empty(size, dtype=numx.uint8)
+        _recv_into(sock, memoryview(raw))
+        raws.append(raw)
+    # an array that occurs multiple times in the message is restored once
+    arrays = {}
+    def persistent_load(handle):
+        index, dtype, shape, order = handle
+        array = arrays.get(index)
+        if array is None:
+            array = raws[index].view(dtype)
+            if order == "F":
+                array = array.reshape(shape[::-1]).T
+            else:
+                array = array.reshape(shape)
+            arrays[index] = array
+        return array
+    unpickler = pickle.Unpickler(StringIO.StringIO(pickled))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+def _digest(secret, challenge):
+    """Return the answer for the authentication challenge."""
+    return hmac.new(secret, challenge, hashlib.sha256).digest()
+
+
+def _compare_digest(digest, expected):
+    """Compare the digests in constant time if possible."""
+    if hasattr(hmac, "compare_digest"):
+        return hmac.compare_digest(digest, expected)
+    return digest == expected
+
+
+class _WorkerConnection(object):
+    """Connection from the scheduler to a single worker daemon."""
+
+    def __init__(self, address, secret, timeout=None):
+        """Connect to the worker and authenticate.
+
+        address -- Tuple (host, port) of the worker.
+        """
+        self.address = "%s:%d" % address
+        self.socket = socket.create_connection(address, timeout)
+        try:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            challenge = _recv_bytes(self.socket, _CHALLENGE_BYTES)
+            own_challenge = os.urandom(_CHALLENGE_BYTES)
+            self.socket.sendall(_digest(secret, challenge) + own_challenge)
+            try:
+                digest = _recv_bytes(self.socket,
+                                     hashlib.sha256().digest_size)
+            except EOFError:
+                err = ("The worker %s closed the connection, probably the "
+                       "secret is wrong." % self.address)
+                raise mdp.MDPException(err)
+            # only unpickle messages from an authenticated worker
+            if not _compare_digest(digest, _digest(secret,
+                                _WORKER_DIGEST_PREFIX + own_challenge)):
+                err = ("The worker %s could not be authenticated, probably "
+                       "the secret is wrong." % self.address)
+                raise mdp.MDPException(err)
+            hello = _recv_message(self.socket)
+            self.socket.settimeout(None)
+        except:
+            self.socket.close()
+            raise
+        # number of tasks that can still be sent to the worker, a credit is
+        # taken for each task and returned with its result
+        self.credits = hello[1]
+        # tasks assigned to the worker, which are sent by its send thread
+        self.tasks = Queue.Queue()
+        # task indices of the tasks sent to the worker, in their order
+        self.pending = collections.deque()
+        self.closed = False
+        # task index of the callable cached by the worker
+        self.callable_index = -1
+
+
+class ClusterScheduler(Scheduler):
+    """Scheduler that distributes the tasks to worker daemons via TCP.
+
+    The worker daemons are started by running this module as a script, on
+    any machine that can be reached by the scheduler (see the module
+    documentation). Each worker runs the tasks one after the other, so one
+    worker should be started for each CPU core.
+
+    Each worker announces how many tasks it can hold (its credits). A task
+    is assigned to the worker with the most credits left, and a credit is
+    returned with each result. add_task blocks when no worker has a credit
+    left. So the data for the next task is transferred while a worker is
+    still busy with its current task, without flooding slow workers. The
+    task callables are cached in the workers, like in ProcessScheduler.
+
+    Each worker is managed by two threads in the scheduler, one for sending
+    the tasks and one for receiving the results.
+    """
+
+    def __init__(self, addresses, result_container=None, verbose=False,
+                 secret=None, timeout=60):
+        """Initialize the scheduler and connect to the workers.
+
+        addresses -- List of the worker addresses, each as a tuple
+            (host, port) or as a string 'host:port' (the port can be omitted
+            to use DEFAULT_PORT).
+        result_container -- ResultContainer used to store the results.
+        verbose -- Set to True to get progress reports from the scheduler
+            (default value is False).
+        secret -- Secret string of the workers. If None (default value) then
+            the MDP_CLUSTER_SECRET environment variable is used, if it is set.
+        timeout -- Timeout in seconds for connecting to a worker.
+        """
+        super(ClusterScheduler, self).__init__(
+                                        result_container=result_container,
+                                        verbose=verbose)
+        if secret is None:
+            secret = os.environ.get(SECRET_ENVIRON, "")
+        self._workers = []
+        try:
+            for address in addresses:
+                if isinstance(address, str):
+                    host, _, port = address.partition(":")
+                    address = (host, int(port or DEFAULT_PORT))
+                self._workers.append(_WorkerConnection(tuple(address),
+                                                       secret=secret,
+                                                       timeout=timeout))
+        except:
+            for worker in self._workers:
+                worker.socket.close()
+            raise
+        if not self._workers:
+            err = "No worker addresses were provided."
+            raise mdp.MDPException(err)
+        # notified when a credit is returned or a connection is lost
+        self._credit_returned = threading.Condition(self._lock)
+        self._threads = []
+        for worker in self._workers:
+            for target in (self._send_thread, self._receive_thread):
+                thread = threading.Thread(target=target, args=(worker,))
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        if self.verbose:
+            print ("scheduler initialized with %d workers" %
+                   len(self._workers))
+
+    def _shutdown(self):
+        """Stop the threads and close the connections to the workers.
+
+        If a worker is still running a task then an exception is raised.
+        """
+        self._lock.acquire()
+        try:
+            if self._n_open_tasks:
+                raise Exception("some worker is still working")
+        finally:
+            self._lock.release()
+        for worker in self._workers:
+            worker.tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        for worker in self._workers:
+            worker.socket.close()
+        self._threads = []
+        if self.verbose:
+            print "scheduler shutdown"
+
+    def _process_task(self, data, task_callable, task_index):
+        """Assign the task to the worker with the most credits.
+
+        It blocks when no worker has a credit left, until a worker has
+        finished a task.
+        """
+        while True:
+            workers = [worker for worker in self._workers
+                       if not worker.closed]
+            if not workers:
+                self._lock.release()
+                err = "no worker is left to run task %d" % task_index
+                print >> sys.stderr, err
+                self._store_result(TaskFailure(task_index, err), task_index)
+                return
+            worker = max(workers, key=lambda worker: worker.credits)
+            if worker.credits > 0:
+                break
+            self._credit_returned.wait()
+        worker.credits -= 1
+        # the callable index is stored with the task, since
+        # _last_callable_index might change before the task is sent
+        callable_index = self._last_callable_index
+        self._lock.release()
+        worker.tasks.put((data, task_callable, task_index, callable_index))
+
+    def _send_thread(self, worker):
+        """Thread function which sends the assigned tasks to a worker.
+
+        When None is taken from the task queue then the worker is told to
+        exit.
+        """
+        while True:
+            task = worker.tasks.get()
+            if task is None:
+                break
+            data, task_callable, task_index, callable_index = task
+            del task
+            # check if the cached callable is up to date
+            if worker.callable_index < callable_index:
+                worker.callable_index = callable_index
+            else:
+                task_callable = None
+            message = ("TASK", data, task_callable, task_index)
+            del data, task_callable
+            self._lock.acquire()
+            try:
+                closed = worker.closed
+                if not closed:
+                    worker.pending.append(task_index)
+            finally:
+                self._lock.release()
+            if closed:
+                err = ("lost the connection to worker %s before sending "
+                       "task %d" % (worker.address, task_index))
+                print >> sys.stderr, err
+                self._store_result(TaskFailure(task_index, err), task_index)
+                continue
+            try:
+                _send_message(worker.socket, message)
+            except socket.error:
+                # the receive thread fails the pending tasks
+                traceback.print_exc()
+                try:
+                    worker.socket.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            except Exception:
+                # the task could not be pickled, nothing was sent
+                failure = TaskFailure(task_index, traceback.format_exc())
+                traceback.print_exc()
+                print >> sys.stderr, ("failed to send task %d to worker %s" %
+                                      (task_index, worker.address))
+                # the callable might be the one that failed
+                worker.callable_index = -1
+                self._lock.acquire()
+                try:
+                    worker.pending.pop()
+                    worker.credits += 1
+                    self._credit_returned.notify_all()
+                finally:
+                    self._lock.release()
+                self._store_result(failure, task_index)
+            del message
+        try:
+            _send_message(worker.socket, ("EXIT",))
+        except socket.error:
+            # the connection is already closed
+            pass
+
+    def _receive_thread(self, worker):
+        """Thread function which receives the results from a worker.
+
+        When the connection is closed then the thread exits, the tasks that
+        are still pending are stored as failed.
+        """
+        while True:
+            try:
+                message = _recv_message(worker.socket)
+            except (EOFError, socket.error):
+                break
+            except Exception:
+                traceback.print_exc()
+                message = ("ERROR", "failed to unpickle the result")
+            self._lock.acquire()
+            try:
+                task_index = worker.pending.popleft()
+                worker.credits += 1
+                self._credit_returned.notify_all()
+            finally:
+                self._lock.release()
+            if message[0] == "RESULT":
+                result = message[1]
+            else:
+                print >> sys.stderr, message[1]
+                print >> sys.stderr, ("failed to execute task %d in worker "
+                                      "%s" % (task_index, worker.address))
+                # store the failure, so that get_results does not block
+                result = TaskFailure(task_index, message[1])
+            del message
+            self._store_result(result, task_index)
+            del result
+        self._lock.acquire()
+        try:
+            worker.closed = True
+            pending = list(worker.pending)
+            worker.pending.clear()
+            self._credit_returned.notify_all()
+        finally:
+            self._lock.release()
+        for task_index in pending:
+            err = ("lost the connection to worker %s during task %d" %
+                   (worker.address, task_index))
+            print >> sys.stderr, err
+            self._store_result(TaskFailure(task_index, err), task_index)
+
+
+class LocalClusterScheduler(ClusterScheduler):
+    """ClusterScheduler with worker daemons on the local machine.
+
+    The worker processes are started automatically with a random secret and
+    are terminated on shutdown.
+    """
+
+    def __init__(self, n_workers=None, result_container=None, verbose=False,
+                 source_paths=None, python_executable=None,
+                 n_credits=DEFAULT_CREDITS):
+        """Start the worker daemons and connect to them.
+
+        n_workers -- Number of worker processes. If None (default) then the
+            number of detected CPU cores is used.
+        result_container -- ResultContainer used to store the results.
+        verbose -- Set to True to get progress reports from the scheduler
+            (default value is False).
+        source_paths -- List of paths that are added to sys.path in
+            the workers to make the task unpickling work. If None (default
+            value) then source_paths is set to sys.path.
+        python_executable -- Python executable that is used for the workers.
+            If None (default value) then sys.executable is used.
+        n_credits -- Number of tasks each worker can hold.
+        """
+        if not n_workers:
+            n_workers = cpu_count()
+        if python_executable is None:
+            python_executable = sys.executable
+        if isinstance(source_paths, str):
+            source_paths = [source_paths]
+        if source_paths is None:
+            source_paths = sys.path
+        module_file = os.path.join(os.path.dirname(mdp.__file__),
+                                   "parallel", "cluster_schedule.py")
+        secret = os.urandom(16).encode("hex")
+        env = dict(os.environ)
+        env[SECRET_ENVIRON] = secret
+        self._worker_processes = []
+        addresses = []
+        try:
+            for _ in range(n_workers):
+                process = subprocess.Popen(
+                        args=[python_executable, "-u", module_file,
+                              "--port", "0", "--once",
+                              "--credits", str(n_credits)] + source_paths,
+                        stdout=subprocess.PIPE, env=env)
+                self._worker_processes.append(process)
+            for process in self._worker_processes:
+                # the worker reports its address in the first line
+                line = process.stdout.readline()
+                if not line:
+                    err = "A worker process could not be started."
+                    raise mdp.MDPException(err)
+                host, port = line.split()[-1].rsplit(":", 1)
+                addresses.append((host, int(port)))
+            super(LocalClusterScheduler, self).__init__(
+                                            addresses=addresses,
+                                            result_container=result_container,
+                                            verbose=verbose,
+                                            secret=secret)
+        except:
+            self._stop_worker_processes(kill=True)
+            raise
+
+    def _stop_worker_processes(self, kill=False):
+        """Wait for the worker processes to exit, or kill them."""
+        for process in self._worker_processes:
+            if kill and process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+        self._worker_processes = []
+
+    def _shutdown(self):
+        """Shut down the connections, so the workers exit."""
+        super(LocalClusterScheduler, self)._shutdown()
+        self._stop_worker_processes()
+
+
+def _serve_connection(sock, secret, n_credits):
+    """Authenticate the scheduler and run its tasks until it sends EXIT.
+
+    The worker also authenticates itself to the scheduler.
+    """
+    challenge = os.urandom(_CHALLENGE_BYTES)
+    sock.sendall(challenge)
+    digest = _recv_bytes(sock, hashlib.sha256().digest_size)
+    scheduler_challenge = _recv_bytes(sock, _CHALLENGE_BYTES)
+    if not _compare_digest(digest, _digest(secret, challenge)):
+        print "authentication of the scheduler failed"
+        return
+    sock.sendall(_digest(secret, _WORKER_DIGEST_PREFIX + scheduler_challenge))
+    _send_message(sock, ("HELLO", n_credits))
+    # the scheduler never sends more than n_credits tasks
+    tasks = Queue.Queue()
+    def receive_tasks():
+        while True:
+            try:
+                task = _recv_message(sock)
+            except (EOFError, socket.error):
+                task = ("EXIT",)
+            except Exception:
+                # the message was received completely, so just report it
+                task = ("ERROR", traceback.format_exc())
+            tasks.put(task)
+            if task[0] == "EXIT":
+                break
+    receive_thread = threading.Thread(target=receive_tasks)
+    receive_thread.setDaemon(True)
+    receive_thread.start()
+    last_callable = None
+    while True:
+        task = tasks.get()
+        if task[0] == "EXIT":
+            break
+        task_index = None
+        try:
+            if task[0] == "ERROR":
+                print task[1]
+                message = ("ERROR", "unpickling a task caused an exception "
+                           "in worker %s:\n%s" % (socket.gethostname(),
+                                                  task[1]))
+            else:
+                _, data, task_callable, task_index = task
+                if task_callable is None:
+                    if last_callable is None:
+                        err = ("No callable was provided and no cached "
+                               "callable is available.")
+                        raise Exception(err)
+                    task_callable = last_callable.fork()
+                else:
+                    # store callable in cache
+                    last_callable = task_callable
+                    task_callable.setup_environment()
+                    task_callable = task_callable.fork()
+                message = ("RESULT", task_callable(data))
+                del data, task_callable
+        except Exception:
+            text = traceback.format_exc()
+            print "task %d caused exception in worker:" % task[3]
+            print text
+            message = ("ERROR", "task %d caused exception in worker %s:\n%s" %
+                       (task[3], socket.gethostname(), text))
+        del task
+        sys.stdout.flush()
+        try:
+            _send_message(sock, message)
+        except socket.error:
+            raise
+        except Exception:
+            # the result could not be pickled, nothing was sent
+            text = traceback.format_exc()
+            print "result of task %s could not be sent:" % task_index
+            print text
+            sys.stdout.flush()
+            _send_message(sock, ("ERROR", "result of task %s could not be "
+                                 "pickled in worker %s:\n%s" %
+                                 (task_index, socket.gethostname(), text)))
+        del message
+    receive_thread.join()
+
+
+def _run_worker(host="localhost", port=DEFAULT_PORT, secret="",
+                n_credits=DEFAULT_CREDITS, once=False):
+    """Run a worker daemon which processes the tasks of ClusterSchedulers.
+
+    The schedulers are served one after the other. If once is True then
+    the worker exits after the first scheduler has disconnected.
+
+    A non-empty secret is required, since the worker runs any code that
+    it receives from an authenticated scheduler.
+    """
+    if not secret:
+        err = ("The worker requires a secret, set it via the %s "
+               "environment variable." % SECRET_ENVIRON)
+        raise mdp.MDPException(err)
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(1)
+    print "worker listening on %s:%d" % server.getsockname()
+    sys.stdout.flush()
+    # nobody might read stdout anymore, so everything else goes to stderr
+    sys.stdout = sys.stderr
+    try:
+        while True:
+            sock, _ = server.accept()
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                _serve_connection(sock, secret, n_credits)
+            except (EOFError, socket.error):
+                traceback.print_exc()
+            finally:
+                sock.close()
+            if once:
+                break
+    finally:
+        server.close()
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(
+                    usage="%prog [options] [source paths]",
+                    description="Run a worker daemon for ClusterScheduler. "
+                    "The secret is taken from the %s environment variable."
+                    % SECRET_ENVIRON)
+    parser.add_option("--host", default="localhost",
+                      help="interface to listen on, use 0.0.0.0 for all "
+                      "interfaces (default: %default)")
+    parser.add_option("--port", type="int", default=DEFAULT_PORT,
+                      help="port to listen on, 0 for a free port "
+                      "(default: %default)")
+    parser.add_option("--credits", type="int", default=DEFAULT_CREDITS,
+                      help="number of tasks the worker can hold "
+                      "(default: %default)")
+    parser.add_option("--once", action="store_true", default=False,
+                      help="exit when the first scheduler disconnects")
+    options, source_paths = parser.parse_args()
+    if not os.environ.get(SECRET_ENVIRON):
+        parser.error("the %s environment variable must be set to the "
+                     "secret" % SECRET_ENVIRON)
+    # put the source paths in front so that they take precedence over
+    # PYTHONPATH
+    new_paths = [path for path in source_paths if path not in sys.path]
+    sys.path = new_paths + sys.path
+    _run_worker(host=options.host, port=options.port,
+                secret=os.environ.get(SECRET_ENVIRON, ""),
+                n_credits=options.credits, once=options.once)
@@ -0,0 +1,158 @@
+"""
+Fork based scheduler for distribution across multiple CPU cores.
+
+This scheduler only works on systems which support os.fork (i.e., not on
+Windows).
+"""
+
+import os
+import sys
+import traceback
+
+import mdp
+from process_schedule import ProcessScheduler, _process_loop
+
+
+class _ForkedProcess(object):
+    """Handle for a forked worker process, similar to subprocess.Popen."""
+
+    def __init__(self, pid, stdin, stdout):
+        """Store the process id and the pipes to the process."""
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+
+    def wait(self):
+        """Wait for the process to terminate."""
+        os.waitpid(self.pid, 0)
+        self.stdin.close()
+        self.stdout.close()
+
+
+class ForkScheduler(ProcessScheduler):
+    """Scheduler that distributes the tasks to forked processes.
+
+    The worker processes are forked from the current process when the first
+    task arrives, so they inherit its callable (e.g., a flow with all its
+    trained nodes) copy-on-write, instead of receiving it in a pickled form.
+    Only the task data and the results are passed between the processes.
+
+    When a task comes with a new callable and no other task is open, the
+    worker processes are replaced by new forks (which takes only a few
+    milliseconds). Otherwise, or if the callable is light (see
+    TaskCallable), the new callable is pickled and sent to the processes,
+    like in ProcessScheduler.
+
+    Note that the current process should not run other threads while the
+    processes are forked.
+    """
+
+    def __init__(self, result_container=None, verbose=False, n_processes=1,
+                 shared_memory=True):
+        """Initialize the scheduler, the processes are forked later.
+
+        result_container -- ResultContainer used to store the results.
+        verbose -- Set to True to get progress reports from the scheduler
+            (default value is False).
+        n_processes -- Number of processes used in parallel. If None (default)
+            then the number of detected CPU cores is used.
+        shared_memory -- Pass large arrays in the task data and results
+            through memory mapped files instead of pickling them through
+            the pipes (default is True).
+        """
+        if not hasattr(os, "fork"):
+            err = "ForkScheduler requires os.fork, which is not available."
+            raise NotImplementedError(err)
+        # callable inherited by the current processes and its task index
+        self._fork_callable = None
+        self._fork_callable_index = -1.0
+        super(ForkScheduler, self).__init__(
+                                        result_container=result_container,
+                                        verbose=verbose,
+                                        n_processes=n_processes,
+                                        cache_callable=True,
+                                        shared_memory=shared_memory)
+
+    def _create_process(self, result_buffer):
+        """Fork a worker process and return a handle for it."""
+        task_read, task_write = os.pipe()
+        result_read, result_write = os.pipe()
+        # otherwise buffered output would be written by both processes
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if not pid:
+            # this is the worker process, which must never return from here
+            try:
+                try:
+                    os.close(task_write)
+                    os.close(result_read)
+                    # the threads of the inherited thread pools are gone
+                    mdp.utils._reset_thread_pools()
+                    # close the pipes of the previously forked processes
+                    for process in self._processes:
+                        process.stdin.close()
+                        process.stdout.close()
+                    if result_buffer is None:
+                        result_buffer_path = None
+                    else:
+                        result_buffer_path = result_buffer.path
+                    _process_loop(os.fdopen(task_read, "rb"),
+                                  os.fdopen(result_write, "wb"),
+                                  cache_callable=True,
+                                  result_buffer_path=result_buffer_path,
+                                  last_callable=self._fork_callable)
+                except:
+                    traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                os._exit(0)
+        os.close(task_read)
+        os.close(result_write)
+        process = _ForkedProcess(pid, os.fdopen(task_write, "wb"),
+                                 os.fdopen(result_read, "rb"))
+        process._callable_index = self._fork_callable_index
+        return process
+
+    def _start_processes(self):
+        """Fork the processes and start their task threads.
+
+        Without a callable there is nothing to inherit, so nothing is done
+        (this is the case when the scheduler is initialized).
+        """
+        if self._fork_callable is None:
+            return
+        super(ForkScheduler, self)._start_processes()
+        if self.verbose:
+            print ("forked %d processes for callable %s" %
+                   (self._n_processes, self._fork_callable_index))
+
+    def _stop_processes(self):
+        """Stop the task threads and wait for the processes to exit."""
+        processes = self._processes
+        super(ForkScheduler, self)._stop_processes()
+        for process in processes:
+            process.wait()
+
+    def _process_task(self, data, task_callable, task_index):
+        """Add a task to the queue, forking new processes if possible.
+
+        The processes are forked for the first task. They are forked again
+        if the callable is newer than the one they have inherited, it is
+        not light and no other task is open (this task is already counted).
+        The lock is released while the processes are replaced.
+        """
+        callable_index = self._last_callable_index
+        refork = (not self._processes or
+                  (callable_index > self._fork_callable_index and
+                   self._n_open_tasks == 1 and
+                   not getattr(task_callable, "light", False)))
+        if refork:
+            self._fork_callable = task_callable
+            self._fork_callable_index = callable_index
+        self._lock.release()
+        if refork:
+            self._stop_processes()
+            self._start_processes()
+        self._task_queue.put((data, task_callable, task_index,
+                              callable_index))
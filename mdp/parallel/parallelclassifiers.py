@@ -14,15 +14,11 @@ def _fork(self):
         return self._default_fork()
 
     def _join(self, forked_node):
-        if not self._cov_objs:
+        if self._class_stats is None:
             self.set_dtype(forked_node._dtype)
-            self._cov_objs = forked_node._cov_objs
-        else:
-            for key, forked_cov in forked_node._cov_objs.items():
-                if key in self._cov_objs:
-                    self._join_covariance(self._cov_objs[key], forked_cov)
-                else:
-                    self._cov_objs[key] = forked_cov
+            self._class_stats = forked_node._class_stats
+        elif forked_node._class_stats is not None:
+            self._class_stats.merge(forked_node._class_stats)
                     
 
 class ParallelNearestMeanClassifier(ParallelExtensionNode,
@@ -32,13 +28,10 @@ def _fork(self):
         return self._default_fork()
     
     def _join(self, forked_node):
-        for key in forked_node.label_means:
-            if key in self.label_means:
-                self.label_means[key] += forked_node.label_means[key]
-                self.n_label_samples[key] += forked_node.n_label_samples[key]
-            else:
-                self.label_means[key] = forked_node.label_means[key]
-                self.n_label_samples[key] = forked_node.n_label_samples[key]
+        if self._class_stats is None:
+            self._class_stats = forked_node._class_stats
+        elif forked_node._class_stats is not None:
+            self._class_stats.merge(forked_node._class_stats)
 
 
 class ParallelKNNClassifier(ParallelExtensionNode,
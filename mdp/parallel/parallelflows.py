@@ -5,12 +5,20 @@
 as well.
 """
 
+import os
+import socket
+import thread
+import time
+import traceback
+import uuid
+
 import mdp
 from mdp import numx as n
 
 from parallelnodes import NotForkableParallelException
 from scheduling import (
-    TaskCallable, ResultContainer, OrderedResultContainer, Scheduler
+    TaskCallable, ResultContainer, ListResultContainer, OrderedResultContainer,
+    Scheduler, TaskFailure
 )
 from mdp.hinet import FlowNode
 
@@ -37,6 +45,23 @@ def _purge_flownode(flownode):
         if not (node._train_phase_started or node.use_execute_fork()):
             flownode._flow.flow[i_node] = _DUMMY_NODE
 
+def _check_results(results):
+    """Raise a ParallelFlowException if some of the results are failures.
+
+    Execution results are tuples, for them the first entry is checked.
+    """
+    failures = []
+    for result in results:
+        if type(result) is tuple and result:
+            result = result[0]
+        if isinstance(result, TaskFailure):
+            failures.append(result)
+    if failures:
+        err = ("%d task(s) failed on the scheduler, the first failure "
+               "(task %s) was:\n%s" % (len(failures), failures[0].task_index,
+                                        failures[0].message))
+        raise ParallelFlowException(err)
+
 
 ### Train task classes ###
 
@@ -67,6 +92,9 @@ class FlowTrainCallable(FlowTaskCallable):
     You can also derive from this class to define your own callable class.
     """
 
+    # the task data is only referenced by the returned flownode
+    zero_copy = True
+
     def __init__(self, flownode, purge_nodes=True):
         """Store everything for the training.
 
@@ -100,27 +128,142 @@ def fork(self):
                               purge_nodes=self._purge_nodes)
 
 
+class FlowJoinCallable(FlowTaskCallable):
+    """Joins forked flownodes, this is used for the tree reduction of the
+    training results (see ParallelFlow.train).
+    """
+
+    zero_copy = True
+    # the flownodes come with the data, so there is no need to fork
+    light = True
+
+    def __call__(self, flownodes):
+        """Join all the flownodes into the first one and return it.
+
+        flownodes -- List of forked flownodes from the same training phase.
+        """
+        flownode = flownodes[0]
+        for other_flownode in flownodes[1:]:
+            flownode.join(other_flownode)
+        return flownode
+
+
+# worker-resident training callables of the sticky training, the keys are
+# (sticky key, worker id) and the values [forked callable, flownode]
+_STICKY_CALLABLES = {}
+# time for which a flush task blocks its worker in the first flush round,
+# so that the other flush tasks are picked up by the other workers; it is
+# doubled in each further round
+_STICKY_FLUSH_WAIT = 0.05
+# maximum number of flush rounds
+_STICKY_FLUSH_ROUNDS = 10
+
+
+def _worker_id():
+    """Return an id for the current worker thread or process."""
+    return (socket.gethostname(), os.getpid(), thread.get_ident())
+
+
+class _StickyFlushRequest(object):
+    """Task data which requests the resident flownode of a worker."""
+
+    def __init__(self, wait=_STICKY_FLUSH_WAIT):
+        """Store the time for which the flush task blocks its worker."""
+        self.wait = wait
+
+
+class FlowStickyTrainCallable(TaskCallable):
+    """Wrapper for a train callable that keeps a single forked flownode in
+    each worker for the whole training phase (see ParallelFlow.train).
+
+    The training tasks only return the id of the worker. At the end of the
+    phase the flownodes are requested with _StickyFlushRequest tasks, which
+    return a tuple (worker id, flownode) and remove the flownode from the
+    worker (the flownode is None if the worker has nothing to flush).
+
+    The resident flownode keeps using the data of earlier tasks (e.g. the
+    HistogramNode stores it), so the task data must not be passed as views
+    into reused buffers (see TaskCallable.zero_copy).
+    """
+
+    zero_copy = False
+
+    def __init__(self, train_callable):
+        """Store and wrap the train callable.
+
+        train_callable -- FlowTrainCallable instance (or an instance of a
+            derived class) for the current training phase.
+        """
+        self._callable = train_callable
+        # identifies the training phase in the workers
+        self._key = uuid.uuid4().hex
+
+    def setup_environment(self):
+        """Set up the environment of the wrapped callable."""
+        self._callable.setup_environment()
+
+    def __call__(self, data):
+        """Train the resident flownode of this worker with the data.
+
+        data -- training data block or a _StickyFlushRequest
+        """
+        worker_key = (self._key, _worker_id())
+        if isinstance(data, _StickyFlushRequest):
+            resident = _STICKY_CALLABLES.pop(worker_key, None)
+            time.sleep(data.wait)
+            if resident is None:
+                return (worker_key[1], None)
+            flownode = resident[1]
+            if self._callable._purge_nodes:
+                _purge_flownode(flownode)
+            return (worker_key[1], flownode)
+        resident = _STICKY_CALLABLES.get(worker_key)
+        if resident is None:
+            forked_callable = self._callable.fork()
+            # the resident flownode must not be purged between the tasks
+            forked_callable._purge_nodes = False
+            resident = [forked_callable, None]
+            _STICKY_CALLABLES[worker_key] = resident
+        resident[1] = resident[0](data)
+        return worker_key[1]
+
+    def fork(self):
+        """Return the callable itself, the state is kept in the worker."""
+        return self
+
+
 class TrainResultContainer(ResultContainer):
     """Container for parallel nodes.
 
     Expects flownodes as results and joins them to save memory.
     A list containing one flownode is returned, so this container can replace
-    the standard list container without any changes elsewhere.
+    the standard list container without any changes elsewhere. If some tasks
+    failed then the list of their TaskFailure results is returned instead.
     """
 
     def __init__(self):
         super(TrainResultContainer, self).__init__()
         self._flownode = None
+        self._failures = []
 
     def add_result(self, result, task_index):
-        if not self._flownode:
+        if isinstance(result, TaskFailure):
+            self._failures.append(result)
+        elif not self._flownode:
             self._flownode = result
         else:
-            self._flownode.join(result)
+            try:
+                self._flownode.join(result)
+            except Exception:
+                self._failures.append(TaskFailure(task_index,
+                                                  traceback.format_exc()))
 
     def get_results(self):
-        flownode = self._flownode
+        flownode, failures = self._flownode, self._failures
         self._flownode = None
+        self._failures = []
+        if failures:
+            return failures
         return [flownode,]
     
 
@@ -133,6 +276,8 @@ class FlowExecuteCallable(FlowTaskCallable):
     encapsulate the flow.
     """
 
+    zero_copy = True
+
     def __init__(self, flownode, nodenr=None, purge_nodes=True):
         """Store everything for the execution.
 
@@ -182,6 +327,9 @@ def __init__(self):
 
     def add_result(self, result, task_index):
         """Remove the forked BiFlowNode from the result and join it."""
+        if isinstance(result, TaskFailure):
+            # keep the failure in place of the execute result
+            result = (result, None)
         excecute_result, forked_flownode = result
         super(ExecuteResultContainer, self).add_result(excecute_result,
                                                        task_index)
@@ -262,6 +410,8 @@ def __init__(self, flow, verbose=False, **kwargs):
     def train(self, data_iterables, scheduler=None,
               train_callable_class=None,
               overwrite_result_container=True,
+              tree_reduce=False,
+              sticky=False,
               **kwargs):
         """Train all trainable nodes in the flow.
 
@@ -292,6 +442,28 @@ def train(self, data_iterables, scheduler=None,
             the result container in the scheduler will be overwritten with an
             instance of NodeResultContainer (unless it is already an instance
             of NodeResultContainer). This improves the memory efficiency.
+        tree_reduce -- If True then the forked nodes of each training phase
+            are not joined one after the other as they arrive, but pairwise
+            in join tasks on the scheduler (default value is False). So the
+            joins are done in parallel, in about log2(n) rounds for n
+            results, and only the final node is joined in this process.
+            The result container is replaced with a ListResultContainer
+            (unless overwrite_result_container is False).
+            This mainly pays off with the ThreadScheduler, where the nodes
+            are not copied. The other schedulers pass every node through
+            this process again for each join round, which is about 3n node
+            transfers instead of n. There, sticky training is usually the
+            better way to reduce the joins.
+        sticky -- If True then each worker of the scheduler keeps a single
+            forked flownode for the whole training phase, which is trained
+            with all the tasks the worker gets (default value is False).
+            Only at the end of the phase the flownodes are collected with
+            additional flush tasks, so only one flownode per worker is
+            transferred and joined, instead of one per task.
+            The scheduler must run the tasks in persistent workers (threads
+            or processes, like all the MDP schedulers). The result container
+            is replaced with a ListResultContainer (unless
+            overwrite_result_container is False).
         """
         # Warning: If this method is updated you also have to update train
         #          in ParallelCheckpointFlow.
@@ -336,22 +508,30 @@ def train(self, data_iterables, scheduler=None,
                 else:
                     schedulers = None
                 # check that the scheduler is compatible
-                if ((scheduler is not None) and
-                    overwrite_result_container and
-                    (not isinstance(scheduler.result_container,
-                                    TrainResultContainer))):
-                    scheduler.result_container = TrainResultContainer()
+                if overwrite_result_container:
+                    self._set_train_result_container(scheduler,
+                                                     tree_reduce or sticky)
                 ## train all nodes
                 while self.is_parallel_training:
                     while self.task_available:
-                        task = self.get_task()
-                        scheduler.add_task(*task)
+                        data, task_callable = self.get_task()
+                        if sticky and task_callable is not None:
+                            task_callable = FlowStickyTrainCallable(
+                                                                task_callable)
+                        scheduler.add_task(data, task_callable)
                     results = scheduler.get_results()
                     if results == []:
                         err = ("Could not get any training tasks or results "
                                "for the current training phase.")
                         raise Exception(err)
                     else:
+                        if sticky:
+                            results = self._flush_sticky_results(results,
+                                                                 scheduler)
+                        _check_results(results)
+                        if tree_reduce:
+                            results = self._tree_reduce_results(results,
+                                                                scheduler)
                         self.use_results(results)
                     # check if we have to switch to next scheduler
                     if ((schedulers is not None) and
@@ -364,11 +544,10 @@ def train(self, data_iterables, scheduler=None,
                             scheduler = schedulers.next()
                         last_trained_node = self._i_train_node
                         # check that the scheduler is compatible
-                        if ((scheduler is not None) and
-                            overwrite_result_container and
-                            (not isinstance(scheduler.result_container,
-                                            TrainResultContainer))):
-                            scheduler.result_container = TrainResultContainer()
+                        if overwrite_result_container:
+                            self._set_train_result_container(
+                                                    scheduler,
+                                                    tree_reduce or sticky)
             finally:
                 # reset iterable references, which cannot be pickled
                 self._train_data_iterables = None
@@ -376,6 +555,101 @@ def train(self, data_iterables, scheduler=None,
                 if (schedulers is not None) and (scheduler is not None):
                     scheduler.shutdown()
 
+    @staticmethod
+    def _set_train_result_container(scheduler, list_results=False):
+        """Set a result container that is suitable for the training.
+
+        With list_results a ListResultContainer is used to keep the results
+        separate (for the tree reduction or the sticky training), otherwise a
+        TrainResultContainer.
+        """
+        if scheduler is None:
+            return
+        result_container = scheduler.result_container
+        if list_results:
+            if (isinstance(result_container, TrainResultContainer) or
+                not isinstance(result_container, ListResultContainer)):
+                scheduler.result_container = ListResultContainer()
+        elif not isinstance(result_container, TrainResultContainer):
+            scheduler.result_container = TrainResultContainer()
+
+    @staticmethod
+    def _flush_sticky_results(worker_ids, scheduler):
+        """Collect the resident flownodes from the workers and return them.
+
+        worker_ids -- Results of the sticky training tasks, i.e., the ids of
+            the workers which hold a flownode.
+
+        The schedulers do not offer a way to send a task to a specific
+        worker, so in each round one flush task is sent for each worker
+        that held a flownode, until all the flownodes have arrived. Each
+        flush task blocks its worker for a moment, so that the other tasks
+        go to the other workers. This wait is doubled in each round, in case
+        some workers are slow to pick up their task.
+
+        If a training task failed then its data is missing in the resident
+        flownode, so a ParallelFlowException is raised. The same happens if
+        a flush task fails, since its flownode is lost. In both cases the
+        exception is only raised after the flownodes have been removed from
+        all the workers.
+        """
+        failures = [worker_id for worker_id in worker_ids
+                    if isinstance(worker_id, TaskFailure)]
+        workers = set(worker_id for worker_id in worker_ids
+                      if not isinstance(worker_id, TaskFailure))
+        pending = set(workers)
+        flownodes = []
+        wait = _STICKY_FLUSH_WAIT
+        for _ in range(_STICKY_FLUSH_ROUNDS):
+            if not pending:
+                break
+            for _ in range(len(workers)):
+                scheduler.add_task(_StickyFlushRequest(wait))
+            wait *= 2
+            for result in scheduler.get_results():
+                if isinstance(result, TaskFailure):
+                    failures.append(result)
+                    continue
+                worker_id, flownode = result
+                # without a flownode the worker has nothing left, because
+                # its flownode was removed by a failed flush task
+                pending.discard(worker_id)
+                if flownode is not None:
+                    flownodes.append(flownode)
+        _check_results(failures)
+        if pending:
+            err = ("Could not collect the flownodes from %d workers after "
+                   "the sticky training phase." % len(pending))
+            raise ParallelFlowException(err)
+        return flownodes
+
+    @staticmethod
+    def _tree_reduce_results(results, scheduler):
+        """Join the forked flownodes pairwise on the scheduler.
+
+        Each round of join tasks halves the number of flownodes, a list with
+        the final flownode is returned. If a task failed then a
+        ParallelFlowException is raised.
+        """
+        _check_results(results)
+        results = list(results)
+        while len(results) > 1:
+            if len(results) % 2:
+                # the odd flownode is joined in the next round
+                odd_result = [results.pop()]
+            else:
+                odd_result = []
+            # only the first task contains the callable (enable caching)
+            join_callable = FlowJoinCallable()
+            for i_result in range(0, len(results), 2):
+                scheduler.add_task(results[i_result:i_result+2],
+                                   join_callable)
+                join_callable = None
+            results = list(scheduler.get_results())
+            _check_results(results)
+            results += odd_result
+        return results
+
     def setup_parallel_training(self, data_iterables,
                                 train_callable_class=FlowTrainCallable):
         """Prepare the flow for handing out tasks to do the training.
@@ -679,7 +953,9 @@ def use_results(self, results):
         results -- Iterable containing the results, normally the return value
             of scheduler.ResultContainer.get_results().
             The individual results can be the return values of the tasks.
+            If a task failed then a ParallelFlowException is raised.
         """
+        _check_results(results)
         if self.is_parallel_training:
             for result in results:
                 # the flownode contains the original nodes
@@ -722,6 +998,8 @@ def __init__(self, flow, verbose=False, **kwargs):
     def train(self, data_iterables, checkpoints, scheduler=None,
               train_callable_class=FlowTrainCallable,
               overwrite_result_container=True,
+              tree_reduce=False,
+              sticky=False,
               **kwargs):
         """Train all trainable nodes in the flow.
 
@@ -733,6 +1011,8 @@ def train(self, data_iterables, checkpoints, scheduler=None,
                         scheduler=scheduler,
                         train_callable_class=train_callable_class,
                         overwrite_result_container=overwrite_result_container,
+                        tree_reduce=tree_reduce,
+                        sticky=sticky,
                         checkpoints=checkpoints,
                         **kwargs)
 
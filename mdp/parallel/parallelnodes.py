@@ -228,25 +228,94 @@ def _join(self, forked_node):
             else:
                 self._join_covariance(self._allcov, forked_node._allcov)
                 self._S_W += forked_node._S_W
-        else:
-            for lbl in forked_node.means:
-                if lbl in self.means:
-                    self.means[lbl] += forked_node.means[lbl]
-                    self.tlens[lbl] += forked_node.tlens[lbl]
-                else:
-                    self.means[lbl] = forked_node.means[lbl]
-                    self.tlens[lbl] = forked_node.tlens[lbl]
+        elif forked_node._class_stats is not None:
+            if self._class_stats is None:
+                self._class_stats = forked_node._class_stats
+            else:
+                self._class_stats.merge(forked_node._class_stats)
+
+
+def _fork_histogram(node):
+    """Fork a HistogramNode, the fork always keeps its data in memory."""
+    forked_node = node._default_fork()
+    forked_node._hist_memmap_filename = None
+    return forked_node
+
+def _join_histogram(node, forked_node):
+    """Join the data history of a forked HistogramNode."""
+    if forked_node.data_hist is None:
+        return
+    if node.reservoir_size is not None:
+        _join_reservoir(node, forked_node)
+    elif node._hist_memmap_filename is not None:
+        node._append_to_file(forked_node.data_hist)
+    else:
+        node._hist_chunks += forked_node._hist_chunks
+        node._hist_len += forked_node._hist_len
+
+def _join_reservoir(node, forked_node):
+    """Merge the reservoir of the forked node into the one of node.
+
+    The merged reservoir is again a uniform sample of all the data
+    seen by both nodes: the number of samples taken from each
+    reservoir follows the hypergeometric distribution.
+    """
+    if node._reservoir is None:
+        node._reservoir = forked_node._reservoir
+        node._hist_len = forked_node._hist_len
+        return
+    size = node.reservoir_size
+    n_self, n_forked = node._hist_len, forked_node._hist_len
+    sample_size = min(size, n_self + n_forked)
+    if n_forked == 0:
+        return
+    elif n_self == 0:
+        n_from_self = 0
+    else:
+        n_from_self = mdp.numx_rand.hypergeometric(n_self, n_forked,
+                                                   sample_size)
+    n_from_forked = sample_size - n_from_self
+    # pick the samples among the ones stored in the reservoirs
+    from_self = mdp.numx_rand.permutation(min(n_self, size))
+    from_forked = mdp.numx_rand.permutation(min(n_forked, size))
+    reservoir = numx.zeros(node._reservoir.shape,
+                           dtype=node._reservoir.dtype)
+    reservoir[:n_from_self] = node._reservoir[from_self[:n_from_self]]
+    forked_reservoir = forked_node._reservoir
+    reservoir[n_from_self:sample_size] = (
+                            forked_reservoir[from_forked[:n_from_forked]])
+    node._reservoir = reservoir
+    node._hist_len = n_self + n_forked
 
 
 class ParallelHistogramNode(ParallelExtensionNode, mdp.nodes.HistogramNode):
-    """Parallel version of the HistogramNode."""
+    """Parallel version of the HistogramNode.
+
+    The forked nodes always keep their data in memory, when the data
+    history is stored on disk it is appended to the file during the join.
+    """
 
     def _fork(self):
-        return self._default_fork()
+        return _fork_histogram(self)
 
     def _join(self, forked_node):
-        if (self.data_hist is not None) and (forked_node.data_hist is not None):
-            self.data_hist = numx.concatenate([self.data_hist,
-                                            forked_node.data_hist])
-        elif forked_node.data_hist != None:
-            self.data_hist = forked_node.data_hist
+        _join_histogram(self, forked_node)
+
+
+class ParallelAdaptiveCutoffNode(ParallelExtensionNode,
+                                 mdp.nodes.AdaptiveCutoffNode):
+    """Parallel version of the AdaptiveCutoffNode.
+
+    When a quantile sketch is used the sketches of the forked nodes are
+    merged, otherwise the data history is joined like in the
+    ParallelHistogramNode.
+    """
+
+    def _fork(self):
+        return _fork_histogram(self)
+
+    def _join(self, forked_node):
+        if self._sketch is not None:
+            self._sketch.merge(forked_node._sketch)
+        else:
+            _join_histogram(self, forked_node)
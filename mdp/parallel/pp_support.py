@@ -119,7 +119,8 @@ def _pp_result_callback(self, result):
         This method then calls the normal _store_result method.
         """
         if result is None:
-            result = (None, None)
+            result = (scheduling.TaskFailure(message="pp returned no result"),
+                      None)
         self._store_result(*result)
 
     def _shutdown(self):
@@ -2,12 +2,6 @@
 Process based scheduler for distribution across multiple CPU cores.
 """
 
-# TODO: use a queue instead of sleep?
-#    http://docs.python.org/library/queue.html
-
-# TODO: use shared memory for data numpy arrays, but this also requires the
-#    use of multiprocessing since the ctype objects can't be pickled
-
 # TODO: only return result when get_results is called,
 #    this sends a special request to the processes to send their data,
 #    we would have to add support for this to the callable,
@@ -21,9 +15,12 @@
 import sys
 import os
 import cPickle as pickle
+import cStringIO as StringIO
+import mmap
+import tempfile
 import threading
+import Queue
 import subprocess
-import time
 import traceback
 import warnings
 
@@ -39,16 +36,159 @@
     warnings.filterwarnings("ignore", ".*")
 
 import mdp
-from mdp.parallel import Scheduler, cpu_count
+from mdp import numx
+from mdp.parallel import Scheduler, TaskFailure, cpu_count
+
+# arrays with at least this many bytes are passed via shared memory
+SHARED_MEMORY_MIN_BYTES = 2**16
+# alignment of the arrays in the shared memory buffers
+_SHARED_MEMORY_ALIGNMENT = 64
+
+
+def _shared_memory_dir():
+    """Return the directory for the shared memory files.
+
+    On Linux /dev/shm is used, so the files are never written to disk.
+    Otherwise None is returned, i.e., the default temporary directory.
+    """
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return None
+
 
-SLEEP_TIME = 0.1  # time spend sleeping when waiting for a free process
+class _SharedBuffer(object):
+    """Growable memory mapped file to pass arrays between processes.
+
+    The writing side pickles objects with dump. Large arrays are written
+    into the buffer (replacing the previous content) and only small handles
+    with their location are pickled. The reading side opens the buffer by
+    its path when loading the handles (see _load).
+
+    Each buffer belongs to a single process and is reused for all the tasks
+    of this process. The scheduler creates all the buffers (also those
+    written by the process), so it can remove the files even if the process
+    crashes.
+    """
+
+    def __init__(self, path=None):
+        """Create a new buffer file or open an existing one by its path.
+
+        Only a newly created file is removed when the buffer is closed.
+        """
+        self._owner = path is None
+        if self._owner:
+            fd, path = tempfile.mkstemp(prefix="mdp_",
+                                        dir=_shared_memory_dir())
+            os.close(fd)
+        self.path = path
+        self._file = open(path, "r+b")
+        self._map = None
+        self._size = 0
+
+    def _remap(self, size):
+        """Map the first size bytes of the file.
+
+        The old map is not closed explicitly, since it might still be in use
+        by arrays (it is released when they are garbage collected).
+        """
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._size = size
+
+    def _array(self, dtype, shape, offset, grow=False):
+        """Return an array in the buffer at the given offset.
+
+        grow -- If True then the file is enlarged if necessary, this is done
+            by the writing side (default value is False).
+        """
+        count = int(numx.prod(shape))
+        end = offset + count * dtype.itemsize
+        if end > self._size:
+            if grow:
+                # grow the file to avoid frequent remapping
+                size = max(end, 2 * self._size)
+                os.ftruncate(self._file.fileno(), size)
+                self._remap(size)
+            else:
+                self._remap(os.fstat(self._file.fileno()).st_size)
+        return numx.frombuffer(self._map, dtype=dtype, count=count,
+                               offset=offset).reshape(shape)
+
+    def dump(self, obj, file, copy=True):
+        """Pickle obj to file, passing the large arrays in the buffer.
+
+        copy -- If True (default value) then the reading side copies the
+            arrays out of the buffer. Otherwise they are views which are
+            only valid until the buffer is written again.
+        """
+        arrays = []
+        handles = {}
+        offset = [0]
+        def persistent_id(obj):
+            if (type(obj) is not numx.ndarray or obj.dtype.hasobject or
+                obj.nbytes < SHARED_MEMORY_MIN_BYTES):
+                return None
+            handle = handles.get(id(obj))
+            if handle is None:
+                handle = (self.path, obj.dtype, obj.shape, offset[0], copy)
+                handles[id(obj)] = handle
+                arrays.append((obj, handle))
+                offset[0] += (-(-obj.nbytes // _SHARED_MEMORY_ALIGNMENT) *
+                              _SHARED_MEMORY_ALIGNMENT)
+            return handle
+        # pickle everything first, the arrays must be in place before the
+        # other side receives the handles
+        pickled = StringIO.StringIO()
+        pickler = pickle.Pickler(pickled, -1)
+        pickler.persistent_id = persistent_id
+        pickler.dump(obj)
+        for array, (_, dtype, shape, offset, _) in arrays:
+            self._array(dtype, shape, offset, grow=True)[...] = array
+        file.write(pickled.getvalue())
+        file.flush()
+
+    def close(self):
+        """Close the buffer, the owner also removes the file."""
+        self._map = None
+        self._file.close()
+        if self._owner:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def _load(file, buffers, copy=False):
+    """Unpickle an object from file, which was pickled by _SharedBuffer.dump.
+
+    buffers -- Dictionary of the _SharedBuffer objects that have been opened
+        for reading, with their path as key. Unknown buffers are opened and
+        added to the dictionary.
+    copy -- If True then the arrays are always copied out of the buffers,
+        otherwise only if this was requested in dump (default value is
+        False).
+    """
+    def persistent_load(handle):
+        path, dtype, shape, offset, copy_array = handle
+        shared_buffer = buffers.get(path)
+        if shared_buffer is None:
+            shared_buffer = _SharedBuffer(path)
+            buffers[path] = shared_buffer
+        array = shared_buffer._array(dtype, shape, offset)
+        if copy or copy_array:
+            array = array.copy()
+        return array
+    unpickler = pickle.Unpickler(file)
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
 
 
 class ProcessScheduler(Scheduler):
     """Scheduler that distributes the task to multiple processes.
 
     The subprocess module is used to start the requested number of processes.
-    The execution of each task is internally managed by dedicated thread.
+    Each process is internally managed by a dedicated thread, which takes
+    the tasks from a queue. The queue holds at most one pending task per
+    process, add_task blocks when it is full.
 
     This scheduler should work on all platforms (at least on Linux,
     Windows XP and Vista).
@@ -56,7 +196,7 @@ class ProcessScheduler(Scheduler):
 
     def __init__(self, result_container=None, verbose=False, n_processes=1,
                  source_paths=None, python_executable=None,
-                 cache_callable=True):
+                 cache_callable=True, shared_memory=True):
         """Initialize the scheduler and start the slave processes.
 
         result_container -- ResultContainer used to store the results.
@@ -76,6 +216,14 @@ def __init__(self, result_container=None, verbose=False, n_processes=1,
             is True). Disabling caching can reduce the memory usage, but will
             generally be less efficient since the task_callable has to be
             pickled each time.
+        shared_memory -- Pass large arrays (see SHARED_MEMORY_MIN_BYTES) in
+            the task data and results through memory mapped files instead
+            of pickling them through the pipes (default is True). Each
+            process has its own buffers, which are reused for all tasks.
+            The processes copy the arrays out of the buffers, unless the
+            zero_copy attribute of the task callable is True. Then the
+            arrays of the task are views into the buffer, which are
+            overwritten by the next task.
         """
         super(ProcessScheduler, self).__init__(
                                         result_container=result_container,
@@ -85,6 +233,7 @@ def __init__(self, result_container=None, verbose=False, n_processes=1,
         else:
             self._n_processes = cpu_count()
         self._cache_callable = cache_callable
+        self._shared_memory = shared_memory
         if python_executable is None:
             python_executable = sys.executable
         # get the location of this module to start the processes
@@ -101,96 +250,178 @@ def __init__(self, result_container=None, verbose=False, n_processes=1,
         if source_paths is None:
             source_paths = sys.path
         process_args += source_paths
-        # list of processes not in use, start the processes now
-        self._free_processes = [subprocess.Popen(args=process_args,
-                                                 stdout=subprocess.PIPE,
-                                                 stdin=subprocess.PIPE)
-                                for _ in range(self._n_processes)]
-        # tag each process with its cached callable task_index,
-        # this is compared with _last_callable_index to check if the cached
-        # task_callable is still up to date
-        for process in self._free_processes:
-            process._callable_index = -1
+        self._process_args = process_args
+        self._processes = []
+        # queue of the pending tasks, the threads take the tasks from here
+        self._task_queue = Queue.Queue(maxsize=self._n_processes)
+        self._task_threads = []
+        self._start_processes()
         if self.verbose:
             print ("scheduler initialized with %d processes" %
                    self._n_processes)
 
+    def _create_process(self, result_buffer):
+        """Start a slave process and return it.
+
+        result_buffer -- _SharedBuffer for the results of the process, or
+            None if shared memory is not used.
+
+        The returned object must provide the stdin and stdout of the
+        process. It is also tagged with the task index of its cached
+        callable, this is compared with the callable index of the task to
+        check if the cached task_callable is still up to date.
+        """
+        # the path of the result buffer is the second argument, an empty
+        # string means that the results are pickled
+        if result_buffer is None:
+            result_path = ""
+        else:
+            result_path = result_buffer.path
+        process_args = (self._process_args[:4] + [result_path] +
+                        self._process_args[4:])
+        process = subprocess.Popen(args=process_args,
+                                   stdout=subprocess.PIPE,
+                                   stdin=subprocess.PIPE)
+        process._callable_index = -1
+        return process
+
+    def _start_processes(self):
+        """Start the processes and their task threads."""
+        for _ in range(self._n_processes):
+            if self._shared_memory:
+                result_buffer = _SharedBuffer()
+                process = self._create_process(result_buffer)
+                process._result_buffers = {result_buffer.path: result_buffer}
+                process._task_buffer = _SharedBuffer()
+                # the callable may be cached in the process, so it gets its
+                # own buffer which is not overwritten by the task data
+                process._callable_buffer = _SharedBuffer()
+            else:
+                process = self._create_process(None)
+                process._result_buffers = {}
+            self._processes.append(process)
+        for process in self._processes:
+            thread = threading.Thread(target=self._task_thread,
+                                      args=(process,))
+            thread.setDaemon(True)
+            thread.start()
+            self._task_threads.append(thread)
+
+    def _stop_processes(self):
+        """Stop the task threads, each one shuts down its process.
+
+        This must only be called when there are no open tasks.
+        """
+        for _ in self._task_threads:
+            self._task_queue.put(None)
+        for thread in self._task_threads:
+            thread.join()
+        self._task_threads = []
+        self._processes = []
+
     def _shutdown(self):
         """Shut down the slave processes.
 
         If a process is still running a task then an exception is raised.
         """
         self._lock.acquire()
-        if len(self._free_processes) < self._n_processes:
-            raise Exception("some slave process is still working")
-        for process in self._free_processes:
-            pickle.dump("EXIT", process.stdin)
-            process.stdin.flush()
-        self._lock.release()
+        try:
+            if self._n_open_tasks:
+                raise Exception("some slave process is still working")
+        finally:
+            self._lock.release()
+        self._stop_processes()
         if self.verbose:
             print "scheduler shutdown"
 
     def _process_task(self, data, task_callable, task_index):
-        """Add a task, if possible without blocking.
+        """Add a task to the queue.
 
-        It blocks when the system is not able to start a new thread
-        or when the processes are all in use.
+        It blocks when the processes are all in use and the queue is full,
+        until a process has finished its task.
         """
-        task_started = False
-        while not task_started:
-            if not len(self._free_processes):
-                # release lock for other threads and wait
-                self._lock.release()
-                time.sleep(SLEEP_TIME)
-                self._lock.acquire()
-            else:
-                try:
-                    process = self._free_processes.pop()
-                    self._lock.release()
-                    thread = threading.Thread(target=self._task_thread,
-                                              args=(process, data,
-                                                    task_callable, task_index))
-                    thread.start()
-                    task_started = True
-                except thread.error:
-                    if self.verbose:
-                        print ("unable to create new task thread,"
-                               " waiting 2 seconds...")
-                    time.sleep(2)
-
-    def _task_thread(self, process, data, task_callable, task_index):
-        """Thread function which cares for a single task.
-
-        The task is pushed to the process via stdin, then we wait for the
-        result on stdout, pass the result to the result container, free
-        the process and exit.
+        # the callable index is stored with the task, since
+        # _last_callable_index might change before the task is processed
+        callable_index = self._last_callable_index
+        self._lock.release()
+        self._task_queue.put((data, task_callable, task_index,
+                              callable_index))
+
+    def _task_thread(self, process):
+        """Thread function which cares for the tasks of a single process.
+
+        The tasks are taken from the queue and processed one after the other
+        by calling _run_task. When None is taken from the queue then the
+        process is shut down and the thread exits.
         """
+        while True:
+            task = self._task_queue.get()
+            if task is None:
+                break
+            data, task_callable, task_index, callable_index = task
+            del task
+            try:
+                result = self._run_task(process, data, task_callable,
+                                        task_index, callable_index)
+            except Exception:
+                traceback.print_exc()
+                print >> sys.stderr, ("failed to execute task %d in process"
+                                      % task_index)
+                # store the failure, so that get_results does not block
+                result = TaskFailure(task_index, traceback.format_exc())
+            del data, task_callable
+            self._store_result(result, task_index)
         try:
-            if self._cache_callable:
-                # check if the cached callable is up to date
-                if process._callable_index < self._last_callable_index:
-                    process._callable_index = self._last_callable_index
-                else:
-                    task_callable = None
-            # push the task to the process
+            pickle.dump("EXIT", process.stdin)
+            process.stdin.flush()
+        except IOError:
+            # the process has already terminated
+            pass
+        if self._shared_memory:
+            process._task_buffer.close()
+            process._callable_buffer.close()
+        for result_buffer in process._result_buffers.values():
+            result_buffer.close()
+
+    def _run_task(self, process, data, task_callable, task_index,
+                  callable_index):
+        """Push the task to the process via stdin and return the result.
+
+        The result is read from the stdout of the process.
+        """
+        # task data which the callable might keep is copied in the process
+        copy = not getattr(task_callable, "zero_copy", False)
+        if self._cache_callable:
+            # check if the cached callable is up to date
+            if process._callable_index < callable_index:
+                process._callable_index = callable_index
+            else:
+                task_callable = None
+        # push the task to the process
+        if self._shared_memory:
+            if task_callable is not None:
+                # send the pickled callable as a string in the task
+                pickled_callable = StringIO.StringIO()
+                process._callable_buffer.dump(task_callable,
+                                              pickled_callable, copy=copy)
+                task_callable = pickled_callable.getvalue()
+            process._task_buffer.dump((data, task_callable, task_index),
+                                      process.stdin, copy=copy)
+        else:
             pickle.dump((data, task_callable, task_index),
                         process.stdin, protocol=-1)
             process.stdin.flush()
-            # wait for result to arrive
-            result = pickle.load(process.stdout)
-        except:
-            traceback.print_exc()
-            self._free_processes.append(process)
-            sys.exit("failed to execute task %d in process:" % task_index)
-        # store the result and clean up
-        self._store_result(result, task_index)
-        self._free_processes.append(process)
+        # wait for result to arrive, the result buffer is reused for
+        # the next task, so the arrays are copied
+        return _load(process.stdout, process._result_buffers, copy=True)
 
 
-def _process_run(cache_callable=True):
+def _process_run(cache_callable=True, result_buffer_path=None):
     """Run this function in a worker process to receive and run tasks.
 
     It waits for tasks on stdin, and sends the results back via stdout.
+    If result_buffer_path is given then large arrays in the results are
+    passed in this memory mapped file.
     """
     # use sys.stdout only for pickled objects, everything else goes to stderr
     # NOTE: .buffer is the binary mode interface for stdin and out in py3k
@@ -204,17 +435,40 @@ def _process_run(cache_callable=True):
         pickle_in = sys.stdin
 
     sys.stdout = sys.stderr
+    _process_loop(pickle_in, pickle_out, cache_callable=cache_callable,
+                  result_buffer_path=result_buffer_path)
+
+def _process_loop(pickle_in, pickle_out, cache_callable=True,
+                  result_buffer_path=None, last_callable=None):
+    """Receive and run tasks until the EXIT message arrives.
+
+    pickle_in, pickle_out -- Files to receive the tasks and to send the
+        results.
+    result_buffer_path -- Path of the _SharedBuffer file for the results.
+        If None (default value) then the results are pickled.
+    last_callable -- Cached callable, which is used for tasks that come
+        without a callable (default value is None).
+    """
     exit_loop = False
-    last_callable = None  # cached callable
+    # the task arrays are copied out of the task buffers as requested by
+    # the scheduler, i.e., unless the callable does not keep them
+    task_buffers = {}
+    result_buffer = None
+    if result_buffer_path:
+        result_buffer = _SharedBuffer(result_buffer_path)
     while not exit_loop:
         task = None
         try:
             # wait for task to arrive
-            task = pickle.load(pickle_in)
+            task = _load(pickle_in, task_buffers)
             if task == "EXIT":
                 exit_loop = True
             else:
                 data, task_callable, task_index = task
+                if isinstance(task_callable, str):
+                    # callable was pickled with its own shared buffer
+                    task_callable = _load(StringIO.StringIO(task_callable),
+                                          task_buffers)
                 if task_callable is None:
                     if last_callable is None:
                         err = ("No callable was provided and no cached "
@@ -230,8 +484,12 @@ def _process_run(cache_callable=True):
                     task_callable.setup_environment()
                 result = task_callable(data)
                 del task_callable  # free memory
-                pickle.dump(result, pickle_out, protocol=-1)
-                pickle_out.flush()
+                if result_buffer is not None:
+                    result_buffer.dump(result, pickle_out)
+                else:
+                    pickle.dump(result, pickle_out, protocol=-1)
+                    pickle_out.flush()
+                del task, data, result
         except Exception, exception:
             # return the exception instead of the result
             if task is None:
@@ -241,16 +499,23 @@ def _process_run(cache_callable=True):
             print exception
             traceback.print_exc()
             sys.stdout.flush()
-            sys.exit()
+            exit_loop = True
+    if result_buffer is not None:
+        result_buffer.close()
+    for task_buffer in task_buffers.values():
+        task_buffer.close()
 
 if __name__ == "__main__":
-    # first argument is cache_callable flag
+    # first two arguments are the cache_callable flag and the path of the
+    # result buffer (empty if no shared memory is used)
     cache_callable = sys.argv[1] == "True"
+    result_buffer_path = sys.argv[2] or None
 
-    if len(sys.argv) > 2:
+    if len(sys.argv) > 3:
         # remaining arguments are code paths,
         # put them in front so that they take precedence over PYTHONPATH
-        new_paths = [sys_arg for sys_arg in sys.argv[2:]
+        new_paths = [sys_arg for sys_arg in sys.argv[3:]
                      if sys_arg not in sys.path]
         sys.path = new_paths + sys.path
-    _process_run(cache_callable=cache_callable)
+    _process_run(cache_callable=cache_callable,
+                 result_buffer_path=result_buffer_path)
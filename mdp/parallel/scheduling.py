@@ -73,13 +73,48 @@ def get_results(self):
         return list(zip(*results))[0]
 
 
+class TaskFailure(object):
+    """Marker which is stored instead of the result of a failed task.
+
+    The schedulers store a failure like a normal result, so that
+    get_results does not block. It is up to the user of the results to
+    check for failures (ParallelFlow raises a ParallelFlowException).
+    """
+
+    def __init__(self, task_index=None, message=""):
+        """Store the failure information.
+
+        task_index -- Index of the failed task, can be None if it is not
+            known.
+        message -- Description of the failure, e.g. the traceback.
+        """
+        self.task_index = task_index
+        self.message = message
+
+    def __repr__(self):
+        return "<TaskFailure of task %s>" % self.task_index
+
+
 class TaskCallable(object):
     """Abstract base class for task callables.
 
     This class encapsulates the task behavior and the related fixed data
     (data which stays constant over multiple tasks).
+
+    If the zero_copy attribute is True then the callable does not keep any
+    references to the task data after the result has been returned. A
+    scheduler may then pass large arrays as views into buffers that are
+    reused for the next task (see ProcessScheduler), instead of copying
+    them.
+
+    If the light attribute is True then the callable holds no large data,
+    so it is cheap to pickle. ForkScheduler then sends it to the processes
+    instead of forking them again.
     """
 
+    zero_copy = False
+    light = False
+
     def setup_environment(self):
         """This hook method is only called when the callable is first called
         in a different Python process / environment.
@@ -211,6 +246,9 @@ def __init__(self, result_container=None, verbose=False):
         # count the number of submitted tasks, also used for the task index
         self._task_counter = 0
         self._lock = threading.Lock()
+        # notified whenever a task has finished
+        self._task_finished = threading.Condition(self._lock)
+        self._result_callback = None
         self._last_callable = None  # last callable is stored
         # task index of the _last_callable, can be *.5 if updated between tasks
         self._last_callable_index = -1.0
@@ -278,38 +316,64 @@ def set_task_callable(self, task_callable):
         self._last_callable_index = self.task_counter + 0.5
         self._lock.release()
 
+    def set_result_callback(self, result_callback):
+        """Set a function that is called whenever a task has finished.
+
+        result_callback -- Function that is called with the result and the
+            task index, after the result was added to the result container.
+            It is called in the thread that received the result, so it
+            should return quickly and must not add new tasks. If None
+            (default value) then no function is called.
+
+        get_results only returns after the callbacks for all the finished
+        tasks have returned.
+        """
+        self._lock.acquire()
+        self._result_callback = result_callback
+        self._lock.release()
+
     def _store_result(self, result, task_index):
         """Store a result in the internal result container.
 
-        result -- Result data
+        result -- Result data, a TaskFailure if the task failed.
         task_index -- Task index. Can be None if an error occured.
 
         This function blocks to avoid any problems during result storage.
+        The task is counted as finished even if the result container or
+        the result callback raise an exception.
         """
         self._lock.acquire()
-        self.result_container.add_result(result, task_index)
-        if self.verbose:
-            if task_index is not None:
-                print "    finished task no. %d" % task_index
-            else:
-                print "    task failed"
-        self._n_open_tasks -= 1
-        self._lock.release()
+        try:
+            self.result_container.add_result(result, task_index)
+            if self.verbose:
+                if isinstance(result, TaskFailure):
+                    print "    task failed"
+                else:
+                    print "    finished task no. %d" % task_index
+            result_callback = self._result_callback
+            if result_callback is not None:
+                self._lock.release()
+                try:
+                    result_callback(result, task_index)
+                finally:
+                    self._lock.acquire()
+        finally:
+            self._n_open_tasks -= 1
+            self._task_finished.notify_all()
+            self._lock.release()
 
     def get_results(self):
         """Get the accumulated results from the result container.
 
         This method blocks if there are open tasks.
         """
-        while True:
-            self._lock.acquire()
-            if self._n_open_tasks == 0:
-                results = self.result_container.get_results()
-                self._lock.release()
-                return results
-            else:
-                self._lock.release()
-                time.sleep(1)
+        self._lock.acquire()
+        try:
+            while self._n_open_tasks:
+                self._task_finished.wait()
+            return self.result_container.get_results()
+        finally:
+            self._lock.release()
 
     def shutdown(self):
         """Controlled shutdown of the scheduler.
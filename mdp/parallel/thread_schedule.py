@@ -2,13 +2,13 @@
 Thread based scheduler for distribution across multiple CPU cores.
 """
 
+import sys
 import threading
-import time
+import Queue
+import traceback
 import cPickle as pickle
 
-from scheduling import Scheduler, cpu_count
-
-SLEEP_TIME = 0.1  # time spend sleeping when waiting for a thread to finish
+from scheduling import Scheduler, TaskFailure, cpu_count
 
 
 class ThreadScheduler(Scheduler):
@@ -18,11 +18,15 @@ class ThreadScheduler(Scheduler):
     numpy calculations (or some other external non-blocking C code) or for IO,
     but can be more efficient than ProcessScheduler because of the
     shared memory.
+
+    The threads are started once and take the tasks from a queue, which
+    holds at most one pending task per thread (add_task blocks when it is
+    full).
     """
 
     def __init__(self, result_container=None, verbose=False, n_threads=1,
                  copy_callable=True):
-        """Initialize the scheduler.
+        """Initialize the scheduler and start the threads.
 
         result_container -- ResultContainer used to store the results.
         verbose -- Set to True to get progress reports from the scheduler
@@ -32,6 +36,8 @@ def __init__(self, result_container=None, verbose=False, n_threads=1,
         copy_callable -- Use deep copies of the task callable in the threads.
             This is for example required if some nodes are stateful during
             execution (e.g., a BiNode using the coroutine decorator).
+            Each thread keeps its copy until a new callable is used, like
+            the callable cache of ProcessScheduler.
         """
         super(ThreadScheduler, self).__init__(
                                             result_container=result_container,
@@ -40,45 +46,66 @@ def __init__(self, result_container=None, verbose=False, n_threads=1,
             self._n_threads = n_threads
         else:
             self._n_threads = cpu_count()
-        self._n_active_threads = 0
         self.copy_callable = copy_callable
+        # queue of the pending tasks, the threads take the tasks from here
+        self._task_queue = Queue.Queue(maxsize=self._n_threads)
+        self._threads = []
+        for _ in range(self._n_threads):
+            thread = threading.Thread(target=self._task_thread)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _shutdown(self):
+        """Stop the threads."""
+        for _ in self._threads:
+            self._task_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
 
     def _process_task(self, data, task_callable, task_index):
-        """Add a task, if possible without blocking.
+        """Add a task to the queue.
 
-        It blocks when the maximum number of threads is reached (given by
-        n_threads) or when the system is not able to start a new thread.
+        It blocks when all the threads are busy and the queue is full, until
+        a thread has finished its task.
         """
-        task_started = False
-        while not task_started:
-            if self._n_active_threads >= self._n_threads:
-                # release lock for other threads and wait
-                self._lock.release()
-                time.sleep(SLEEP_TIME)
-                self._lock.acquire()
-            else:
-                self._lock.release()
-                task_callable = task_callable.fork()
-                if self.copy_callable:
-                    # create a deep copy of the task_callable,
-                    # since it might not be thread safe 
-                    # (but the fork is still required)
-                    as_str = pickle.dumps(task_callable, -1)
-                    task_callable = pickle.loads(as_str)
-                try:
-                    thread = threading.Thread(target=self._task_thread,
-                                              args=(data, task_callable,
-                                                    task_index))
-                    thread.start()
-                    task_started = True
-                except Exception:
-                    if self.verbose:
-                        print ("unable to create new thread,"
-                               " waiting 2 seconds...")
-                    time.sleep(2)
+        # the callable index is stored with the task, since
+        # _last_callable_index might change before the task is processed
+        callable_index = self._last_callable_index
+        self._lock.release()
+        self._task_queue.put((data, task_callable, task_index,
+                              callable_index))
 
-    def _task_thread(self, data, task_callable, task_index):
-        """Thread function which processes a single task."""
-        result = task_callable(data)
-        self._store_result(result, task_index)
-        self._n_active_threads -= 1
+    def _task_thread(self):
+        """Thread function which processes the tasks from the queue.
+
+        When None is taken from the queue then the thread exits.
+        """
+        # task index of the cached callable, like in ProcessScheduler
+        cached_callable_index = -1
+        cached_callable = None
+        while True:
+            task = self._task_queue.get()
+            if task is None:
+                break
+            data, task_callable, task_index, callable_index = task
+            del task
+            try:
+                if cached_callable_index < callable_index:
+                    if self.copy_callable:
+                        # create a deep copy of the task_callable,
+                        # since it might not be thread safe
+                        as_str = pickle.dumps(task_callable, -1)
+                        task_callable = pickle.loads(as_str)
+                    cached_callable = task_callable
+                    cached_callable_index = callable_index
+                result = cached_callable.fork()(data)
+            except Exception:
+                traceback.print_exc()
+                print >> sys.stderr, ("failed to execute task %d in thread"
+                                      % task_index)
+                # store the failure, so that get_results does not block
+                result = TaskFailure(task_index, traceback.format_exc())
+            del data, task_callable
+            self._store_result(result, task_index)
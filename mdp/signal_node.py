@@ -56,7 +56,10 @@ class NodeMetaclass(type):
 
     # methods that can overwrite docs:
     DOC_METHODS = ['_train', '_stop_training', '_execute', '_inverse',
-                   '_label', '_prob']
+                   '_label', '_prob', '_label_codes', '_prob_matrix']
+    # methods that also overwrite the docs of the public methods which are
+    # derived from them, unless the private methods of those are defined:
+    DOC_DERIVED_METHODS = {'_label_codes': '_label', '_prob_matrix': '_prob'}
 
     def __new__(cls, classname, bases, members):
         new_cls = super(NodeMetaclass, cls).__new__(cls, classname,
@@ -121,6 +124,11 @@ def _select_private_methods_to_wrap(cls, members):
                 # (so the public method in this class would be missed).
                 if pubname not in members:
                     priv_infos[pubname] = cls._function_infodict(members[privname])
+        for privname, derivedname in cls.DOC_DERIVED_METHODS.iteritems():
+            pubname = derivedname[1:]
+            if (privname in cls.DOC_METHODS and privname in members and
+                derivedname not in members and pubname not in members):
+                priv_infos[pubname] = cls._function_infodict(members[privname])
         return priv_infos
 
     # The next two functions (originally called get_info, wrapper)
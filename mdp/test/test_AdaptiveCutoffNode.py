@@ -35,3 +35,33 @@ def test_AdaptiveCutoffNode_randomdata():
     node.stop_training()
     node.execute(x)
 
+
+def test_AdaptiveCutoffNode_sketch_smalldata():
+    """Test AdaptiveCutoffNode with a quantile sketch on a small data set."""
+    x1 = numx.array([[0.1, 0.3], [0.3, 0.5], [0.5, 0.7]])
+    x2 = numx.array([[0.4, 0.6], [0.2, 0.4], [0.6, 0.2]])
+    node = mdp.nodes.AdaptiveCutoffNode(lower_cutoff_fraction= 0.2,
+                                        upper_cutoff_fraction=0.4,
+                                        quantile_eps=0.01)
+    node.train(x1)
+    node.train(x2)
+    node.stop_training()
+    assert node.data_hist is None
+    # for small data sets the sketch is exact
+    assert numx.all(node.lower_bounds == numx.array([0.2, 0.3]))
+    assert numx.all(node.upper_bounds == numx.array([0.4, 0.5]))
+
+def test_AdaptiveCutoffNode_sketch_randomdata():
+    """Test AdaptiveCutoffNode with a quantile sketch on large random data."""
+    eps = 0.01
+    node = mdp.nodes.AdaptiveCutoffNode(lower_cutoff_fraction= 0.2,
+                                        upper_cutoff_fraction=0.4,
+                                        quantile_eps=eps)
+    x = numx_rand.random((50000, 3))
+    for i in range(0, 50000, 1000):
+        node.train(x[i:i+1000])
+    node.stop_training()
+    assert node._sketch.get_size() < 10 * node._sketch.k
+    # uniform data, quantiles and ranks are the same
+    assert numx.all(abs(node.lower_bounds - 0.2) < 2*eps)
+    assert numx.all(abs(node.upper_bounds - 0.6) < 2*eps)
@@ -133,3 +133,40 @@ def testConvolution2DNode_shape_mismatch():
     node = mdp.nodes.Convolution2DNode(filters, input_shape=(3,2))
     with py.test.raises(mdp.NodeException):
         node.execute(x)
+
+@requires_signal
+def testConvolution2DNode_batched():
+    import sys
+    import scipy.signal
+    x = numx.random.random((7,12,11))
+    filters = numx.random.random((3,4,3))
+    for mode in ['valid', 'same', 'full']:
+        for boundary in ['fill', 'wrap', 'symm']:
+            node = mdp.nodes.Convolution2DNode(filters, approach='linear',
+                                               mode=mode, boundary=boundary,
+                                               fillvalue=0.5,
+                                               output_2d=False)
+            y = node.execute(x)
+            for n_im in range(x.shape[0]):
+                for n_flt in range(filters.shape[0]):
+                    y_ref = scipy.signal.convolve2d(x[n_im], filters[n_flt],
+                                                    mode=mode,
+                                                    boundary=boundary,
+                                                    fillvalue=0.5)
+                    assert_array_almost_equal(y[n_im,n_flt], y_ref, 10)
+        # blocks of images processed by several threads
+        node = mdp.nodes.Convolution2DNode(filters, approach='fft',
+                                           mode=mode, output_2d=False,
+                                           n_threads=3)
+        conv_module = sys.modules['mdp.nodes.convolution_nodes']
+        orig_block_size = conv_module._FFT_BLOCK_SIZE
+        conv_module._FFT_BLOCK_SIZE = 1
+        try:
+            y = node.execute(x)
+        finally:
+            conv_module._FFT_BLOCK_SIZE = orig_block_size
+        for n_im in range(x.shape[0]):
+            for n_flt in range(filters.shape[0]):
+                y_ref = scipy.signal.fftconvolve(x[n_im], filters[n_flt],
+                                                 mode=mode)
+                assert_array_almost_equal(y[n_im,n_flt], y_ref, 10)
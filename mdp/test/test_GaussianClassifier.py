@@ -74,3 +74,51 @@ def distr(size): return normal(0, 1., size=(size)) * std_
     classification = node.label(x)
 
     assert_array_equal(classes, classification)
+
+def testGaussianClassifier_log_prob():
+    dim = 3
+    x = numx_rand.random((300, dim))
+    labels = numx_rand.randint(3, size=300)
+    node = mdp.nodes.GaussianClassifier()
+    node.train(x, labels)
+    node.stop_training()
+    log_prob = node.log_prob(x[:10])
+    for i in range(len(node.labels)):
+        x_mn = x[:10] - node.means[i]
+        exponent = -0.5 * (mult(x_mn, node.inv_covs[i])*x_mn).sum(axis=1)
+        det = numx_linalg.det(utils.inv(node.inv_covs[i]))
+        prob = node.p[i] * numx.exp(exponent) / numx.sqrt((2*numx.pi)**dim*det)
+        assert_array_almost_equal(log_prob[:, i], numx.log(prob))
+    posterior = node.class_probabilities(x[:10])
+    assert_array_almost_equal(posterior.sum(axis=1), numx.ones(10))
+
+def testGaussianClassifier_high_dim():
+    # the probability densities underflow in linear space
+    dim = 200
+    x1 = normal(0., 1., size=(1000, dim))
+    x2 = normal(0., 1., size=(1000, dim)) + 0.5
+    node = mdp.nodes.GaussianClassifier()
+    node.train(x1, 1)
+    node.train(x2, 2)
+    node.stop_training()
+    posterior = node.class_probabilities(x1[:20])
+    assert not numx.isnan(posterior).any()
+    assert_array_almost_equal(posterior.sum(axis=1), numx.ones(20))
+    assert node.label(x1[:20]) == [1] * 20
+
+def testGaussianClassifier_log_prob_blocks():
+    x = numx_rand.random((300, 3))
+    labels = numx_rand.randint(5, size=300)
+    node = mdp.nodes.GaussianClassifier()
+    node.train(x, labels)
+    node.stop_training()
+    log_prob = node.log_prob(x)
+    classifier_nodes = sys.modules['mdp.nodes.classifier_nodes']
+    block_size = classifier_nodes._LOG_PROB_BLOCK_SIZE
+    try:
+        # blocks over both classes and rows
+        for size in (7, 30, 2000):
+            classifier_nodes._LOG_PROB_BLOCK_SIZE = size
+            assert_array_almost_equal(node.log_prob(x), log_prob)
+    finally:
+        classifier_nodes._LOG_PROB_BLOCK_SIZE = block_size
@@ -1,3 +1,4 @@
+import os
 from _tools import *
 
 def testHistogramNode_nofraction():
@@ -18,3 +19,38 @@ def testHistogramNode_fraction():
     node.train(x1)
     node.train(x2)
     assert len(node.data_hist) < 1000
+
+def testHistogramNode_reservoir():
+    """Test HistogramNode with a fixed reservoir size."""
+    node = mdp.nodes.HistogramNode(reservoir_size=100)
+    x1 = numx.arange(60, dtype='d').reshape(30, 2)
+    node.train(x1)
+    assert numx.all(x1 == node.data_hist)
+    x2 = numx_rand.random((1000, 2)) + 100
+    node.train(x2)
+    assert node.data_hist.shape == (100, 2)
+    # stored samples are samples of the training data
+    x = numx.concatenate([x1, x2])
+    assert set(node.data_hist[:,0]) <= set(x[:,0])
+    # every sample should have the same probability to be stored
+    counts = numx.zeros(2)
+    for _ in range(20):
+        node = mdp.nodes.HistogramNode(reservoir_size=100)
+        node.train(x1)
+        node.train(x2[:500])
+        node.train(x2[500:])
+        counts += [(node.data_hist[:,0] < 100).sum(),
+                   (node.data_hist[:,0] >= 100).sum()]
+    assert_almost_equal(counts[0] / counts.sum(), 30. / 1030, 1)
+
+def testHistogramNode_memmap():
+    """Test HistogramNode which appends the history to a file."""
+    filename = os.path.join(py.test.mdp_tempdirname, 'hist_memmap.npy')
+    node = mdp.nodes.HistogramNode(hist_memmap_filename=filename)
+    x1 = numx_rand.random((100, 3))
+    x2 = numx_rand.random((50, 3))
+    node.train(x1)
+    node.train(x2)
+    node.stop_training()
+    assert_array_equal(node.data_hist, numx.concatenate([x1, x2]))
+    assert_array_equal(numx.load(filename), numx.concatenate([x1, x2]))
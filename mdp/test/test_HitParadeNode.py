@@ -53,3 +53,88 @@ def testOneDimensionalHitParade():
     assert_array_equal(ind_maxima,[110,103,0,10,50])
     assert_array_equal(minima,[-3.1,-3,-1.5,-1.4,-1.3])
     assert_array_equal(ind_minima,[123,130,1,11,51])
+
+def _greedy_hits(signal, n, gap):
+    # reference implementation: take the largest values one after
+    # the other, skipping the ones within the gap of a previous hit
+    hits, ind = [], []
+    for i in numx.argsort(-signal, kind='mergesort'):
+        if len(hits) == n:
+            break
+        if all(abs(i-j) > gap for j in ind):
+            hits.append(signal[i])
+            ind.append(i)
+    return hits, ind
+
+def testHitParadeNodeGreedy():
+    signal = uniform((1000,4))
+    n, gap = 10, 7
+    hit = mdp.nodes.HitParadeNode(n,gap)
+    hit.train(signal)
+    maxima, max_ind = hit.get_maxima()
+    minima, min_ind = hit.get_minima()
+    for c in range(4):
+        hits, ind = _greedy_hits(signal[:,c], n, gap)
+        assert_array_equal(maxima[:,c], hits)
+        assert_array_equal(max_ind[:,c], ind)
+        hits, ind = _greedy_hits(-signal[:,c], n, gap)
+        assert_array_equal(minima[:,c], -numx.array(hits))
+        assert_array_equal(min_ind[:,c], ind)
+
+def _per_sample_hits(signal, n, gap):
+    # the former implementation, which walked through the samples
+    M = numx.array([-numx.inf]*n)
+    iM = numx.zeros((n,), dtype='l')
+    lM = 0
+    for i in xrange(len(signal)):
+        k1 = M.argmin()
+        if signal[i] > M[k1]:
+            if i-iM[lM] <= gap and signal[i] > M[lM]:
+                M[lM] = signal[i]
+                iM[lM] = i
+            elif i-iM[lM] > gap:
+                M[k1] = signal[i]
+                iM[k1] = i
+                lM = k1
+    sort = M.argsort()[::-1]
+    return M[sort], iM[sort]
+
+def testHitParadeNodeChunks():
+    n, gap = 6, 5
+    # the hit at 8 suppresses the value at 4, but is itself suppressed by
+    # the hit at 12 in the next chunk, so the value at 4 becomes a hit
+    signal = numx.zeros((40, 1))
+    signal[4,0], signal[8,0], signal[12,0] = 4.5, 5, 6
+    hit = mdp.nodes.HitParadeNode(2,gap)
+    hit.train(signal[:10])
+    hit.train(signal[10:])
+    maxima, max_ind = hit.get_maxima()
+    assert_array_equal(maxima[:,0], [6, 4.5])
+    assert_array_equal(max_ind[:,0], [12, 4])
+    # random signals (the integer signals contain many ties)
+    for signal in [uniform((1000,4)), (uniform((1000,4))*20).astype('i')]:
+        for chunk in [1, 7, 33, 1000]:
+            hit = mdp.nodes.HitParadeNode(n,gap)
+            for start in range(0, 1000, chunk):
+                hit.train(signal[start:start+chunk])
+            maxima, max_ind = hit.get_maxima()
+            minima, min_ind = hit.get_minima()
+            for c in range(4):
+                hits, ind = _greedy_hits(signal[:,c], n, gap)
+                assert_array_equal(maxima[:,c], hits)
+                assert_array_equal(max_ind[:,c], ind)
+                hits, ind = _greedy_hits(-signal[:,c], n, gap)
+                assert_array_equal(minima[:,c], -numx.array(hits))
+                assert_array_equal(min_ind[:,c], ind)
+    # for isolated peaks the former implementation gives the same hits
+    signal = uniform((1000,))
+    peaks = numx.arange(20, 1000, 50)
+    signal[peaks] = 2 + uniform((len(peaks),))
+    hits, ind = _per_sample_hits(signal, n, gap)
+    for chunk in [13, 100]:
+        hit = mdp.nodes.HitParadeNode(n,gap)
+        for start in range(0, 1000, chunk):
+            hit.train(signal[start:start+chunk,numx.newaxis])
+        maxima, max_ind = hit.get_maxima()
+        assert_array_equal(maxima[:,0], hits)
+        assert_array_equal(max_ind[:,0], ind)
@@ -57,3 +57,37 @@ def distr(size): return normal(0, 1., size=(size)) * std_
     node.train(x, classes)
     classification = node.label(x)
     assert_array_equal(classes, classification)
+
+def testNearestMeanClassifier_blocks():
+    x = numx_rand.random((300, 5))
+    labels = numx_rand.randint(20, size=300)
+    node = mdp.nodes.NearestMeanClassifier()
+    node.train(x, labels)
+    node.stop_training()
+    distances = ((x[:, numx.newaxis, :] - node.ordered_means)**2).sum(axis=2)
+    module = sys.modules['mdp.nodes.classifier_nodes']
+    block_size = module._DISTANCE_BLOCK_SIZE
+    try:
+        # force several blocks
+        module._DISTANCE_BLOCK_SIZE = 100
+        codes, labels = node.label_codes(x)
+    finally:
+        module._DISTANCE_BLOCK_SIZE = block_size
+    assert_array_equal(codes, distances.argmin(axis=1))
+
+def testNearestMeanClassifier_approx():
+    nclasses = 400
+    means = normal(0., 10., size=(nclasses, 8))
+    x = numx.repeat(means, 3, axis=0)
+    labels = numx.repeat(numx.arange(nclasses), 3)
+    x += normal(0., 0.1, size=x.shape)
+    node = mdp.nodes.NearestMeanClassifier(approx_cells=20, approx_probes=3)
+    node.train(x, labels)
+    node.stop_training()
+    assert len(node._cell_members) == 20
+    assert sum(len(members) for members in node._cell_members) == nclasses
+    classification = node.label(x)
+    assert (classification == labels).mean() > 0.95
+    # probing all cells gives the exact result
+    node.approx_probes = 20
+    assert_array_equal(node.label(x), labels)
@@ -77,3 +77,34 @@ def test_TimeDelayNodes():
 
     assert_array_equal(real_res, slider_res)
 
+
+def test_TimeDelaySlidingWindowNodeChunks():
+    x = numx_rand.random((100, 3))
+    node = TimeDelayNode(time_frames=4, gap=3)
+    slider = TimeDelaySlidingWindowNode(time_frames=4, gap=3)
+    real_res = node.execute(x)
+    # split the data in chunks of different length
+    bounds = [0, 1, 2, 7, 8, 30, 31, 50, 100]
+    slider_res = numx.concatenate([slider.execute(x[start:stop])
+                                   for start, stop in zip(bounds[:-1],
+                                                          bounds[1:])])
+    assert_array_equal(real_res, slider_res)
+    # after a reset the node starts from scratch
+    slider.reset()
+    assert_array_equal(real_res, slider.execute(x))
+
+def test_TimeDelaySlidingWindowNodeMult():
+    x = numx_rand.random((100, 3))
+    matrix = numx_rand.random((12, 2))
+    y = TimeDelayNode(time_frames=4, gap=3).execute(x)
+    slider = TimeDelaySlidingWindowNode(time_frames=4, gap=3)
+    # the sliding window must be used and updated by both methods
+    prod = numx.concatenate([slider.execute_mult(x[:40], matrix),
+                             slider.execute_mult(x[40:], matrix)])
+    assert_array_almost_equal(prod, mdp.utils.mult(y, matrix))
+    slider.reset()
+    mtx1, avg1, tlen1 = slider.execute_moments(x[:40])
+    mtx2, avg2, tlen2 = slider.execute_moments(x[40:])
+    assert tlen1 + tlen2 == 100
+    assert_array_almost_equal(mtx1 + mtx2, mdp.utils.mult(y.T, y))
+    assert_array_almost_equal(avg1 + avg2, y.sum(axis=0))
@@ -24,3 +24,32 @@ def test_TimeFramesNode():
 
 def test_TimeFramesNodeBugInputDim():
     mdp.nodes.TimeFramesNode(time_frames=10, gap=1, input_dim=1)
+
+def test_TimeFramesNodeView():
+    inp = numx_rand.random((50, 3))
+    copy = mdp.nodes.TimeFramesNode(time_frames=4, gap=1)
+    view = mdp.nodes.TimeFramesNode(time_frames=4, gap=1, view=True)
+    out = view.execute(inp)
+    assert_array_equal(out, copy.execute(inp))
+    # the output shares the memory of the input
+    assert not out.flags.writeable
+    assert out.base is not None
+    # with gap > 1 the layout does not allow a view
+    view = mdp.nodes.TimeFramesNode(time_frames=4, gap=3, view=True)
+    copy = mdp.nodes.TimeFramesNode(time_frames=4, gap=3)
+    out = view.execute(inp)
+    assert out.flags.writeable
+    assert_array_equal(out, copy.execute(inp))
+
+def test_TimeFramesNodeFused():
+    inp = numx_rand.random((50, 3))
+    for klass in (mdp.nodes.TimeFramesNode, mdp.nodes.TimeDelayNode):
+        node = klass(time_frames=4, gap=3)
+        out = node.execute(inp)
+        matrix = numx_rand.random((node.output_dim, 2))
+        assert_array_almost_equal(node.execute_mult(inp, matrix),
+                                  mult(out, matrix))
+        mtx, avg, tlen = node.execute_moments(inp)
+        assert_array_almost_equal(mtx, mult(out.T, out))
+        assert_array_almost_equal(avg, out.sum(axis=0))
+        assert_equal(tlen, out.shape[0])
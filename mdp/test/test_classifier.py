@@ -178,3 +178,111 @@ def testKMeansClassifier():
             set(res1) != set(res2)
             ), ("Error in K-Means classifier. "
                 "This might be a bug or just a local minimum.")
+
+def testClassifierNode_array_api():
+    bc = _BogusClassifier()
+    test_data = numx_rand.random((30, 20)) - 0.5
+    probs, labels = bc.prob_matrix(test_data)
+    assert probs.shape == (30, 2)
+    for prob_row, prob in zip(probs, bc.prob(test_data)):
+        for i, label in enumerate(labels):
+            assert prob_row[i] == prob[label]
+    codes, code_labels = bc.label_codes(test_data)
+    assert [code_labels[code] for code in codes] == bc.label(test_data)
+
+def testClassifierNode_label_codes_only():
+    class _CodesClassifier(ClassifierNode):
+        @staticmethod
+        def is_trainable():
+            return False
+        def _label_codes(self, x):
+            return (x[:, 0] > 0).astype('i'), ["neg", "pos"]
+    node = _CodesClassifier()
+    x = numx.array([[1., 0.], [-1., 2.], [3., -1.]])
+    assert node.label(x) == ["pos", "neg", "pos"]
+    assert_array_equal(node.label_codes(x)[0], [1, 0, 1])
+    py.test.raises(NotImplementedError, node.prob, x)
+
+def testKNNClassifier_label_codes():
+    node = mdp.nodes.KNNClassifier(k=3)
+    x = numx.concatenate((numx_rand.random((20, 2)),
+                          numx_rand.random((20, 2)) + 2))
+    node.train(x[:20], "a")
+    node.train(x[20:], "b")
+    node.stop_training()
+    codes, labels = node.label_codes(x)
+    assert [labels[code] for code in codes] == ["a"] * 20 + ["b"] * 20
+
+def testSimpleMarkovClassifier_counts():
+    x = numx_rand.randint(3, size=(500, 2))
+    labels = numx_rand.randint(4, size=500)
+    for sparse in (False, True):
+        mc = SimpleMarkovClassifier(sparse=sparse)
+        mc.train(x[:250], labels[:250])
+        mc.train(x[250:400], list(labels[250:400]))
+        mc.train(x[400:450], 7)
+        # new features and labels in later chunks
+        mc.train(x[450:] + 3, labels[450:] + 10)
+        x[450:] += 3
+        labels[400:450] = 7
+        labels[450:] += 10
+        assert mc.ntotal_connections == 500
+        for (feature, label), count in mc.connections.items():
+            assert count == ((x == feature).all(axis=1) &
+                             (labels == label)).sum()
+        for feature, count in mc.features.items():
+            assert count == (x == feature).all(axis=1).sum()
+        probs = mc.prob(x[:20])
+        for feature, prob in zip(x[:20], probs):
+            feature_labels = labels[(x == feature).all(axis=1)]
+            for label, p in prob.items():
+                assert_almost_equal(p, (feature_labels == label).mean())
+        # unknown features have no probabilities
+        assert mc.prob(numx.array([[9, 9]])) == [{}]
+        codes, label_list = mc.label_codes(x[:20])
+        for prob, code in zip(probs, codes):
+            assert prob[label_list[code]] == max(prob.values())
+
+def testDiscreteHopfieldClassifier_modes():
+    memory_size = 200
+    patterns = numx_rand.random((10, memory_size)) > 0.5
+    noisy = patterns.copy()
+    flips = numx_rand.random(noisy.shape) > 0.95
+    noisy[flips] = ~noisy[flips]
+    for mode, block_size in (('async', 1), ('async', 10), ('sync', 1)):
+        h = DiscreteHopfieldClassifier(update_mode=mode,
+                                       block_size=block_size, max_iter=50)
+        # train all patterns in one chunk
+        h.train(patterns)
+        h.stop_training()
+        assert_array_equal(h.label(patterns), patterns)
+        # recall all noisy patterns at once
+        retrieved = h.label(noisy)
+        for p, r in zip(patterns, retrieved):
+            assert numx.all(r == p) or numx.all(r != p)
+
+def testDiscreteHopfieldClassifier_weights():
+    patterns = numx_rand.random((5, 30)) > 0.5
+    h = DiscreteHopfieldClassifier()
+    h.train(patterns[:2])
+    h.train(patterns[2:])
+    h.stop_training()
+    weights = numx.zeros((30, 30))
+    for p in patterns:
+        sign = utils.bool_to_sign(p)
+        weights += numx.outer(sign, sign)
+    weights -= numx.diag(numx.diag(weights))
+    assert_array_equal(h._weight_matrix, weights)
+    assert h.load_parameter == 5 / 30.
+
+def testSimpleMarkovClassifier_attributes():
+    mc = SimpleMarkovClassifier()
+    mc.train(numx.array([[1, 2], [1, 2], [3, 4]]), ["a", "b", "a"])
+    assert mc.ntotal_connections == 3
+    assert mc.features == {(1, 2): 2, (3, 4): 1}
+    assert mc.labels == {"a": 2, "b": 1}
+    assert mc.connections == {((1, 2), "a"): 1, ((1, 2), "b"): 1,
+                              ((3, 4), "a"): 1}
+    # the occurrence dictionaries are plain attributes
+    mc.features = {}
+    assert mc.features == {}
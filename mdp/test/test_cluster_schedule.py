@@ -0,0 +1,169 @@
+from __future__ import with_statement
+import socket
+import threading
+from _tools import *
+
+import mdp.parallel as parallel
+n = numx
+
+def test_message_framing():
+    """Test that arrays are passed correctly as raw buffers."""
+    cluster_schedule = sys.modules['mdp.parallel.cluster_schedule']
+    x = n.random.random((100, 50))
+    obj = {"c": x, "same": x, "f": n.asfortranarray(x), "strided": x[:, ::3],
+           "small": n.arange(3), "ints": n.arange(5000, dtype="int16"),
+           "objects": n.array([None, "a"] * 1000, dtype=object)}
+    sock1, sock2 = socket.socketpair()
+    try:
+        cluster_schedule._send_message(sock1, obj)
+        received = cluster_schedule._recv_message(sock2)
+    finally:
+        sock1.close()
+        sock2.close()
+    for key in obj:
+        assert received[key].dtype == obj[key].dtype
+        assert n.all(received[key] == obj[key])
+    assert received["f"].flags.f_contiguous
+    assert received["same"] is received["c"]
+
+def test_cluster_scheduler_order():
+    """Test the correct result order in cluster scheduler."""
+    with parallel.LocalClusterScheduler(n_workers=3) as scheduler:
+        max_i = 8
+        for i in xrange(max_i):
+            scheduler.add_task((n.arange(0,i+1), (max_i-1-i)*1.0/4),
+                               parallel.SleepSqrTestCallable())
+        results = scheduler.get_results()
+    results = n.concatenate(results)
+    assert n.all(results ==
+                     n.concatenate([n.arange(0,i+1)**2
+                                    for i in xrange(max_i)]))
+
+def test_cluster_scheduler_credits():
+    """Test that the tasks are spread over the workers with free credits."""
+    with parallel.LocalClusterScheduler(n_workers=2,
+                                        n_credits=1) as scheduler:
+        # each worker gets one of the tasks, so they run in parallel
+        start_time = time.time()
+        for i in xrange(2):
+            scheduler.add_task((i, 1.0), parallel.SleepSqrTestCallable())
+        # blocks until a worker has returned its credit
+        scheduler.add_task((2, 0.0))
+        assert time.time() - start_time > 0.9
+        results = scheduler.get_results()
+        assert time.time() - start_time < 1.9
+    assert list(results) == [0, 1, 4]
+
+def test_cluster_scheduler_arrays():
+    """Test that large task data and results are passed correctly."""
+    x = n.random.random((300, 200))
+    with parallel.LocalClusterScheduler(n_workers=2) as scheduler:
+        scheduler.add_task(x, parallel.SqrTestCallable())
+        scheduler.add_task(x.T)
+        scheduler.add_task(x[::2])
+        results = scheduler.get_results()
+    assert_array_equal(results[0], x**2)
+    assert_array_equal(results[1], (x**2).T)
+    assert_array_equal(results[2], x[::2]**2)
+
+def test_cluster_scheduler_failure():
+    """Test that a failing task does not block the scheduler."""
+    with parallel.LocalClusterScheduler(n_workers=2) as scheduler:
+        scheduler.add_task("a", parallel.SqrTestCallable())
+        scheduler.add_task(3)
+        results = scheduler.get_results()
+    assert isinstance(results[0], parallel.TaskFailure)
+    assert results[0].task_index == 1
+    assert results[1] == 9
+
+class _LambdaTestCallable(parallel.TaskCallable):
+    """Callable for testing which returns an unpicklable result."""
+
+    def __call__(self, data):
+        """Return a lambda function."""
+        return lambda: data
+
+def test_cluster_scheduler_result_failure():
+    """Test that an unpicklable result does not kill the worker."""
+    with parallel.LocalClusterScheduler(n_workers=1) as scheduler:
+        scheduler.add_task(2, _LambdaTestCallable())
+        scheduler.add_task(3, parallel.SqrTestCallable())
+        results = scheduler.get_results()
+    assert isinstance(results[0], parallel.TaskFailure)
+    assert results[0].task_index == 1
+    assert results[1] == 9
+
+def test_cluster_scheduler_secret():
+    """Test that a worker rejects a scheduler with a wrong secret."""
+    cluster_schedule = sys.modules['mdp.parallel.cluster_schedule']
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("localhost", 0))
+    server.listen(1)
+    def serve():
+        sock, _ = server.accept()
+        try:
+            cluster_schedule._serve_connection(sock, "secret", 1)
+        finally:
+            sock.close()
+            server.close()
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        py.test.raises(mdp.MDPException, parallel.ClusterScheduler,
+                       [server.getsockname()], secret="wrong")
+    finally:
+        thread.join()
+
+def test_cluster_scheduler_worker_secret():
+    """Test that the scheduler rejects a worker with a wrong secret."""
+    cluster_schedule = sys.modules['mdp.parallel.cluster_schedule']
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("localhost", 0))
+    server.listen(1)
+    def serve():
+        # like _serve_connection, but the worker does not know the secret
+        sock, _ = server.accept()
+        try:
+            challenge = "x" * cluster_schedule._CHALLENGE_BYTES
+            sock.sendall(challenge)
+            cluster_schedule._recv_bytes(sock, len(
+                    cluster_schedule._digest("", challenge)) +
+                    cluster_schedule._CHALLENGE_BYTES)
+            sock.sendall(cluster_schedule._digest("wrong", challenge))
+            cluster_schedule._send_message(sock, ("HELLO", 1))
+        finally:
+            sock.close()
+            server.close()
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        py.test.raises(mdp.MDPException, parallel.ClusterScheduler,
+                       [server.getsockname()], secret="secret")
+    finally:
+        thread.join()
+
+def test_cluster_worker_empty_secret():
+    """Test that a worker does not start without a secret."""
+    cluster_schedule = sys.modules['mdp.parallel.cluster_schedule']
+    py.test.raises(mdp.MDPException, cluster_schedule._run_worker,
+                   port=0, secret="")
+
+def test_cluster_scheduler_flow():
+    """Test cluster scheduler with real Nodes."""
+    precision = 6
+    flow = mdp.parallel.ParallelFlow([mdp.nodes.PCANode(output_dim=5),
+                                      mdp.nodes.SFANode(output_dim=3)])
+    parallel_flow = mdp.parallel.ParallelFlow(flow.copy()[:])
+    train_iterables = [[n.random.random((500, 10)) for _ in xrange(8)]
+                       for _ in xrange(2)]
+    x = n.random.random((10, 10))
+    with parallel.LocalClusterScheduler(n_workers=3) as scheduler:
+        parallel_flow.train(train_iterables, scheduler=scheduler,
+                            sticky=True)
+        # more chunks than workers to test the callable caching
+        y2 = parallel_flow.execute([x for _ in xrange(8)],
+                                   scheduler=scheduler)
+    flow.train(train_iterables)
+    assert parallel_flow[0].tlen == flow[0].tlen
+    y1 = flow.execute(n.concatenate([x for _ in xrange(8)]))
+    assert_array_almost_equal(abs(y1), abs(y2), precision)
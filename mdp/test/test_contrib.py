@@ -226,3 +226,28 @@ def test_XSFANode():
     assert min(corrs) > 0.8, ('source/estimate minimal'
                               ' covariance: %g' % min(corrs))
 
+
+def test_NIPALSNode_block():
+    # high dimensional data with few samples and decaying variances
+    mat = numx_rand.normal(size=(200, 60)) * numx.exp(-numx.arange(60)/5.)
+    mat = mult(mat, utils.random_rot(60))
+    pca = mdp.nodes.PCANode(output_dim=12)
+    pca.train(mat)
+    pca.stop_training()
+    for chunk_dir in (None, py.test.mdp_tempdirname):
+        nipals = mdp.nodes.NIPALSNode(output_dim=12, block_size=5,
+                                      conv=1e-14, chunk_dir=chunk_dir)
+        for i in range(0, 200, 50):
+            nipals.train(mat[i:i+50])
+        nipals.stop_training()
+        assert nipals.output_dim == 12
+        assert_array_almost_equal(nipals.d, pca.d, 6)
+        assert_array_almost_equal(abs(nipals.execute(mat)),
+                                  abs(pca.execute(mat)), 4)
+    # the number of components is given by the explained variance
+    nipals = mdp.nodes.NIPALSNode(output_dim=0.8, block_size=3)
+    nipals.train(mat)
+    nipals.stop_training()
+    var = pca.d.cumsum() / nipals.total_variance
+    assert nipals.explained_variance >= 0.8
+    assert nipals.output_dim == numx.flatnonzero(var >= 0.8)[0] + 1
@@ -182,6 +182,115 @@ def test_CloneLayer():
     assert layer.dtype == numx.dtype('f')
     assert y.dtype == layer.dtype
 
+def test_CloneLayer_batched():
+    x = numx_rand.random([100,70])
+    node = mdp.nodes.PCANode(input_dim=10, output_dim=5)
+    layer = mh.CloneLayer(node, 7)
+    layer.train(x)
+    batched_node = mdp.nodes.PCANode(input_dim=10, output_dim=5)
+    batched_layer = mh.CloneLayer(batched_node, 7, batched=True)
+    batched_layer.train(x[:50])
+    batched_layer.train(x[50:])
+    # the covariance is accumulated from the same data in both cases
+    assert_array_almost_equal(abs(node.get_projmatrix()),
+                              abs(batched_node.get_projmatrix()), 10)
+    y = layer.execute(x)
+    assert_array_almost_equal(batched_layer.execute(x), y, 10)
+    assert_array_almost_equal(batched_layer.inverse(y), layer.inverse(y), 10)
+
+def test_Layer_threads():
+    x = numx_rand.random([100,60])
+    def get_nodes():
+        return [mdp.nodes.PCANode(input_dim=10, output_dim=4)
+                for _ in range(6)]
+    layer = mh.Layer(get_nodes())
+    threaded_layer = mh.Layer(get_nodes(), n_threads=3)
+    for l in (layer, threaded_layer):
+        l.train(x)
+        l.stop_training()
+    y = layer.execute(x)
+    assert_array_almost_equal(abs(threaded_layer.execute(x)), abs(y), 10)
+    assert_array_almost_equal(abs(threaded_layer.inverse(y)),
+                              abs(layer.inverse(y)), 10)
+    same_layer = mh.SameInputLayer(
+                    [mdp.nodes.PCANode(input_dim=60, output_dim=i)
+                     for i in range(1, 5)], n_threads=4)
+    same_layer.train(x)
+    same_layer.stop_training()
+    y = same_layer.execute(x)
+    assert y.shape == (100, 10)
+    assert_array_almost_equal(y[:, 6:], same_layer.nodes[3].execute(x), 10)
+
+def test_Layer_threads_blas():
+    layer = mh.Layer([mdp.nodes.PCANode(input_dim=2) for _ in range(4)],
+                     n_threads=4)
+    module = sys.modules['mdp.hinet.layer']
+    old_environ = dict(module.os.environ)
+    try:
+        for variable in module._BLAS_THREADS_VARIABLES:
+            module.os.environ.pop(variable, None)
+        assert layer._n_workers(10) == 4
+        assert layer._n_workers(2) == 2
+        module.os.environ['OMP_NUM_THREADS'] = str(module.cpu_count())
+        assert layer._n_workers(10) == 1
+    finally:
+        module.os.environ.clear()
+        module.os.environ.update(old_environ)
+
+def test_Rect2dSwitchboard_field_view():
+    for in_channels_xy, field_channels_xy, spacing_xy, channel_dim in [
+                    ((6, 4), (2, 2), (1, 1), 1), ((7, 5), (3, 2), (2, 3), 3),
+                    ((4, 4), (4, 4), (1, 1), 2)]:
+        sboard = mh.Rectangular2dSwitchboard(
+                                    in_channels_xy=in_channels_xy,
+                                    field_channels_xy=field_channels_xy,
+                                    field_spacing_xy=spacing_xy,
+                                    in_channel_dim=channel_dim,
+                                    ignore_cover=True)
+        x = numx_rand.random((5, sboard.input_dim))
+        view = sboard.get_field_view(x)
+        assert view.shape == (5, sboard.out_channels_xy[1],
+                              sboard.out_channels_xy[0],
+                              field_channels_xy[1], field_channels_xy[0],
+                              channel_dim)
+        assert_array_equal(view.reshape((5, -1)), x[:, sboard.connections])
+        y = sboard.execute(x)
+        assert_array_equal(y, x[:, sboard.connections])
+        y[:] = 0
+        assert x.any()
+        # a non-contiguous input is copied before the view is taken
+        x = numx_rand.random((10, sboard.input_dim))[::2]
+        y = sboard.execute(x)
+        assert_array_equal(y, x[:, sboard.connections])
+        y += 1
+
+def test_Rect2dCloneLayer():
+    sboard = mh.Rectangular2dSwitchboard(in_channels_xy=(8, 6),
+                                         field_channels_xy=(4, 3),
+                                         field_spacing_xy=(2, 1),
+                                         in_channel_dim=2)
+    x = numx_rand.random((50, sboard.input_dim))
+    node = mdp.nodes.PCANode(input_dim=sboard.out_channel_dim, output_dim=3)
+    flow = mdp.Flow([sboard, mh.CloneLayer(node, sboard.output_channels)])
+    flow.train(x)
+    fused_node = mdp.nodes.PCANode(input_dim=sboard.out_channel_dim,
+                                   output_dim=3)
+    fused = mh.Rectangular2dCloneLayer(sboard, fused_node)
+    module = sys.modules['mdp.hinet.layer']
+    block_size = module._FIELD_BLOCK_SIZE
+    try:
+        # force several blocks
+        module._FIELD_BLOCK_SIZE = 1000
+        fused.train(x)
+        fused.stop_training()
+        y = fused.execute(x)
+    finally:
+        module._FIELD_BLOCK_SIZE = block_size
+    assert fused.output_dim == 3 * sboard.output_channels
+    assert_array_almost_equal(abs(fused_node.get_projmatrix()),
+                              abs(node.get_projmatrix()), 10)
+    assert_array_almost_equal(abs(y), abs(flow.execute(x)), 10)
+
 def test_SwitchboardInverse1():
     sboard = mh.Switchboard(input_dim=3,
                             connections=[2,0,1])
@@ -190,6 +299,28 @@ def test_SwitchboardInverse1():
     x = sboard.inverse(y)
     assert numx.all(x == numx.array([[3,4,2],[6,7,5]]))
 
+def test_Switchboard_runs():
+    # the routing with slices, a view and an index array agree
+    x = numx_rand.random((5, 40))
+    connections = numx.concatenate((numx.arange(10, 30),
+                                    numx.arange(0, 10),
+                                    numx.arange(30, 40)))
+    sboard = mh.Switchboard(input_dim=40, connections=connections)
+    assert len(sboard._runs) == 3
+    assert_array_equal(sboard.execute(x), x[:, connections])
+    assert_array_equal(sboard.inverse(sboard.execute(x)), x)
+    sboard = mh.Switchboard(input_dim=40, connections=numx.arange(5, 35))
+    assert len(sboard._runs) == 1
+    assert_array_equal(sboard.execute(x), x[:, 5:35])
+    connections = numx_rand.permutation(40)
+    sboard = mh.Switchboard(input_dim=40, connections=connections)
+    assert sboard._runs is None
+    assert_array_equal(sboard.execute(x), x[:, connections])
+    assert_array_equal(sboard.inverse(sboard.execute(x)), x)
+    # arrays with more than two dimensions are routed along the second one
+    x = numx_rand.random((3, 40, 2))
+    assert_array_equal(sboard._execute(x), x[:, connections])
+
 def testSwitchboardInverse2():
     sboard = mh.Switchboard(input_dim=3,
                             connections=[2,1,1])
@@ -213,6 +344,19 @@ def test_MeanInverseSwitchboard2():
     x = sboard.inverse(y)
     assert numx.all(x == numx.array([[0,2,1],[0,3,3]]))
 
+def test_MeanInverseSwitchboard3():
+    connections = numx_rand.randint(0, 10, size=30)
+    sboard = mh.MeanInverseSwitchboard(input_dim=12,
+                                       connections=connections)
+    y = numx_rand.random((4, 30))
+    x = sboard.inverse(y)
+    for i in range(12):
+        if i in connections:
+            assert_array_almost_equal(x[:, i],
+                                      y[:, connections == i].mean(axis=1))
+        else:
+            assert numx.all(x[:, i] == 0)
+
 ## Tests for ChannelSwitchboard ##
 
 def testOutChannelInput():
@@ -305,6 +449,37 @@ def testRect2d_get_out_channel_node():
     layer_y = layer.execute(x)
     assert (y == layer_y).all()
 
+def test_Rect2d_shared_connections():
+    # switchboards with the same geometry share the connection table
+    args = dict(in_channels_xy=(6,4), field_channels_xy=(2,2),
+                field_spacing_xy=(2,1), in_channel_dim=2)
+    sboard1 = mh.Rectangular2dSwitchboard(**args)
+    sboard2 = mh.Rectangular2dSwitchboard(**args)
+    assert sboard1.connections is sboard2.connections
+    assert not sboard1.connections.flags.writeable
+    args["in_channel_dim"] = 3
+    sboard3 = mh.Rectangular2dSwitchboard(**args)
+    assert sboard3.connections is not sboard1.connections
+    for sboard_class, args in [
+            (mh.DoubleRect2dSwitchboard,
+             dict(in_channels_xy=(6,4), field_channels_xy=2,
+                  in_channel_dim=2)),
+            (mh.DoubleRhomb2dSwitchboard,
+             dict(long_in_channels_xy=(4,3), diag_field_channels=2,
+                  in_channel_dim=2))]:
+        sboard1 = sboard_class(**args)
+        sboard2 = sboard_class(**args)
+        assert sboard1.connections is sboard2.connections
+    # copies get their own connections
+    sboard_copy = sboard1.copy()
+    assert sboard_copy.connections is not sboard1.connections
+    assert (sboard_copy.connections == sboard1.connections).all()
+    # a table passed by the user is still copied
+    connections = numx.array([0, 2, 1])
+    sboard = mh.Switchboard(input_dim=3, connections=connections)
+    connections[0] = 1
+    assert sboard.connections[0] == 0
+
 def test_Rect2d_exception_1():
     bad_args = dict(in_channels_xy=(12,8),
                     # 3 is the problematic value:
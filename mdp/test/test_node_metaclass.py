@@ -125,3 +125,28 @@ def _train(self, x, foo2=None):
     cnode.train(X, foo2='abc')
     assert cnode.foo2 == 42
     assert get_signature(cnode.train) == 'self, x, foo2'
+
+def test_docstrings_derived_classifier_methods():
+    # the array methods also document the public methods derived from them
+    class ArrayClassifier(mdp.ClassifierNode):
+        @staticmethod
+        def is_trainable():
+            return False
+        def _label_codes(self, x):
+            """doc label codes"""
+            return mdp.numx.zeros(len(x), dtype='i'), [7]
+    node = ArrayClassifier()
+    assert node.label.__doc__ == "doc label codes"
+    assert node.label_codes.__doc__ == "doc label codes"
+    assert node.label(X[:3]) == [7, 7, 7]
+    assert get_signature(node.label) == 'self, x'
+    # but the docs of the methods defined in the class take precedence
+    class Classifier(ArrayClassifier):
+        def _label(self, x):
+            """doc label"""
+            return [8] * len(x)
+    node = Classifier()
+    assert node.label.__doc__ == "doc label"
+    assert node.label(X[:2]) == [8, 8]
+    assert mdp.nodes.GaussianClassifier.label.__doc__ == (
+                        "Classify the input data using Maximum A-Posteriori.")
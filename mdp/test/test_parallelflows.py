@@ -95,6 +95,149 @@ def test_multiphase():
     iterable = [n.random.random((20,10)) for _ in xrange(6)]
     flow.execute(iterable, scheduler=scheduler)
 
+def test_tree_reduce():
+    """Test parallel training with the tree reduction of the results."""
+    data_iterables = [[n.random.random((30,10))*n.arange(1,11)
+                       for _ in xrange(7)],
+                      None,
+                      [n.random.random((30,10))*n.arange(1,11)
+                       for _ in xrange(7)]]
+    x = n.random.random((20,10))
+    ys = []
+    for tree_reduce in [False, True]:
+        flow = parallel.ParallelFlow([
+                            mdp.nodes.PCANode(output_dim=5),
+                            mdp.nodes.PolynomialExpansionNode(degree=2),
+                            mdp.nodes.PCANode(output_dim=10)])
+        scheduler = parallel.ThreadScheduler(n_threads=3)
+        flow.train(data_iterables, scheduler=scheduler,
+                   tree_reduce=tree_reduce)
+        scheduler.shutdown()
+        assert flow[0].tlen == 7*30
+        ys.append(flow.execute(x))
+    assert_array_almost_equal(abs(ys[0]), abs(ys[1]), 8)
+    # failed tasks are not silently dropped
+    scheduler = parallel.Scheduler()
+    py.test.raises(parallel.ParallelFlowException,
+                   parallel.ParallelFlow._tree_reduce_results,
+                   [mdp.hinet.FlowNode(mdp.Flow([mdp.nodes.PCANode()])),
+                    parallel.TaskFailure(2)], scheduler)
+
+def test_sticky():
+    """Test parallel training with worker-resident flownodes."""
+    parallelflows = sys.modules['mdp.parallel.parallelflows']
+    data_iterables = [[n.random.random((30,10))*n.arange(1,11)
+                       for _ in xrange(7)],
+                      None,
+                      [n.random.random((30,10))*n.arange(1,11)
+                       for _ in xrange(7)]]
+    x = n.random.random((20,10))
+    ys = []
+    for scheduler, sticky, tree_reduce in [
+                        (parallel.Scheduler(), False, False),
+                        (parallel.Scheduler(), True, False),
+                        (parallel.ThreadScheduler(n_threads=3), True, False),
+                        (parallel.ThreadScheduler(n_threads=3), True, True)]:
+        flow = parallel.ParallelFlow([
+                            mdp.nodes.PCANode(output_dim=5),
+                            mdp.nodes.PolynomialExpansionNode(degree=2),
+                            mdp.nodes.PCANode(output_dim=10)])
+        flow.train(data_iterables, scheduler=scheduler, sticky=sticky,
+                   tree_reduce=tree_reduce)
+        scheduler.shutdown()
+        assert flow[0].tlen == 7*30
+        assert flow[2].tlen == 7*30
+        assert not parallelflows._STICKY_CALLABLES
+        ys.append(flow.execute(x))
+    for y in ys[1:]:
+        assert_array_almost_equal(abs(ys[0]), abs(y), 8)
+
+def test_task_failure():
+    """Test that failed tasks raise an exception instead of blocking."""
+    data_iterables = [[n.random.random((30,10)) for _ in xrange(5)] +
+                      [n.random.random((30,3))]]
+    parallelflows = sys.modules['mdp.parallel.parallelflows']
+    for sticky, tree_reduce in [(False, False), (False, True),
+                                (True, False), (True, True)]:
+        flow = parallel.ParallelFlow([mdp.nodes.PCANode(output_dim=2)])
+        scheduler = parallel.ThreadScheduler(n_threads=2)
+        try:
+            py.test.raises(parallel.ParallelFlowException, flow.train,
+                           data_iterables, scheduler=scheduler,
+                           sticky=sticky, tree_reduce=tree_reduce)
+        finally:
+            scheduler.shutdown()
+        # the resident flownodes are removed despite the failure
+        assert not parallelflows._STICKY_CALLABLES
+    flow = parallel.ParallelFlow([mdp.nodes.PCANode(output_dim=2)])
+    flow.train([[n.random.random((30,10))]])
+    scheduler = parallel.ThreadScheduler(n_threads=2)
+    try:
+        py.test.raises(parallel.ParallelFlowException, flow.execute,
+                       [n.random.random((5,10)), n.random.random((5,3))],
+                       scheduler=scheduler)
+    finally:
+        scheduler.shutdown()
+
+class _SleepPCANode(mdp.nodes.PCANode):
+    """PCANode with slow training, so that every thread gets a task."""
+
+    def _train(self, x):
+        time.sleep(0.05)
+        super(_SleepPCANode, self)._train(x)
+
+def test_sticky_flush_failure():
+    """Test that a failed flush task still removes all resident flownodes.
+    """
+    parallelflows = sys.modules['mdp.parallel.parallelflows']
+    purge_flownode = parallelflows._purge_flownode
+    calls = []
+    def failing_purge_flownode(flownode):
+        calls.append(flownode)
+        if len(calls) == 1:
+            raise Exception("purge failed")
+        purge_flownode(flownode)
+    data_iterables = [[n.random.random((30,10)) for _ in xrange(6)]]
+    flow = parallel.ParallelFlow([_SleepPCANode(output_dim=2)])
+    scheduler = parallel.ThreadScheduler(n_threads=3)
+    parallelflows._purge_flownode = failing_purge_flownode
+    try:
+        py.test.raises(parallel.ParallelFlowException, flow.train,
+                       data_iterables, scheduler=scheduler, sticky=True)
+    finally:
+        parallelflows._purge_flownode = purge_flownode
+        scheduler.shutdown()
+    # all three threads held a flownode
+    assert len(calls) == 3
+    assert not parallelflows._STICKY_CALLABLES
+
+class _ScriptedScheduler(object):
+    """Scheduler for testing which returns the given results per round."""
+
+    def __init__(self, rounds):
+        self.rounds = list(rounds)
+        # number of tasks added in each round
+        self.n_tasks = [0]
+
+    def add_task(self, data, task_callable=None):
+        self.n_tasks[-1] += 1
+
+    def get_results(self):
+        self.n_tasks.append(0)
+        return self.rounds.pop(0)
+
+def test_sticky_flush_failure_rounds():
+    """Test that the flush continues after a failed flush task."""
+    scheduler = _ScriptedScheduler([
+                        [parallel.TaskFailure(1), ("a", "flownode a")],
+                        [("a", None), ("b", "flownode b")]])
+    py.test.raises(parallel.ParallelFlowException,
+                   parallel.ParallelFlow._flush_sticky_results,
+                   ["a", "b", "a"], scheduler)
+    # the second round was still sent, for both workers
+    assert not scheduler.rounds
+    assert scheduler.n_tasks == [2, 2, 0]
+
 def test_firstnode():
     """Test special case in which the first node is untrainable.
 
@@ -120,6 +120,37 @@ def test_ParallelHistogramNode_fraction():
         node.join(forked_node)
     assert len(node.data_hist) < 1000
 
+def test_ParallelHistogramNode_reservoir():
+    """Test HistogramNode with a fixed reservoir size."""
+    node = parallel.ParallelHistogramNode(reservoir_size=100)
+    x1 = numx.random.random((1000, 3))
+    x2 = numx.random.random((500, 3)) + 1
+    x3 = numx.random.random((50, 3)) + 2
+    for chunk in [x1, x2, x3]:
+        forked_node = node.fork()
+        forked_node.train(chunk)
+        node.join(forked_node)
+    assert node.data_hist.shape == (100, 3)
+    assert node._hist_len == 1550
+    x = numx.concatenate([x1, x2, x3])
+    assert set(node.data_hist[:,0]) <= set(x[:,0])
+
+def test_ParallelAdaptiveCutoffNode_sketch():
+    """Test AdaptiveCutoffNode with merged quantile sketches."""
+    eps = 0.01
+    node = parallel.ParallelAdaptiveCutoffNode(lower_cutoff_fraction=0.1,
+                                               upper_cutoff_fraction=0.1,
+                                               quantile_eps=eps)
+    x = numx.random.random((40000, 2))
+    for i in range(0, 40000, 4000):
+        forked_node = node.fork()
+        forked_node.train(x[i:i+4000])
+        node.join(forked_node)
+    node.stop_training()
+    assert node._sketch.get_tlen() == 40000
+    assert numx.all(abs(node.lower_bounds - 0.1) < 2*eps)
+    assert numx.all(abs(node.upper_bounds - 0.9) < 2*eps)
+
 
 class TestDerivedParallelMDPNodes(object):
     """Test derived nodes that use the parallel node classes."""
@@ -1,4 +1,5 @@
 from __future__ import with_statement
+import os
 from _tools import *
 
 import mdp.parallel as parallel
@@ -54,6 +55,23 @@ def test_process_scheduler_manager():
     results = n.array(results)
     assert n.all(results == n.array([0,1,4,9,16,25,36,49]))
 
+def test_process_scheduler_no_polling():
+    """Test that short tasks are not delayed by waiting for the processes."""
+    finished = []
+    def result_callback(result, task_index):
+        finished.append(task_index)
+    with parallel.ProcessScheduler(n_processes=2,
+                                   source_paths=None) as scheduler:
+        scheduler.set_result_callback(result_callback)
+        start_time = time.time()
+        for i in xrange(100):
+            scheduler.add_task(i, parallel.SqrTestCallable())
+        results = scheduler.get_results()
+        # with a polling interval of 0.1 seconds this would take 5 seconds
+        assert time.time() - start_time < 2
+    assert n.all(n.array(results) == n.arange(100)**2)
+    assert sorted(finished) == range(1, 101)
+
 def test_process_scheduler_flow():
     """Test process scheduler with real Nodes."""
     precision = 6
@@ -83,6 +101,40 @@ def test_process_scheduler_flow():
     y2 = parallel_flow.execute(x)
     assert_array_almost_equal(abs(y1), abs(y2), precision)
 
+def test_process_scheduler_sticky():
+    """Test sticky flow training with the process scheduler."""
+    flow = mdp.parallel.ParallelFlow([mdp.nodes.PCANode(output_dim=5),
+                                      mdp.nodes.SFANode(output_dim=3)])
+    parallel_flow = mdp.parallel.ParallelFlow(flow.copy()[:])
+    # chunks above SHARED_MEMORY_MIN_BYTES, so they use the shared buffers
+    train_iterables = [[n.random.random((1000, 10)) for _ in xrange(8)]
+                       for _ in xrange(2)]
+    with parallel.ProcessScheduler(verbose=False,
+                                   n_processes=3,
+                                   source_paths=None) as scheduler:
+        parallel_flow.train(train_iterables, scheduler=scheduler,
+                            sticky=True)
+    flow.train(train_iterables)
+    assert parallel_flow[0].tlen == flow[0].tlen == 8000
+    assert parallel_flow[1].tlen == flow[1].tlen
+    x = n.random.random((10, 10))
+    assert_array_almost_equal(abs(flow.execute(x)),
+                              abs(parallel_flow.execute(x)), 6)
+
+def test_process_scheduler_sticky_data():
+    """Test that the resident flownodes keep their own copy of the data."""
+    train_iterables = [[n.random.random((1000, 10)) for _ in xrange(8)]]
+    flow = mdp.parallel.ParallelFlow([mdp.nodes.HistogramNode()])
+    with parallel.ProcessScheduler(verbose=False,
+                                   n_processes=3,
+                                   source_paths=None) as scheduler:
+        flow.train(train_iterables, scheduler=scheduler, sticky=True)
+    expected = n.concatenate(train_iterables[0])
+    data_hist = flow[0].data_hist
+    assert data_hist.shape == expected.shape
+    # the order of the chunks depends on the workers
+    assert_array_equal(n.sort(data_hist, axis=0), n.sort(expected, axis=0))
+
 def test_process_scheduler_mdp_version():
     """Test that we are running the same mdp in subprocesses"""
     scheduler = parallel.ProcessScheduler(verbose=False,
@@ -96,3 +148,157 @@ def test_process_scheduler_mdp_version():
     # check that we get 2 identical dictionaries
     assert out[0] == out[1], 'Subprocesses did not run '\
         'the same MDP as the parent:\n%s\n--\n%s'%(out[0], out[1])
+
+def test_process_scheduler_shared_memory():
+    """Test process scheduler with arrays passed in shared memory."""
+    process_schedule = sys.modules["mdp.parallel.process_schedule"]
+    min_size = process_schedule.SHARED_MEMORY_MIN_BYTES // 8
+    x = mdp.numx_rand.random((4, min_size))
+    for shared_memory in [True, False]:
+        with parallel.ProcessScheduler(n_processes=2,
+                                       source_paths=None,
+                                       shared_memory=shared_memory) \
+                as scheduler:
+            # the cached callable must not be overwritten by the task data
+            scheduler.add_task(x, parallel.SqrTestCallable())
+            for i in xrange(1, 6):
+                scheduler.add_task(x + i)
+            results = scheduler.get_results()
+        for i, result in enumerate(results):
+            assert_array_almost_equal(result, (x + i)**2)
+
+def test_shared_buffer():
+    """Test the pickling of arrays via shared memory buffers."""
+    import cStringIO
+    process_schedule = sys.modules["mdp.parallel.process_schedule"]
+    min_size = process_schedule.SHARED_MEMORY_MIN_BYTES // 8
+    large = mdp.numx_rand.random((3, min_size))
+    small = n.arange(10)
+    shared_buffer = process_schedule._SharedBuffer()
+    buffers = {}
+    try:
+        for i in range(2):
+            # the second time the buffer has to grow
+            large = n.concatenate((large, large))
+            pickled = cStringIO.StringIO()
+            shared_buffer.dump((large, small, large.T), pickled)
+            # only the handles of the large arrays are pickled
+            assert len(pickled.getvalue()) < large.nbytes // 10
+            result = process_schedule._load(
+                            cStringIO.StringIO(pickled.getvalue()), buffers)
+            assert_array_equal(result[0], large)
+            assert_array_equal(result[1], small)
+            assert_array_equal(result[2], large.T)
+        # the arrays are copied unless zero copy was requested
+        pickled = cStringIO.StringIO()
+        shared_buffer.dump(large, pickled, copy=False)
+        view = process_schedule._load(cStringIO.StringIO(pickled.getvalue()),
+                                      buffers)
+        shared_buffer.dump(large + 1, cStringIO.StringIO())
+        assert_array_equal(result[0], large)
+        assert_array_equal(view, large + 1)
+    finally:
+        shared_buffer.close()
+        for reading_buffer in buffers.values():
+            reading_buffer.close()
+    assert not os.path.exists(shared_buffer.path)
+
+def test_process_scheduler_crash_cleanup():
+    """Test that the shared memory files are removed after a crash."""
+    if not hasattr(os, "kill"):
+        py.test.skip("os.kill is not available")
+    import signal
+    process_schedule = sys.modules["mdp.parallel.process_schedule"]
+    x = mdp.numx_rand.random((2, process_schedule.SHARED_MEMORY_MIN_BYTES))
+    with parallel.ProcessScheduler(n_processes=2,
+                                   source_paths=None) as scheduler:
+        scheduler.add_task(x, parallel.SqrTestCallable())
+        scheduler.get_results()
+        paths = []
+        for process in scheduler._processes:
+            paths += [process._task_buffer.path,
+                      process._callable_buffer.path]
+            paths += process._result_buffers.keys()
+            os.kill(process.pid, signal.SIGKILL)
+            process.wait()
+        assert all(os.path.exists(path) for path in paths)
+    assert not any(os.path.exists(path) for path in paths)
+
+def test_fork_scheduler():
+    """Test fork scheduler with changing callables."""
+    if not hasattr(os, "fork"):
+        py.test.skip("os.fork is not available")
+    with parallel.ForkScheduler(n_processes=2) as scheduler:
+        # the processes are only forked for the first task
+        assert not scheduler._processes
+        for i in xrange(6):
+            scheduler.add_task(i, parallel.SqrTestCallable())
+        results = scheduler.get_results()
+        assert n.all(n.array(results) == n.arange(6)**2)
+        scheduler.add_task((n.arange(2), 0.2),
+                           parallel.SleepSqrTestCallable())
+        # new callable while a task is open, it is sent to the processes
+        scheduler.add_task(3, parallel.SqrTestCallable())
+        results = scheduler.get_results()
+        assert n.all(results[0] == n.arange(2)**2)
+        assert results[1] == 9
+        # no open task, the processes are forked with the new callable
+        scheduler.set_task_callable(parallel.SqrTestCallable())
+        scheduler.add_task(4)
+        assert (scheduler._fork_callable_index ==
+                scheduler._last_callable_index)
+        assert scheduler.get_results() == (16,)
+
+class _LightSqrTestCallable(parallel.SqrTestCallable):
+    """Callable for testing which is sent instead of forking."""
+
+    light = True
+
+def test_fork_scheduler_light_callable():
+    """Test that the fork scheduler does not fork again for light callables.
+    """
+    if not hasattr(os, "fork"):
+        py.test.skip("os.fork is not available")
+    with parallel.ForkScheduler(n_processes=2) as scheduler:
+        scheduler.add_task(2, parallel.SqrTestCallable())
+        assert scheduler.get_results() == (4,)
+        processes = list(scheduler._processes)
+        scheduler.add_task(3, _LightSqrTestCallable())
+        scheduler.add_task(4)
+        assert scheduler.get_results() == (9, 16)
+        assert scheduler._processes == processes
+        assert (scheduler._fork_callable_index <
+                scheduler._last_callable_index)
+
+class _ThreadMapSqrTestCallable(parallel.TaskCallable):
+    """Callable for testing which squares the data with thread_map."""
+
+    def __call__(self, data):
+        """Return the squared data entries."""
+        return mdp.utils.thread_map(lambda x: x**2, data, n_threads=2)
+
+def test_fork_scheduler_thread_pools():
+    """Test that the forked processes do not use inherited thread pools."""
+    if not hasattr(os, "fork"):
+        py.test.skip("os.fork is not available")
+    # create the pool before the fork, its threads do not exist in the fork
+    assert mdp.utils.thread_map(abs, [-1, -2], n_threads=2) == [1, 2]
+    with parallel.ForkScheduler(n_processes=2) as scheduler:
+        for i in xrange(2):
+            scheduler.add_task([i, i+1], _ThreadMapSqrTestCallable())
+        results = scheduler.get_results()
+    assert list(results) == [[0, 1], [1, 4]]
+
+def test_fork_scheduler_flow():
+    """Test fork scheduler with real Nodes."""
+    if not hasattr(os, "fork"):
+        py.test.skip("os.fork is not available")
+    flow = mdp.parallel.ParallelFlow([mdp.nodes.PCANode(output_dim=5),
+                                      mdp.nodes.SFANode(output_dim=3)])
+    parallel_flow = mdp.parallel.ParallelFlow(flow.copy()[:])
+    x = mdp.numx_rand.random((5, 100, 10))
+    with parallel.ForkScheduler(n_processes=3) as scheduler:
+        parallel_flow.train([x, x], scheduler=scheduler)
+        y = parallel_flow.execute(list(x), scheduler=scheduler)
+    flow.train([x, x])
+    assert_array_almost_equal(abs(flow.execute(x[0])), abs(y[:100]), 6)
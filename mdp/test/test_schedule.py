@@ -43,12 +43,98 @@ def _process_task(self, data, task_callable, task_index):
         pass
     assert log == ["shutdown"]
 
+def test_scheduler_result_callback():
+    """Test the result callback for different schedulers."""
+    for scheduler in [parallel.Scheduler(),
+                      parallel.ThreadScheduler(n_threads=3)]:
+        finished = []
+        def result_callback(result, task_index):
+            finished.append((task_index, result))
+        scheduler.set_result_callback(result_callback)
+        for i in xrange(6):
+            scheduler.add_task(i, parallel.SqrTestCallable())
+        results = scheduler.get_results()
+        scheduler.shutdown()
+        assert n.all(n.array(results) == n.array([0,1,4,9,16,25]))
+        assert sorted(finished) == [(i+1, i**2) for i in xrange(6)]
+
+def test_thread_scheduler_no_polling():
+    """Test that short tasks are not delayed by waiting for the threads."""
+    scheduler = parallel.ThreadScheduler(n_threads=2)
+    start_time = time.time()
+    for i in xrange(100):
+        scheduler.add_task(i, parallel.SqrTestCallable())
+    results = scheduler.get_results()
+    scheduler.shutdown()
+    assert len(results) == 100
+    # with a polling interval of 0.1 seconds this would take about 5 seconds
+    assert time.time() - start_time < 2
+
+def test_thread_scheduler_failure():
+    """Test that failed tasks are stored as TaskFailure."""
+    scheduler = parallel.ThreadScheduler(n_threads=2)
+    scheduler.add_task("a", parallel.SqrTestCallable())
+    scheduler.add_task(3)
+    results = scheduler.get_results()
+    scheduler.shutdown()
+    assert isinstance(results[0], parallel.TaskFailure)
+    assert results[0].task_index == 1
+    assert "TypeError" in results[0].message
+    assert results[1] == 9
+
+class _FailingResultContainer(parallel.ListResultContainer):
+    """Result container which cannot store any results."""
+
+    def add_result(self, result, task_index):
+        raise Exception("the result could not be stored")
+
+def test_scheduler_result_container_failure():
+    """Test that a failing result container does not block the scheduler."""
+    scheduler = parallel.Scheduler(
+                                result_container=_FailingResultContainer())
+    py.test.raises(Exception, scheduler.add_task, 1,
+                   parallel.SqrTestCallable())
+    assert scheduler.n_open_tasks == 0
+    assert scheduler.get_results() == []
+    scheduler.shutdown()
+
 def test_cpu_count():
     """Test the cpu_count helper function."""
     n_cpus = parallel.cpu_count()
     assert isinstance(n_cpus, int)
 
 
+class _CopyCountCallable(parallel.TaskCallable):
+    """Callable which counts how often it has been copied."""
+
+    n_copies = 0
+
+    def __setstate__(self, state):
+        _CopyCountCallable.n_copies += 1
+        self.__dict__.update(state)
+
+    def __call__(self, data):
+        return data**2
+
+def test_thread_scheduler_callable_cache():
+    """Test that each thread copies the callable only once."""
+    _CopyCountCallable.n_copies = 0
+    scheduler = parallel.ThreadScheduler(n_threads=2, copy_callable=True)
+    scheduler.add_task(0, _CopyCountCallable())
+    for i in xrange(1, 10):
+        scheduler.add_task(i)
+    results = scheduler.get_results()
+    assert n.all(n.array(results) == n.arange(10)**2)
+    assert 1 <= _CopyCountCallable.n_copies <= 2
+    # a new callable is copied again
+    _CopyCountCallable.n_copies = 0
+    scheduler.set_task_callable(_CopyCountCallable())
+    for i in xrange(10):
+        scheduler.add_task(i)
+    scheduler.get_results()
+    scheduler.shutdown()
+    assert 1 <= _CopyCountCallable.n_copies <= 2
+
 def test_thread_scheduler_flow():
     """Test thread scheduler with real Nodes."""
     precision = 6
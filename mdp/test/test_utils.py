@@ -150,3 +150,35 @@ def test_nongeneral_svd_bug():
     diag = numx.diagonal(utils.mult(utils.hermitian(z),
                                     utils.mult(a, z))).real
     assert_array_almost_equal(diag, w, 12)
+
+def test_ClassStatistics():
+    x = numx_rand.random((200, 4))
+    labels = numx_rand.randint(3, size=200)
+    stats = utils.ClassStatistics(second_moments=True)
+    stats.update(x[:120], labels[:120])
+    # merge the statistics of the rest of the data
+    stats2 = utils.ClassStatistics(second_moments=True)
+    stats2.update(x[120:150], list(labels[120:150]))
+    stats2.update(x[150:], 2)
+    stats.merge(stats2)
+    labels[150:] = 2
+    covs = stats.get_covariances()
+    means = stats.get_means()
+    counts = stats.get_counts()
+    for code, label in enumerate(stats.labels):
+        x_label = x[labels == label]
+        assert counts[code] == len(x_label)
+        assert_array_almost_equal(means[code], x_label.mean(axis=0))
+        assert_array_almost_equal(covs[code], numx.cov(x_label, rowvar=0))
+    assert_array_equal(stats.encode(labels[:10], add=False),
+                       [stats.labels.index(label) for label in labels[:10]])
+    py.test.raises(KeyError, stats.encode, [5], add=False)
+
+def test_thread_map():
+    inner = lambda i: [i*j for j in range(3)]
+    # the nested calls run in the pool threads and must not block
+    results = utils.thread_map(lambda i: utils.thread_map(inner, range(i), 2),
+                               range(5), 2)
+    assert results == [[inner(j) for j in range(i)] for i in range(5)]
+    py.test.raises(ZeroDivisionError, utils.thread_map,
+                   lambda i: 1 // i, range(3), 2)
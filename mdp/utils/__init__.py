@@ -7,7 +7,8 @@
                       lrep, rrep, irep, orthogonal_permutations,
                       izip_stretched,
                       weighted_choice, bool_to_sign, sign_to_bool, gabor,
-                      invert_exp_funcs2)
+                      invert_exp_funcs2, as_strided,
+                      thread_map, _reset_thread_pools)
 try:
     from collections import OrderedDict
 except ImportError:
@@ -23,6 +24,8 @@
 from quad_forms import QuadraticForm, QuadraticFormException
 from covariance import (CovarianceMatrix, DelayCovarianceMatrix,
                         MultipleCovarianceMatrices,CrossCovarianceMatrix)
+from quantile_sketch import QuantileSketch
+from class_statistics import ClassStatistics
 from progress_bar import progressinfo
 from slideshow import (basic_css, slideshow_css, HTMLSlideShow,
                        image_slideshow_css, ImageHTMLSlideShow,
@@ -80,6 +83,7 @@ def svd(x, compute_uv = True):
 
 __all__ = ['CovarianceMatrix', 'DelayCovarianceMatrix','CrossCovarianceMatrix',
            'MultipleCovarianceMatrices', 'QuadraticForm',
+           'QuantileSketch', 'ClassStatistics',
            'QuadraticFormException',
            'comb', 'cov2', 'dig_node', 'get_dtypes', 'get_node_size',
            'hermitian', 'inv', 'mult', 'mult_diag', 'nongeneral_svd',
@@ -93,7 +97,8 @@ def svd(x, compute_uv = True):
            'lrep', 'rrep', 'irep',
            'orthogonal_permutations', 'izip_stretched',
            'weighted_choice', 'bool_to_sign', 'sign_to_bool',
-           'OrderedDict', 'TemporaryDirectory', 'gabor', 'fixup_namespace']
+           'OrderedDict', 'TemporaryDirectory', 'gabor', 'fixup_namespace',
+           'as_strided', 'thread_map']
 
 def _without_prefix(name, prefix):
     if name.startswith(prefix):
@@ -203,6 +208,8 @@ def _fixup_namespace_item(parent, mname, name, old_modules, path):
                  'introspection',
                  'quad_forms',
                  'covariance',
+                 'quantile_sketch',
+                 'class_statistics',
                  'progress_bar',
                  'slideshow',
                  '_ordered_dict',
@@ -0,0 +1,157 @@
+import mdp
+
+# import numeric module (scipy, Numeric or numarray)
+numx = mdp.numx
+
+class ClassStatistics(object):
+    """This class accumulates, for each class label, the number of
+    observations, their sum and optionally the matrix of their second
+    moments.
+
+    The labels are mapped to integer codes the first time they are seen
+    (the codes follow the order in which the labels appear), and all the
+    statistics are stored in arrays indexed by code. An update sorts the
+    observations by class once and computes the per-class sums with a
+    single 'add.reduceat' and the second moments with one matrix product
+    per class, instead of masking the data once for every label.
+
+    Statistics of different parts of the data can be combined with 'merge',
+    e.g. to join the results of parallel training.
+    """
+
+    def __init__(self, dtype=None, second_moments=False):
+        """If 'second_moments' is true the uncentered scatter matrix of each
+        class is accumulated as well (this needs memory quadratic in the
+        input dimension for each class).
+        """
+        if dtype is not None:
+            dtype = numx.dtype(dtype)
+        self._dtype = dtype
+        self.second_moments = second_moments
+        # labels in the order of their codes
+        self.labels = []
+        # dictionary mapping the labels to their codes
+        self._codes = {}
+        # number of observations, sums and second moments of each class
+        self._counts = None
+        self._sums = None
+        self._moments = None
+
+    def encode(self, labels, add=True):
+        """Return an array with the integer codes of the labels.
+
+        Labels seen for the first time get a new code, unless 'add' is
+        false, in which case a KeyError is raised.
+        """
+        uniq, inverse = numx.unique(numx.asarray(labels),
+                                    return_inverse=True)
+        codes = numx.empty(len(uniq), dtype='l')
+        for i, label in enumerate(uniq):
+            code = self._codes.get(label)
+            if code is None:
+                if not add:
+                    raise KeyError(label)
+                code = len(self.labels)
+                self._codes[label] = code
+                self.labels.append(label)
+            codes[i] = code
+        return codes[inverse]
+
+    def _grow(self, dim):
+        """Make room for the statistics of newly added labels."""
+        n_labels = len(self.labels)
+        if self._counts is None:
+            self._counts = numx.zeros((n_labels,), dtype='l')
+            self._sums = numx.zeros((n_labels, dim), dtype=self._dtype)
+            if self.second_moments:
+                self._moments = numx.zeros((n_labels, dim, dim),
+                                           dtype=self._dtype)
+            return
+        missing = n_labels - len(self._counts)
+        if missing > 0:
+            self._counts = numx.concatenate((self._counts,
+                                             numx.zeros((missing,), 'l')))
+            self._sums = numx.concatenate(
+                    (self._sums, numx.zeros((missing, dim), self._dtype)))
+            if self.second_moments:
+                self._moments = numx.concatenate(
+                        (self._moments,
+                         numx.zeros((missing, dim, dim), self._dtype)))
+
+    def update(self, x, labels):
+        """Add the observations in x (one observation per row).
+
+        'labels' is either a sequence with the label of each observation or
+        a single label for all of them.
+        """
+        if self._dtype is None:
+            self._dtype = x.dtype
+        x = mdp.utils.refcast(x, self._dtype)
+        if isinstance(labels, (list, tuple, numx.ndarray)):
+            codes = self.encode(labels)
+            if len(codes) != x.shape[0]:
+                err = ("The number of labels (%d) does not match the number "
+                       "of observations (%d)." % (len(codes), x.shape[0]))
+                raise mdp.MDPException(err)
+        else:
+            codes = self.encode([labels])
+            self._grow(x.shape[1])
+            code = codes[0]
+            self._counts[code] += x.shape[0]
+            self._sums[code] += x.sum(axis=0)
+            if self.second_moments:
+                self._moments[code] += mdp.utils.mult(x.T, x)
+            return
+        self._grow(x.shape[1])
+        if not len(codes):
+            return
+        # sort the observations by class, so that each class is a
+        # contiguous block of rows
+        order = codes.argsort(kind='mergesort')
+        codes = codes[order]
+        x = x[order]
+        starts = numx.flatnonzero(numx.concatenate(([True],
+                                                    codes[1:] != codes[:-1])))
+        bounds = numx.concatenate((starts, [len(codes)]))
+        present = codes[starts]
+        self._counts[present] += numx.diff(bounds)
+        self._sums[present] += numx.add.reduceat(x, starts, axis=0)
+        if self.second_moments:
+            for code, start, stop in zip(present, bounds[:-1], bounds[1:]):
+                x_class = x[start:stop]
+                self._moments[code] += mdp.utils.mult(x_class.T, x_class)
+
+    def merge(self, stats):
+        """Add all the observations of another ClassStatistics object."""
+        if stats._counts is None:
+            return
+        if self._dtype is None:
+            self._dtype = stats._dtype
+        codes = self.encode(stats.labels)
+        self._grow(stats._sums.shape[1])
+        self._counts[codes] += stats._counts
+        self._sums[codes] += stats._sums
+        if self.second_moments:
+            self._moments[codes] += stats._moments
+
+    def get_counts(self):
+        """Return the number of observations of each class (by code)."""
+        return self._counts.copy()
+
+    def get_means(self):
+        """Return the mean of each class (by code) as a 2D array."""
+        return self._sums / self._counts[:, numx.newaxis].astype(self._dtype)
+
+    def get_covariances(self, bias=False):
+        """Return the covariance matrix of each class (by code) as a 3D
+        array, computed like in CovarianceMatrix."""
+        if not self.second_moments:
+            err = "The second moments have not been accumulated."
+            raise mdp.MDPException(err)
+        tlens = self._counts[:, numx.newaxis, numx.newaxis]
+        tlens = tlens.astype(self._dtype)
+        outer = (self._sums[:, :, numx.newaxis] *
+                 self._sums[:, numx.newaxis, :])
+        if bias:
+            return self._moments / tlens - outer / (tlens * tlens)
+        return self._moments / (tlens - 1) - outer / (tlens * (tlens - 1))
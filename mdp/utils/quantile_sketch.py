@@ -0,0 +1,111 @@
+import mdp
+
+# import numeric module (scipy, Numeric or numarray)
+numx = mdp.numx
+numx_rand = mdp.numx_rand
+
+class QuantileSketch(object):
+    """This class stores a mergeable sketch of the quantiles of each column
+    of a data stream. The memory needed by the sketch depends only on the
+    requested accuracy, not on the number of observations.
+
+    The sketch is a KLL sketch (Karnin, Lang and Liberty, "Optimal Quantile
+    Approximation in Streams", 2016). The observations are stored in levels,
+    an item at level h represents 2**h observations. When a level is full
+    its items are sorted and every second item is promoted to the next
+    level. Since all the columns see the same number of observations, the
+    columns share the levels and are compacted at the same time.
+
+    Sketches of different parts of the data can be combined with 'merge',
+    e.g. to join the results of parallel training. The quantiles of the
+    merged sketch have the same error bound as the ones of a single
+    sketch of all the data.
+    """
+
+    def __init__(self, eps=0.01):
+        """'eps' is the approximate rank error of the quantiles, as a
+        fraction of the number of observations.
+        """
+        self.eps = eps
+        # capacity of the top level
+        self.k = int(numx.ceil(3./eps))
+        # list of 2D arrays, the items at level h have weight 2**h
+        self._levels = []
+        # number of observations so far
+        self._tlen = 0
+
+    def _capacity(self, level):
+        """Return the capacity of the given level."""
+        depth = len(self._levels) - level - 1
+        return max(2, int(numx.ceil(self.k * (2./3)**depth)))
+
+    def _compress(self):
+        """Compact the levels which exceed their capacity."""
+        levels = self._levels
+        level = 0
+        while level < len(levels):
+            items = levels[level]
+            if len(items) > self._capacity(level):
+                if level == len(levels) - 1:
+                    levels.append(items[:0])
+                # with an odd number of items, leave the last one behind
+                keep = len(items) % 2
+                promoted = numx.sort(items[:len(items)-keep], axis=0)
+                promoted = promoted[numx_rand.randint(2)::2]
+                levels[level] = items[len(items)-keep:]
+                levels[level+1] = numx.concatenate((levels[level+1],
+                                                    promoted))
+            level += 1
+
+    def update(self, x):
+        """Add the observations in x (one observation per row)."""
+        if not self._levels:
+            self._levels = [x.copy()]
+        else:
+            self._levels[0] = numx.concatenate((self._levels[0], x))
+        self._tlen += x.shape[0]
+        self._compress()
+
+    def merge(self, sketch):
+        """Add all the observations of another sketch to this one."""
+        if not sketch._levels:
+            return
+        if not self._levels:
+            self._levels = [items.copy() for items in sketch._levels]
+        else:
+            for level, items in enumerate(sketch._levels):
+                if level < len(self._levels):
+                    self._levels[level] = numx.concatenate(
+                                                (self._levels[level], items))
+                else:
+                    self._levels.append(items.copy())
+        self._tlen += sketch._tlen
+        self._compress()
+
+    def quantile(self, q):
+        """Return the approximate q-quantile of each column.
+
+        This is the observation with rank floor(q*tlen) in the sorted data,
+        which is exact as long as no compaction has been performed.
+        """
+        if not self._levels:
+            err = "The sketch does not contain any observation."
+            raise mdp.MDPException(err)
+        items = numx.concatenate(self._levels)
+        weights = numx.concatenate([numx.zeros(len(items_))+2**level
+                                    for level, items_
+                                    in enumerate(self._levels)])
+        cols = numx.arange(items.shape[1])
+        order = items.argsort(axis=0, kind='mergesort')
+        cum_weights = weights[order].cumsum(axis=0)
+        index = (cum_weights <= q * self._tlen).sum(axis=0)
+        index = numx.minimum(index, len(items)-1)
+        return items[order[index, cols], cols]
+
+    def get_tlen(self):
+        """Return the number of observations."""
+        return self._tlen
+
+    def get_size(self):
+        """Return the number of stored items per column."""
+        return sum(len(items) for items in self._levels)
@@ -1,3 +1,4 @@
+from __future__ import with_statement
 import mdp
 
 # import numeric module (scipy, Numeric or numarray)
@@ -5,6 +6,68 @@
 numx_description = mdp.numx_description
 import random
 import itertools
+import threading
+from multiprocessing.pool import ThreadPool
+
+class _StridedArrayInterface(object):
+    """Array interface of a view with a custom shape and strides."""
+
+    def __init__(self, array, shape, strides):
+        interface = dict(array.__array_interface__)
+        interface['shape'] = tuple(shape)
+        interface['strides'] = tuple(strides)
+        self.__array_interface__ = interface
+        # keep the memory alive as long as the view
+        self.base = array
+
+def as_strided(x, shape, strides):
+    """Return a view on the memory of x with the given shape and strides.
+
+    Like numpy.lib.stride_tricks.as_strided no checks are done, so the
+    view must stay within the memory of x. Writing to a view in which
+    elements overlap gives surprising results.
+    """
+    return numx.asarray(_StridedArrayInterface(x, shape, strides))
+
+# thread pools shared by all the callers of thread_map, one per size
+_THREAD_POOLS = {}
+_THREAD_POOLS_LOCK = threading.Lock()
+# marks the threads of the pools, to run nested calls serially
+_THREAD_POOL_STATE = threading.local()
+
+def _reset_thread_pools():
+    """Forget the thread pools, e.g. in a forked process.
+
+    The threads of the pools do not exist in a forked process, so using an
+    inherited pool would block forever (the lock might be inherited in
+    the locked state as well).
+    """
+    global _THREAD_POOLS, _THREAD_POOLS_LOCK
+    _THREAD_POOLS = {}
+    _THREAD_POOLS_LOCK = threading.Lock()
+
+def _thread_pool_task(args):
+    func, item = args
+    _THREAD_POOL_STATE.in_pool = True
+    return func(item)
+
+def thread_map(func, items, n_threads):
+    """Apply func to each item with n_threads threads, return the results.
+
+    The thread pools are created once and shared by all calls, so this is
+    cheap enough to be used on every execute call. A call from inside one
+    of the pool threads (e.g. from a node nested in a threaded layer) runs
+    serially, since it could otherwise wait for its own pool forever.
+    """
+    items = list(items)
+    if (n_threads <= 1 or len(items) <= 1 or
+        getattr(_THREAD_POOL_STATE, 'in_pool', False)):
+        return [func(item) for item in items]
+    with _THREAD_POOLS_LOCK:
+        pool = _THREAD_POOLS.get(n_threads)
+        if pool is None:
+            pool = _THREAD_POOLS[n_threads] = ThreadPool(n_threads)
+    return pool.map(_thread_pool_task, [(func, item) for item in items])
 
 def timediff(data):
     """Returns the array of the time differences of data."""